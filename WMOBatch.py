@@ -0,0 +1,154 @@
+from WMOMessage import WMOUpperAirMessage, MISSING
+import numpy as np
+
+## Unicode code points of the characters allowed in a group
+_ZERO = ord("0")
+_SLASHES = (ord("/"), ord("\\"))
+
+
+def decode_messages(messages):
+    """
+    Decode many WMOUpperAirMessages at once. The level structure of
+    each message is walked as usual, but every temperature/dewpoint
+    depression group and every dddff wind group from all of the
+    messages is gathered up and decoded with NumPy in one shot. The
+    decoded levels are cached on each message exactly as if decode()
+    had been called on it. Messages that are already decoded, or that
+    already failed to decode, are skipped.
+
+    A message that can't be decoded doesn't stop the others: it is
+    counted as a decode failure (see WMOUpperAirMessage.decode) and left
+    undecoded, the same as decoding each message on its own. Returns the
+    messages that were decoded.
+    """
+    pending = []
+    tt_levels, tt_groups, tt_owners = [], [], []
+    ww_levels, ww_groups, ww_owners = [], [], []
+    for wmo_msg in messages:
+        if wmo_msg.levels is not None or wmo_msg.decode_error is not None: continue
+        try:
+            res_dicts = wmo_msg._decode_levels(decode_groups=False)
+        except Exception as err:
+            wmo_msg._decode_failed(err)
+            continue
+        for res in res_dicts:
+            if "tt" in res:
+                tt_levels.append(res)
+                tt_groups.append(res.pop("tt"))
+                tt_owners.append(len(pending))
+            if "ww" in res:
+                ww_levels.append(res)
+                ww_groups.append(res.pop("ww"))
+                ww_owners.append(len(pending))
+        pending.append((wmo_msg, res_dicts))
+
+    tt_failed, ww_failed = [], []
+    tmpc, dwpc = decode_temp_groups(tt_groups, failed=tt_failed)
+    for res, t, td in zip(tt_levels, tmpc.tolist(), dwpc.tolist()):
+        res["tmpc"] = t
+        res["dwpc"] = td
+
+    wdir, wspd = decode_wind_groups(ww_groups, failed=ww_failed)
+    for res, d, s in zip(ww_levels, wdir.tolist(), wspd.tolist()):
+        res["wdir"] = d
+        res["wspd"] = s
+
+    ## Messages with a group that couldn't be decoded go
+    ## through decode() on their own, which reports the error
+    broken = set(tt_owners[idx] for idx in tt_failed) | set(ww_owners[idx] for idx in ww_failed)
+    decoded = []
+    for idx, (wmo_msg, res_dicts) in enumerate(pending):
+        if idx in broken:
+            try:
+                wmo_msg.decode()
+            except Exception:
+                continue
+        else:
+            wmo_msg.levels = wmo_msg._to_columns(res_dicts)
+        decoded.append(wmo_msg)
+    return decoded
+
+
+def decode_temp_groups(groups, failed=None):
+    """
+    Decode a sequence of TTTDD temperature/dewpoint depression groups
+    and return arrays of temperature and dewpoint in C, with MISSING
+    where the group is missing. This applies the same rules as
+    WMOUpperAirMessage._get_t_and_td_from_rpt: an odd tenths digit means
+    the temperature is negative, and dewpoint depressions above 55 are
+    whole degrees offset by 50.
+
+    A group the scalar decoder can't make sense of raises its error,
+    unless failed is a list, in which case its index is appended to it
+    and it is decoded as missing.
+    """
+    digits, is_slash, valid = _pack_groups(groups)
+
+    t_ok = valid & ~is_slash[:, :3].any(axis=1)
+    tval = digits[:, 0] * 100 + digits[:, 1] * 10 + digits[:, 2]
+    tmpc = tval / 10.0
+    tmpc = np.where(tval % 2 == 1, -tmpc, tmpc)
+    tmpc = np.where(t_ok, tmpc, MISSING)
+
+    dd_ok = valid & ~is_slash[:, 3:].any(axis=1)
+    ddval = (digits[:, 3] * 10 + digits[:, 4]).astype(np.float64)
+    dewpoint_depression = np.where(ddval <= 55.0, ddval * .1, ddval - 50.0)
+    dwpc = np.where(t_ok & dd_ok, tmpc - dewpoint_depression, MISSING)
+
+    ## Anything that isn't a plain 5 character group goes
+    ## through the scalar decoder so the results match exactly
+    _scalar_fallback(groups, valid, WMOUpperAirMessage._get_t_and_td_from_rpt, tmpc, dwpc, failed)
+    return tmpc, dwpc
+
+
+def decode_wind_groups(groups, failed=None):
+    """
+    Decode a sequence of dddff wind groups and return arrays of wind
+    direction and speed, with MISSING where the group is missing. As in
+    WMOUpperAirMessage._get_spd_and_dir_from_rpt, the units digit of the
+    direction (wdir % 5) carries the hundreds of knots of the speed.
+    Groups that can't be decoded are handled as in decode_temp_groups.
+    """
+    digits, is_slash, valid = _pack_groups(groups)
+
+    ok = valid & ~is_slash.any(axis=1)
+    wdir = (digits[:, 0] * 100 + digits[:, 1] * 10 + digits[:, 2]).astype(np.float64)
+    wspd = (digits[:, 3] * 10 + digits[:, 4]) + (wdir % 5) * 100.0
+    wdir = np.where(ok, wdir, MISSING)
+    wspd = np.where(ok, wspd, MISSING)
+
+    _scalar_fallback(groups, valid, WMOUpperAirMessage._get_spd_and_dir_from_rpt, wdir, wspd, failed)
+    return wdir, wspd
+
+
+def _pack_groups(groups):
+    """
+    Pack a sequence of report groups into a fixed width (n, 5) array
+    of digit values. Returns the digits, a mask of the '/' (or '\\')
+    characters, and a mask of the rows that are plain 5 character
+    groups made up of only digits and slashes.
+    """
+    n = len(groups)
+    lengths = np.fromiter(map(len, groups), dtype=np.intp, count=n)
+
+    ## A fixed width unicode array viewed as integers gives the
+    ## code point of every character without encoding each group.
+    ## Use 6 characters so anything longer than 5 is easy to spot.
+    codes = np.array(groups, dtype="U6").view(np.uint32).reshape(n, 6)[:, :5]
+    codes = codes.astype(np.int64)
+    digits = codes - _ZERO
+    is_digit = (digits >= 0) & (digits <= 9)
+    is_slash = (codes == _SLASHES[0]) | (codes == _SLASHES[1])
+    valid = (lengths == 5) & (is_digit | is_slash).all(axis=1)
+    digits = np.where(is_digit, digits, 0)
+    return digits, is_slash, valid
+
+
+def _scalar_fallback(groups, valid, decoder, out1, out2, failed=None):
+    for idx in np.flatnonzero(~valid).tolist():
+        try:
+            out1[idx], out2[idx] = decoder(groups[idx])
+        except Exception:
+            if failed is None: raise
+            out1[idx] = out2[idx] = MISSING
+            failed.append(idx)
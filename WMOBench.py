@@ -0,0 +1,423 @@
+from WMOParser import WMOReader
+from WMOMessage import DECODER_VERSION
+from WMOStations import get_station_table
+from WMOBatch import decode_messages
+from WMOTokenizer import tokenize, tokenize_buffer
+import numpy as np
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+## Bulletins bundled with the repository
+BUNDLED_FILES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                 for name in ["test.wmo", "20220714_00Z_KLWX.uair"]]
+
+## Stations reporting at one synoptic time at scale 1, about
+## the same as test.wmo, and the synoptic times to spread them over.
+BASE_STATIONS = 187
+SYNOPTIC_TIMES = ["%02d%02d00" % (day, hour) for day in range(1, 29) for hour in (0, 6, 12, 18)]
+
+## WMO heading prefix (TTAAii) of the bulletins of each message type
+HEADING_PREFIX = {"TTAA": "US", "TTBB": "UK", "PPBB": "UG", "TTCC": "UL", "TTDD": "UE", "PPDD": "UQ"}
+MESSAGE_TYPES = ["TTAA", "TTBB", "PPBB", "TTCC", "TTDD", "PPDD"]
+
+## Mandatory levels and the units (m) their heights are encoded in
+MAND_TTAA = [(1000, 1), (925, 1), (850, 1), (700, 1), (500, 10), (400, 10), (300, 10),
+             (250, 10), (200, 10), (150, 10), (100, 10)]
+## (like most real soundings, these stop at 10 hPa)
+MAND_TTCC = [(70, 10), (50, 10), (30, 10), (20, 10), (10, 10)]
+
+## Heights (thousands of feet) of the PPBB and PPDD wind reports
+PPBB_HEIGHTS = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 12, 14, 16, 20, 25, 30, 35, 40, 45, 50]
+PPDD_HEIGHTS = [60, 65, 70, 75, 80, 85, 90]
+
+## Wall time (s) a fresh interpreter may take to import the parser and
+## read and decode a single bulletin, as when run from pqact EXEC
+COLD_START_BUDGET = 0.25
+COLD_START_FILE = BUNDLED_FILES[1]
+
+## Run in a fresh interpreter by measure_cold_start
+_COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from WMOParser import WMOReader
+imported = time.perf_counter()
+reader = WMOReader(sys.argv[1], stations_file=sys.argv[2] or None)
+reader.decode_all()
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "decode": done - imported,
+                  "modules": [name for name in ("pandas", "numpy") if name in sys.modules]}))
+"""
+
+STAGES = ["tokenize", "tokenize_buffer", "records", "decode_mand", "decode_sigt",
+          "decode_sigw", "decode_batch", "station_lookup", "assemble"]
+
+
+def generate_traffic(scale=1, seed=0, stations_file=None, nil_fraction=0.2,
+                     retransmit_fraction=0.05, per_bulletin=20):
+    """
+    Generate raw LDM upper air traffic with about scale times as many
+    soundings as test.wmo: scale * BASE_STATIONS soundings spread over the synoptic
+    times, each sent as TTAA, TTBB, PPBB, TTCC, TTDD and PPDD messages
+    grouped per_bulletin stations to a bulletin. Profiles follow a
+    standard lapse rate to a tropopause with some noise, and are encoded
+    the same way real soundings are. A nil_fraction of the stations send
+    NIL reports and a retransmit_fraction of bulletins are sent again
+    with an RRA heading. Stations come from the station table first,
+    so most of them can be looked up. Returns the text.
+    """
+    rng = random.Random(seed)
+    wmo_ids = sorted(get_station_table(stations_file).by_wmo_id.keys())
+    nsoundings = int(round(scale * BASE_STATIONS))
+    ntimes = max(1, min(len(SYNOPTIC_TIMES), int(math.ceil(scale))))
+    per_time = int(math.ceil(nsoundings / float(ntimes)))
+    extra = 10000
+    while len(wmo_ids) < per_time:
+        if str(extra) not in wmo_ids: wmo_ids.append(str(extra))
+        extra += 1
+
+    out = []
+    seq = 0
+    remaining = nsoundings
+    for time_str in SYNOPTIC_TIMES[:ntimes]:
+        stations = wmo_ids[:min(per_time, remaining)]
+        remaining -= len(stations)
+        profiles = [(wmo_id, None if rng.random() < nil_fraction else _make_profile(rng))
+                    for wmo_id in stations]
+        for msg_type in MESSAGE_TYPES:
+            for start in range(0, len(profiles), per_bulletin):
+                body = []
+                for wmo_id, profile in profiles[start:start + per_bulletin]:
+                    if profile is None: body.append("%s %s NIL=" % (msg_type, wmo_id))
+                    else: body.append(_encode(msg_type, time_str, wmo_id, profile))
+                heading = "%s%s%02d KWBC %s" % (HEADING_PREFIX[msg_type], "US", start // per_bulletin % 100, time_str)
+                out.append(_transmission(seq, heading, body))
+                seq += 1
+                if rng.random() < retransmit_fraction:
+                    out.append(_transmission(seq, heading + " RRA", body))
+                    seq += 1
+    return "".join(out)
+
+
+def _transmission(seq, heading, body):
+    lines = ["\x01", "%03d " % (seq % 1000), heading]
+    for msg in body:
+        lines += _wrap(msg)
+    return "\r\r\n".join(lines) + "\r\r\n\x03"
+
+
+def _wrap(msg, ngroups=11):
+    groups = msg.split(" ")
+    return [" ".join(groups[idx:idx + ngroups]) for idx in range(0, len(groups), ngroups)]
+
+
+def _make_profile(rng):
+    """
+    A random but plausible sounding, as functions of pressure (hPa)
+    returning height (m), temperature (C), dewpoint depression (C)
+    and wind (direction, knots).
+    """
+    psfc = rng.uniform(850.0, 1025.0)
+    tsfc = rng.uniform(-10.0, 38.0)
+    ztrop = rng.uniform(10000.0, 16500.0)
+    elev = 44330.8 * (1.0 - (psfc / 1013.25) ** 0.190263)
+    wdir0 = rng.uniform(0.0, 360.0)
+    jet = rng.uniform(40.0, 160.0)
+
+    def hght(pres):
+        ## Standard atmosphere, isothermal above 226 hPa
+        if pres >= 226.32: z = 44330.8 * (1.0 - (pres / 1013.25) ** 0.190263)
+        else: z = 11000.0 + 6341.6 * math.log(226.32 / pres)
+        return z + rng.uniform(-30.0, 30.0)
+
+    def tmpc(z):
+        tz = tsfc - 6.5 * (min(z, ztrop) - elev) / 1000.0
+        if z > ztrop: tz += 1.5 * (z - ztrop) / 1000.0
+        return tz + rng.uniform(-1.0, 1.0)
+
+    def wind(z):
+        spd = jet * math.exp(-((z - 11000.0) / 5000.0) ** 2) + rng.uniform(0.0, 15.0)
+        return (wdir0 + z / 200.0 + rng.uniform(-20.0, 20.0)) % 360.0, spd
+
+    return {"psfc": psfc, "elev": elev, "ztrop": ztrop, "hght": hght, "tmpc": tmpc,
+            "ddep": lambda: rng.choice([rng.uniform(0.0, 5.0), rng.uniform(6.0, 40.0)]),
+            "wind": wind, "rng": rng}
+
+
+def _encode(msg_type, time_str, wmo_id, profile):
+    day, hour = int(time_str[:2]), int(time_str[2:4])
+    date_group = "%02d%02d%s" % (day + 50, hour, "1" if msg_type in ("TTAA", "TTCC") else "/")
+    groups = [msg_type, date_group, wmo_id]
+    rng = profile["rng"]
+    psfc = profile["psfc"]
+
+    if msg_type in ("TTAA", "TTCC"):
+        if msg_type == "TTAA":
+            groups += ["99%03d" % (int(round(psfc)) % 1000),
+                       _temp_group(profile["tmpc"](profile["elev"]), profile["ddep"]()),
+                       _wind_group(*profile["wind"](0.0))]
+        for pres, unit in (MAND_TTAA if msg_type == "TTAA" else MAND_TTCC):
+            ## The first two digits of the pressure (00 for 1000 hPa)
+            code = "%02d" % (pres // 10 % 100 if msg_type == "TTAA" else pres)
+            if pres > psfc:
+                groups += [code + "///", "/////", "/////"]
+                continue
+            z = profile["hght"](pres)
+            groups += [code + "%03d" % (int(round(z / unit)) % 1000),
+                       _temp_group(profile["tmpc"](z), profile["ddep"]()),
+                       _wind_group(*profile["wind"](z))]
+        if msg_type == "TTAA":
+            ptrop = 1013.25 * (1.0 - profile["ztrop"] / 44330.8) ** (1.0 / 0.190263)
+            groups += ["88%03d" % int(round(ptrop)),
+                       _temp_group(profile["tmpc"](profile["ztrop"]), profile["ddep"]()),
+                       _wind_group(*profile["wind"](profile["ztrop"]))]
+            groups += ["77%03d" % int(round(ptrop + 60.0)), _wind_group(*profile["wind"](11000.0))]
+        else:
+            groups += ["88999", "77999"]
+        groups += ["31313", "58708", "8%02d05" % hour]
+
+    elif msg_type in ("TTBB", "TTDD"):
+        if msg_type == "TTBB":
+            levels = [psfc] + sorted([rng.uniform(100.0, psfc - 5.0) for idx in range(rng.randint(8, 30))], reverse=True)
+        else:
+            levels = sorted([rng.uniform(8.0, 99.0) for idx in range(rng.randint(4, 15))], reverse=True)
+        for idx, pres in enumerate(levels):
+            if msg_type == "TTBB" and idx == 0:
+                code = "00%03d" % (int(round(pres)) % 1000)
+            elif msg_type == "TTBB":
+                code = "%d%d%03d" % ((idx - 1) % 9 + 1, (idx - 1) % 9 + 1, int(round(pres)) % 1000)
+            else:
+                code = "%d%d%03d" % (idx % 9 + 1, idx % 9 + 1, int(round(pres * 10.0)) % 1000)
+            groups += [code, _temp_group(profile["tmpc"](profile["hght"](pres)), profile["ddep"]())]
+        groups += ["31313", "58708", "8%02d05" % hour]
+
+    else:
+        heights = PPBB_HEIGHTS if msg_type == "PPBB" else PPDD_HEIGHTS
+        tens = {}
+        for kft in heights:
+            tens.setdefault(kft // 10, []).append(kft % 10)
+        for ten, units in sorted(tens.items()):
+            for start in range(0, len(units), 3):
+                chunk = units[start:start + 3]
+                groups.append("9%d%s" % (ten, "".join(str(unit) for unit in chunk) + "/" * (3 - len(chunk))))
+                for unit in chunk:
+                    z = (ten * 10 + unit) * 1000.0 / 3.281
+                    groups.append(_wind_group(*profile["wind"](z)))
+    return " ".join(groups) + "="
+
+
+def _temp_group(tmpc, ddep):
+    ## An odd tenths digit means the temperature is negative
+    tval = int(round(abs(tmpc) * 10.0))
+    if (tmpc < 0) != (tval % 2 == 1): tval += 1
+    if ddep <= 5.0: dd = int(round(ddep * 10.0))
+    else: dd = min(int(round(ddep)), 49) + 50
+    return "%03d%02d" % (tval % 1000, dd)
+
+
+def _wind_group(wdir, wspd):
+    ## Hundreds of knots are carried in the units digit of the direction
+    wdir = int(round(wdir / 5.0)) * 5 % 360
+    wspd = int(round(wspd))
+    return "%03d%02d" % (wdir + wspd // 100, wspd % 100)
+
+
+def run_benchmarks(text, name, repeat=3, stages=None, stations_file=None):
+    """
+    Time each stage on the raw bulletin text and return a dictionary
+    of results. Every stage is run repeat times and the fastest run is
+    kept, then once more under tracemalloc for its peak memory.
+    """
+    stages = stages or STAGES
+    data = text.encode("latin-1")
+    stations = get_station_table(stations_file)
+
+    reader = WMOReader(None, stations_file=stations_file)
+    reader._parse(text)
+    messages = [wmo_msg for tid in reader.records.keys()
+                        for sid in reader.records[tid].keys()
+                        for wmo_msg in reader.records[tid][sid].values()]
+    by_kind = {
+        "decode_mand": [wmo_msg for wmo_msg in messages if wmo_msg.type in ("TTAA", "TTCC")],
+        "decode_sigt": [wmo_msg for wmo_msg in messages if wmo_msg.type in ("TTBB", "TTDD")],
+        "decode_sigw": [wmo_msg for wmo_msg in messages if wmo_msg.type in ("PPBB", "PPDD")],
+    }
+
+    def reset(msgs):
+        for wmo_msg in msgs: wmo_msg.levels = None
+
+    def run_tokenize():
+        return sum(1 for res in tokenize(text)), 0
+
+    def run_tokenize_buffer():
+        return sum(1 for res in tokenize_buffer(data)), 0
+
+    def run_records():
+        rdr = WMOReader(None, stations_file=stations_file)
+        rdr._parse(text)
+        return sum(len(msgs) for tid in rdr.records for msgs in rdr.records[tid].values()), 0
+
+    def run_decode(kind):
+        def run():
+            nlevels = sum(len(wmo_msg.decode()) for wmo_msg in by_kind[kind])
+            return len(by_kind[kind]), nlevels
+        return run
+
+    def run_decode_batch():
+        decode_messages(messages)
+        return len(messages), sum(len(wmo_msg.levels) for wmo_msg in messages)
+
+    def run_station_lookup():
+        for wmo_msg in messages:
+            stations.get(wmo_msg.id)
+            stations.elevation(wmo_msg.id)
+        return len(messages), 0
+
+    def run_assemble():
+        nsoundings, nlevels = 0, 0
+        for tid in reader.records.keys():
+            for sid in reader.records[tid].keys():
+                if "TTAA" not in reader.records[tid][sid]: continue
+                sounding = reader.create_sounding(tid, sid)
+                nsoundings += 1
+                nlevels += len(sounding.levels)
+        return nsoundings, nlevels
+
+    runners = {
+        "tokenize": (run_tokenize, None, True),
+        "tokenize_buffer": (run_tokenize_buffer, None, True),
+        "records": (run_records, None, True),
+        "decode_mand": (run_decode("decode_mand"), lambda: reset(by_kind["decode_mand"]), False),
+        "decode_sigt": (run_decode("decode_sigt"), lambda: reset(by_kind["decode_sigt"]), False),
+        "decode_sigw": (run_decode("decode_sigw"), lambda: reset(by_kind["decode_sigw"]), False),
+        "decode_batch": (run_decode_batch, lambda: reset(messages), False),
+        "station_lookup": (run_station_lookup, None, False),
+        "assemble": (run_assemble, lambda: reset(messages), False),
+    }
+
+    results = {}
+    for stage in stages:
+        run, setup, reads_text = runners[stage]
+        seconds, counts = _time_stage(run, setup, repeat)
+        peak = _peak_memory(run, setup)
+        nbulletins, nlevels = counts
+        results[stage] = {
+            "seconds": seconds,
+            "bulletins": nbulletins,
+            "levels": nlevels,
+            "bulletins_per_s": nbulletins / seconds if seconds > 0 else None,
+            "levels_per_s": nlevels / seconds if seconds > 0 and nlevels else None,
+            "mb_per_s": len(data) / 1e6 / seconds if seconds > 0 and reads_text else None,
+            "peak_bytes": peak,
+        }
+    return {"name": name, "bytes": len(data), "messages": len(messages), "stages": results}
+
+
+def measure_cold_start(filename=COLD_START_FILE, repeat=5, stations_file=None, budget=COLD_START_BUDGET):
+    """
+    Time a fresh Python process importing WMOParser and reading and
+    decoding filename, repeat times, and return the median wall time
+    along with how long the import and the decode took inside the
+    process, the heavy modules (pandas, NumPy) that got loaded and the
+    startup time of an empty interpreter to compare against.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, "-c", _COLD_START_SCRIPT, os.path.abspath(filename), stations_file or ""]
+    empty, walls, runs = [], [], []
+    for idx in range(max(1, repeat)):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        empty.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=here, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+        walls.append(time.perf_counter() - start)
+        ## The timings are the last line of the output
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    seconds = statistics.median(walls)
+    return {
+        "file": os.path.basename(filename),
+        "seconds": seconds,
+        "interpreter_seconds": statistics.median(empty),
+        "import_seconds": statistics.median(run["import"] for run in runs),
+        "decode_seconds": statistics.median(run["decode"] for run in runs),
+        "modules": runs[-1]["modules"],
+        "budget_seconds": budget,
+        "within_budget": seconds <= budget,
+    }
+
+
+def _time_stage(run, setup, repeat):
+    best = None
+    counts = None
+    for idx in range(max(1, repeat)):
+        if setup is not None: setup()
+        start = time.perf_counter()
+        counts = run()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best: best = elapsed
+    return best, counts
+
+
+def _peak_memory(run, setup):
+    if setup is not None: setup()
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the WMO upper air parser and decoders and print the results as JSON.")
+    parser.add_argument("paths", nargs="*", help="bulletin files to benchmark (default: the bundled files)")
+    parser.add_argument("--scale", type=float, nargs="*", default=[10], help="sizes of synthetic traffic to generate, relative to test.wmo")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic traffic")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each stage to take the fastest of")
+    parser.add_argument("--stages", nargs="*", default=None, choices=STAGES, help="stages to run (default: all)")
+    parser.add_argument("--stations", default=None, help="station table (default: snstns.tbl)")
+    parser.add_argument("-o", "--output", default=None, help="write the JSON here instead of stdout")
+    parser.add_argument("--budget", type=float, default=COLD_START_BUDGET, help="cold start budget in seconds")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if the cold start is over budget")
+    args = parser.parse_args()
+
+    inputs = []
+    for path in (args.paths or BUNDLED_FILES):
+        with open(path, "r", newline="", encoding="latin-1") as snfile:
+            inputs.append((os.path.basename(path), snfile.read()))
+    for scale in args.scale:
+        inputs.append(("synthetic_x%g" % scale, generate_traffic(scale, seed=args.seed, stations_file=args.stations)))
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "decoder_version": DECODER_VERSION,
+        "repeat": args.repeat,
+        "cold_start": measure_cold_start(repeat=max(args.repeat, 5), stations_file=args.stations, budget=args.budget),
+        "inputs": [],
+    }
+    for name, text in inputs:
+        report["inputs"].append(run_benchmarks(text, name, repeat=args.repeat, stages=args.stages,
+                                               stations_file=args.stations))
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as ofile:
+            json.dump(report, ofile, indent=2)
+    if args.check and not report["cold_start"]["within_budget"]: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
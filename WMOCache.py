@@ -0,0 +1,236 @@
+from WMOParser import WMOReader
+from WMOMessage import DECODER_VERSION
+from WMOStations import get_station_table, check_private, USER_CACHE_DIR
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+
+## Default cache directory. Can be overridden with the
+## WMO_CACHE_DIR environment variable or the cache_dir keyword.
+CACHE_DIR = os.environ.get("WMO_CACHE_DIR", os.path.join(USER_CACHE_DIR, "decoded"))
+
+## Bump this whenever the layout of the cache entries changes
+CACHE_VERSION = 2
+
+CACHE_SUFFIX = ".wmoc"
+
+## Entries are written to a temporary file first. Temporary files
+## older than TEMP_MAX_AGE seconds were left by a writer that died
+## and are removed by evict().
+TEMP_SUFFIX = ".wmoc-tmp"
+TEMP_MAX_AGE = 3600
+
+## Seconds between full scans of the cache directory for expired
+## entries when the size limit isn't reached
+SCAN_INTERVAL = 3600
+
+
+class WMOCache():
+    def __init__(self, cache_dir=None, max_bytes=1 << 30, max_age=30 * 86400):
+        """
+        A directory of decoded WMOReader records, one entry per input file.
+        An entry is used instead of parsing the file again for as long as
+        the file's size and modification time (or, if only the modification
+        time changed, its contents), the decoder version and the station
+        table are all unchanged. Each entry is a pickle of the decoded records.
+
+        Loading a pickle can run code, so the directory (by default one in
+        the per-user cache directory, see WMOStations.user_cache_dir) is
+        created readable by its owner only, and nothing is read from or
+        written to it unless it and the entry belong to the current user
+        and nobody else can write to them (see WMOStations.check_private).
+
+        Entries that haven't been used for max_age seconds are removed,
+        then the least recently used entries until the directory holds no
+        more than max_bytes (see evict). Rather than scanning the directory
+        every time an entry is written, the size of the cache is counted as
+        entries are written, and it is only scanned when that goes over
+        max_bytes or every SCAN_INTERVAL seconds. Either limit can be None
+        to turn it off.
+        """
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        ## Size of the cache as of the last scan plus what was written
+        ## since, and when that scan was (None before the first one)
+        self.size = None
+        self.scanned = None
+        self._private = False
+
+    def read(self, filename, stations_file=None, stats=None):
+        """
+        Return a WMOReader with the decoded records of filename, from the
+        cache if there is a valid entry. Otherwise parse and decode the
+        file and store the result. Hits and misses are counted in stats
+        (a WMOStats), if given.
+        """
+        stations = get_station_table(stations_file)
+        reader = self.get(filename, stations)
+        if reader is not None:
+            self.hits += 1
+            if stats is not None: stats.count("cache_hits")
+            return reader
+        self.misses += 1
+        if stats is not None: stats.count("cache_misses")
+
+        ## Stat the file before reading it, so an entry written
+        ## while the file is being appended to is never reused.
+        stat = os.stat(filename)
+        reader = WMOReader(filename, stations_file=stations.stations_file, stats=stats)
+        reader.decode_all()
+        self.put(filename, reader, stat=stat)
+        return reader
+
+    def get(self, filename, stations):
+        """
+        Return a WMOReader with the cached records of filename, or None if
+        there isn't a valid entry.
+        """
+        entry_file = self._entry_file(filename, stations)
+        try:
+            self._check_dir()
+            stat = os.stat(filename)
+            with open(entry_file, "rb") as cfile:
+                if not _owned(os.fstat(cfile.fileno())): return None
+                entry = pickle.load(cfile)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError, ImportError):
+            return None
+
+        if entry.get("version") != CACHE_VERSION: return None
+        if entry.get("size") != stat.st_size: return None
+        if entry.get("mtime") != stat.st_mtime_ns:
+            ## Touched, but possibly not changed
+            if entry.get("hash") != self._file_hash(filename): return None
+
+        ## Mark the entry as recently used for eviction
+        try:
+            os.utime(entry_file)
+        except OSError:
+            pass
+
+        reader = WMOReader(None, stations_file=stations.stations_file)
+        reader.filename = filename
+        reader.records = entry["records"]
+        return reader
+
+    def put(self, filename, reader, stat=None):
+        """
+        Store the records of reader as the entry for filename. stat is the
+        os.stat result of the file from before it was read, if known.
+        """
+        if stat is None: stat = os.stat(filename)
+        entry = {
+            "version": CACHE_VERSION,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": self._file_hash(filename),
+            "records": reader.records,
+        }
+        self._check_dir()
+        entry_file = self._entry_file(filename, reader.stations)
+        try:
+            old_size = os.stat(entry_file).st_size
+        except OSError:
+            old_size = 0
+
+        ## Write to a temporary file and move it into place so
+        ## concurrent readers never see a partial entry.
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=TEMP_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as cfile:
+                pickle.dump(entry, cfile, protocol=pickle.HIGHEST_PROTOCOL)
+                size = cfile.tell()
+            os.replace(tmp_name, entry_file)
+        except OSError:
+            if os.path.exists(tmp_name): os.remove(tmp_name)
+            return
+
+        if self.size is not None: self.size += size - old_size
+        too_big = self.size is None or (self.max_bytes is not None and self.size > self.max_bytes)
+        if too_big or time.time() - self.scanned > SCAN_INTERVAL: self.evict()
+
+    def evict(self):
+        """
+        Remove entries older than max_age, then the least recently
+        used entries until the cache is no larger than max_bytes.
+        Temporary files left by writers that died are removed too.
+        """
+        now = time.time()
+        entries = []
+        for name in self._names():
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith(CACHE_SUFFIX):
+                entries.append((stat.st_mtime, stat.st_size, path))
+            elif name.endswith(TEMP_SUFFIX) and now - stat.st_mtime > TEMP_MAX_AGE:
+                _remove(path)
+        entries.sort()
+
+        total = sum(size for used, size, entry_file in entries)
+        for used, size, entry_file in entries:
+            expired = self.max_age is not None and now - used > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not expired and not too_big: break
+            if _remove(entry_file): total -= size
+        self.size = total
+        self.scanned = now
+
+    def clear(self):
+        for name in self._names():
+            if name.endswith(CACHE_SUFFIX): _remove(os.path.join(self.cache_dir, name))
+        self.size = 0
+
+    def _names(self):
+        try:
+            return os.listdir(self.cache_dir)
+        except OSError:
+            return []
+
+    def _check_dir(self):
+        """
+        Create the cache directory, readable by its owner only, and make
+        sure nobody else can put entries in it (see check_private).
+        """
+        if self._private: return
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        check_private(self.cache_dir)
+        self._private = True
+
+    def _entry_file(self, filename, stations):
+        """
+        Entries are named after the input file, the decoder version and
+        the version of the station table, so changing any of them starts
+        a new entry and the old one ages out.
+        """
+        key = "\n".join([os.path.abspath(filename), str(DECODER_VERSION), str(stations.stations_file),
+                         str(stations.mtime), str(stations.size)])
+        name = hashlib.sha1(key.encode()).hexdigest() + CACHE_SUFFIX
+        return os.path.join(self.cache_dir, name)
+
+    def _file_hash(self, filename):
+        sha = hashlib.sha1()
+        with open(filename, "rb") as snfile:
+            for chunk in iter(lambda: snfile.read(1 << 20), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+
+def _owned(stat):
+    ## Entries must belong to us and not be writable by anyone else
+    if hasattr(os, "getuid") and stat.st_uid != os.getuid(): return False
+    return not stat.st_mode & 0o022
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,279 @@
+from WMOParser import WMOReader
+from WMOStations import get_station_table
+from WMORecords import valid_time, default_ref_date
+from WMOIngest import find_files
+import numpy as np
+import argparse
+import datetime
+import json
+import os
+import tempfile
+
+## Bump this whenever the layout of the cube files changes
+CUBE_VERSION = 1
+
+## Default pressure grid (hPa): the mandatory levels
+CUBE_GRID = [1000.0, 925.0, 850.0, 700.0, 500.0, 400.0, 300.0, 250.0, 200.0, 150.0,
+             100.0, 70.0, 50.0, 30.0, 20.0, 10.0]
+
+## Variables that can be put in a cube. Winds are stored as u and v in
+## knots (the decoders convert m/s to knots), since directions can't be
+## interpolated.
+CUBE_VARIABLES = ["hght", "tmpc", "dwpc", "u", "v"]
+
+META_FILE = "cube.json"
+DATA_FILE = "data.f4"
+TIMES_FILE = "times.i8"
+STATIONS_FILE = "stations.txt"
+
+
+class WMOSoundingCube():
+    def __init__(self, cube_dir, grid=None, variables=None, max_stations=None, stations_file=None):
+        """
+        An on-disk (time, station, level, variable) array of soundings
+        interpolated in log pressure onto a fixed pressure grid, read
+        through np.memmap so it can be sliced without loading it.
+
+        The cube is a directory holding the float32 data, one slab of
+        (max_stations, levels, variables) per time, the record times
+        (seconds since 1970, int64) in the order they were added, and
+        the WMO ID of every station slot, one per line. Adding a new
+        time only appends to these files; adding a time that is already
+        there overwrites its slab in place. Station slots are handed out
+        as stations are first seen, up to max_stations (by default the
+        number of stations in the station table, rounded up to the next
+        thousand), which is fixed when the cube is created, as are grid
+        and variables.
+        """
+        self.cube_dir = cube_dir
+        meta_file = os.path.join(cube_dir, META_FILE)
+        if os.path.exists(meta_file):
+            with open(meta_file, "r") as mfile:
+                meta = json.load(mfile)
+            if meta.get("version") != CUBE_VERSION:
+                raise ValueError("{cube} is a version {version} cube, not {ours}".format(
+                    cube=cube_dir, version=meta.get("version"), ours=CUBE_VERSION))
+        else:
+            if max_stations is None:
+                max_stations = (len(get_station_table(stations_file)) // 1000 + 1) * 1000
+            meta = {
+                "version": CUBE_VERSION,
+                "grid": [float(lvl) for lvl in (grid or CUBE_GRID)],
+                "variables": list(variables or CUBE_VARIABLES),
+                "max_stations": int(max_stations),
+            }
+            for name in meta["variables"]:
+                if name not in CUBE_VARIABLES: raise ValueError("Unknown variable: {name!r}".format(name=name))
+            os.makedirs(cube_dir, exist_ok=True)
+            _write_atomic(meta_file, json.dumps(meta, indent=2).encode())
+            for name in [DATA_FILE, TIMES_FILE, STATIONS_FILE]: open(os.path.join(cube_dir, name), "ab").close()
+
+        self.grid = np.array(meta["grid"])
+        self.variables = meta["variables"]
+        self.max_stations = meta["max_stations"]
+        self.slab_shape = (self.max_stations, len(self.grid), len(self.variables))
+        self.slab_bytes = int(np.prod(self.slab_shape)) * 4
+        self._load_index()
+
+    def __len__(self):
+        return len(self.times)
+
+    def data(self, mode="r"):
+        """
+        Return the whole cube as a (time, station, level, variable)
+        np.memmap. Missing values are NaN.
+        """
+        if len(self.times) == 0: return np.zeros((0,) + self.slab_shape, dtype="f4")
+        return np.memmap(os.path.join(self.cube_dir, DATA_FILE), dtype="f4", mode=mode,
+                         shape=(len(self.times),) + self.slab_shape)
+
+    def select(self, station=None, time=None, level=None, variable=None):
+        """
+        Return a slice of the cube, read from disk, for the given WMO ID,
+        time (a datetime), pressure level and variable name. Each can also
+        be a list, or None for all of them. Station, level and variable
+        slots are kept in the order given, times in cube order.
+        """
+        cube = self.data()
+        index = (self._time_index(time), self._axis_index(station, self.station_slots, "station"),
+                 self._axis_index(level, {float(lvl): idx for idx, lvl in enumerate(self.grid)}, "level", float),
+                 self._axis_index(variable, {name: idx for idx, name in enumerate(self.variables)}, "variable"))
+        ## Index one axis at a time, last axis first, so that lists on
+        ## several axes don't broadcast together and dropped axes don't
+        ## shift the ones still to be indexed
+        result = cube
+        for axis in reversed(range(len(index))):
+            result = result[(slice(None),) * axis + (index[axis],)]
+        return np.array(result)
+
+    def add_reader(self, reader, ref_date=None):
+        """
+        Interpolate every sounding in a WMOReader onto the grid and add
+        them to the cube, one slab per record time. ref_date fills in the
+        year and month of the record times (see WMORecords.valid_time)
+        and defaults to the date in the reader's file name, then today.
+        Record times that don't exist, and soundings that can't be
+        assembled (see WMOReader.create_sounding), are skipped. Returns the
+        number of soundings added.
+        """
+        if ref_date is None: ref_date = default_ref_date(reader.filename)
+        reader.decode_all()
+        nsoundings = 0
+        for time_str in sorted(reader.records.keys()):
+            valid = valid_time(time_str, ref_date)
+            if valid is None: continue
+            profiles = {}
+            for wmo_id in sorted(reader.records[time_str].keys()):
+                if "TTAA" not in reader.records[time_str][wmo_id]: continue
+                sounding = reader.create_sounding(time_str, wmo_id, skip_errors=True)
+                if sounding is not None and len(sounding.levels) > 0: profiles[wmo_id] = sounding.levels
+            if len(profiles) == 0: continue
+            self.add_time(valid, profiles)
+            nsoundings += len(profiles)
+        return nsoundings
+
+    def add_time(self, time, profiles):
+        """
+        Add the soundings of one time (a datetime) to the cube. profiles
+        maps WMO IDs to decoded level arrays (see WMOSounding.assemble).
+        If the time is already in the cube, the given stations are
+        overwritten in place and the others are kept.
+        """
+        seconds = int(np.datetime64(time, "s").astype(np.int64))
+        existing = self.time_slots.get(seconds)
+        if existing is not None:
+            data = self.data(mode="r+")
+            slab = data[existing]
+        else:
+            slab = np.full(self.slab_shape, np.nan, dtype="f4")
+
+        for wmo_id, levels in profiles.items():
+            slab[self._station_slot(wmo_id)] = interp_profile(levels, self.grid, self.variables)
+
+        if existing is not None:
+            data.flush()
+            del data
+            return
+
+        ## Data first, then the time, so a crash in between leaves
+        ## a partial slab that _load_index ignores.
+        with open(os.path.join(self.cube_dir, DATA_FILE), "r+b") as dfile:
+            dfile.seek(len(self.times) * self.slab_bytes)
+            dfile.write(slab.tobytes())
+        with open(os.path.join(self.cube_dir, TIMES_FILE), "r+b") as tfile:
+            tfile.seek(len(self.times) * 8)
+            tfile.write(np.array([seconds], dtype="<i8").tobytes())
+        self.time_slots[seconds] = len(self.times)
+        self.times.append(seconds)
+
+    def time_list(self):
+        """
+        Return the times in the cube as datetimes, in cube order.
+        """
+        return [datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=seconds) for seconds in self.times]
+
+    def _load_index(self):
+        with open(os.path.join(self.cube_dir, TIMES_FILE), "rb") as tfile:
+            times = np.frombuffer(tfile.read(), dtype="<i8")
+        ntimes = min(len(times), os.path.getsize(os.path.join(self.cube_dir, DATA_FILE)) // self.slab_bytes)
+        self.times = [int(seconds) for seconds in times[:ntimes]]
+        self.time_slots = {seconds: idx for idx, seconds in enumerate(self.times)}
+        with open(os.path.join(self.cube_dir, STATIONS_FILE), "r") as sfile:
+            self.stations = [line.strip() for line in sfile if line.strip()]
+        self.station_slots = {wmo_id: idx for idx, wmo_id in enumerate(self.stations)}
+
+    def _station_slot(self, wmo_id):
+        slot = self.station_slots.get(wmo_id)
+        if slot is not None: return slot
+        if len(self.stations) >= self.max_stations:
+            raise ValueError("The cube has no room for station {stn} (max_stations={num})".format(
+                stn=wmo_id, num=self.max_stations))
+        with open(os.path.join(self.cube_dir, STATIONS_FILE), "a") as sfile:
+            sfile.write(wmo_id + "\n")
+        slot = len(self.stations)
+        self.stations.append(wmo_id)
+        self.station_slots[wmo_id] = slot
+        return slot
+
+    def _time_index(self, time):
+        if time is None: return slice(None)
+        if isinstance(time, (list, tuple)): return [self._time_index(val) for val in time]
+        seconds = int(np.datetime64(time, "s").astype(np.int64))
+        if seconds not in self.time_slots: raise KeyError("No {time} in the cube".format(time=time))
+        return self.time_slots[seconds]
+
+    def _axis_index(self, value, slots, name, convert=str):
+        if value is None: return slice(None)
+        if isinstance(value, (list, tuple)): return [self._axis_index(val, slots, name, convert) for val in value]
+        if convert(value) not in slots: raise KeyError("No {name} {value} in the cube".format(name=name, value=value))
+        return slots[convert(value)]
+
+
+def interp_profile(levels, grid, variables=CUBE_VARIABLES):
+    """
+    Interpolate decoded levels (see WMOMessage.LEVEL_DTYPE) linearly in
+    log pressure onto grid and return a (len(grid), len(variables))
+    float32 array. Each variable only uses the levels that have a value
+    for it, and grid levels outside of those are NaN (no extrapolation).
+    """
+    out = np.full((len(grid), len(variables)), np.nan, dtype="f4")
+    has_pres = np.isfinite(levels["lvl"]) & (levels["lvl"] > 0)
+    levels = levels[has_pres]
+    if len(levels) == 0: return out
+    ## np.interp needs increasing x, and log pressure decreases upward
+    logp = -np.log(levels["lvl"])
+    grid_logp = -np.log(np.asarray(grid, dtype=float))
+
+    rad = np.radians(levels["wdir"])
+    columns = {"hght": levels["hght"], "tmpc": levels["tmpc"], "dwpc": levels["dwpc"],
+               "u": -levels["wspd"] * np.sin(rad), "v": -levels["wspd"] * np.cos(rad)}
+    for idx, name in enumerate(variables):
+        col = columns[name]
+        valid = np.isfinite(col)
+        if valid.sum() == 0: continue
+        x, y = logp[valid], col[valid]
+        order = np.argsort(x, kind="stable")
+        x, y = x[order], y[order]
+        inside = (grid_logp >= x[0]) & (grid_logp <= x[-1])
+        out[inside, idx] = np.interp(grid_logp[inside], x, y)
+    return out
+
+
+def _write_atomic(path, data):
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as ofile:
+            ofile.write(data)
+        os.replace(tmp_name, path)
+    except OSError:
+        if os.path.exists(tmp_name): os.remove(tmp_name)
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a memory mapped cube of soundings on a common pressure grid.")
+    parser.add_argument("cube", help="cube directory (created if it doesn't exist)")
+    parser.add_argument("paths", nargs="*", help="files, directories or glob patterns to add")
+    parser.add_argument("--grid", default=None, help="comma separated pressure levels (hPa) of a new cube")
+    parser.add_argument("--variables", default=None, help="comma separated variables of a new cube")
+    parser.add_argument("--max-stations", type=int, default=None, help="station slots of a new cube")
+    parser.add_argument("--date", default=None, help="date (YYYYMMDD) the record times are in (default: from each file name)")
+    parser.add_argument("--pattern", default="*.uair", help="file pattern to use for directories")
+    parser.add_argument("--stations", default=None, help="station table (default: snstns.tbl)")
+    args = parser.parse_args()
+
+    grid = [float(lvl) for lvl in args.grid.split(",")] if args.grid else None
+    variables = args.variables.split(",") if args.variables else None
+    cube = WMOSoundingCube(args.cube, grid=grid, variables=variables, max_stations=args.max_stations,
+                           stations_file=args.stations)
+    ref_date = datetime.datetime.strptime(args.date, "%Y%m%d").date() if args.date else None
+    for filename in find_files(args.paths, args.pattern):
+        reader = WMOReader(filename, stations_file=args.stations)
+        nsoundings = cube.add_reader(reader, ref_date=ref_date)
+        print("{file}: {num} soundings".format(file=filename, num=nsoundings))
+    print("Times: {ntimes}\tStations: {nstn}/{max}\tLevels: {nlvl}\tVariables: {vars}".format(
+        ntimes=len(cube), nstn=len(cube.stations), max=cube.max_stations, nlvl=len(cube.grid),
+        vars=",".join(cube.variables)))
+
+if __name__ == "__main__":
+    main()
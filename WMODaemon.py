@@ -0,0 +1,323 @@
+from WMOParser import WMOReader
+from WMOStations import get_station_table, check_private, USER_CACHE_DIR
+from WMORecords import valid_time, default_ref_date
+from WMOExport import write_sharppy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import signal
+import socket
+import sys
+
+
+
+def default_socket():
+    """
+    Return the socket the daemon listens on by default: the
+    WMO_DAEMON_SOCKET environment variable, or wmo_decoder.sock in the
+    per-user runtime directory ($XDG_RUNTIME_DIR, or the per-user cache
+    directory when there isn't one, see WMOStations.user_cache_dir).
+    """
+    if os.environ.get("WMO_DAEMON_SOCKET"): return os.environ["WMO_DAEMON_SOCKET"]
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR") or USER_CACHE_DIR, "wmo_decoder.sock")
+
+## Default socket the daemon listens on. Can be overridden with --socket.
+DAEMON_SOCKET = default_socket()
+
+
+class WMODecoderDaemon():
+    def __init__(self, stations_file=None, max_files=16, max_soundings=1024, data_dirs=None, stats=None):
+        """
+        A resident decoder that keeps the station table and the records of
+        recently used files in memory, and answers JSON requests, one per
+        line, over a Unix socket (see handle() for the commands).
+
+        At most max_files WMOReaders and max_soundings assembled soundings
+        are kept, dropping the least recently used. Files are read in
+        follow mode, so a file that was appended to since it was last used
+        only has the new part parsed (see WMOReader.update). When the
+        station table changes on disk, it is loaded again and everything
+        decoded with the old one is dropped. stats is an optional WMOStats
+        handed to every reader.
+
+        Only files inside data_dirs (by default the current directory),
+        after following symbolic links, are opened; a request for any other
+        file is refused. The socket is created readable and writable by its
+        owner only (see serve_unix).
+        """
+        self.stations_file = stations_file
+        self.data_dirs = [os.path.realpath(path) for path in (data_dirs or [os.getcwd()])]
+        self.stations = get_station_table(stations_file)
+        self.max_files = max_files
+        self.max_soundings = max_soundings
+        self.stats = stats
+        self.files = OrderedDict()
+        self.soundings = OrderedDict()
+        self.counters = {"requests": 0, "errors": 0, "file_hits": 0, "file_misses": 0, "file_updates": 0,
+                         "sounding_hits": 0, "sounding_misses": 0, "station_reloads": 0}
+        ## Requests are answered one at a time, off the event loop,
+        ## so the caches never need a lock.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def handle(self, request):
+        """
+        Answer one request (a dictionary) and return the response. Every
+        response has "ok", and "error" if ok is False. The commands are:
+
+            {"cmd": "ping"}
+            {"cmd": "decode", "file": X} - parse and decode X, return the
+                message types of every record time and station
+            {"cmd": "sounding", "file": X, "station": S, "time": T} - the
+                assembled sounding of WMO or site ID S at record time T
+                (ddhhmm) as columns of LEVEL_FIELDS, or as SHARPpy text
+                with "format": "sharppy"
+            {"cmd": "stats"} - cache sizes and counters
+        """
+        self.counters["requests"] += 1
+        try:
+            self._check_stations()
+            cmd = request.get("cmd")
+            if cmd == "ping": return {"ok": True}
+            if cmd == "decode": return self._decode(request)
+            if cmd == "sounding": return self._sounding(request)
+            if cmd == "stats":
+                return {"ok": True, "files": len(self.files), "soundings": len(self.soundings),
+                        "counters": dict(self.counters)}
+            raise ValueError("Unknown command: {cmd!r}".format(cmd=cmd))
+        except Exception as err:
+            self.counters["errors"] += 1
+            return {"ok": False, "error": "{type}: {err}".format(type=type(err).__name__, err=err)}
+
+    def reader(self, filename):
+        """
+        Return the WMOReader of filename from the cache, bringing it up
+        to date if the file has changed, or parse it. A file that ends in
+        a transmission that is still being written is checked again on
+        the next request, since only complete transmissions are read.
+        """
+        path = self._path(filename)
+        stat = os.stat(path)
+        stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        entry = self.files.get(path)
+        if entry is not None:
+            self.files.move_to_end(path)
+            old_stamp, reader = entry
+            if old_stamp == stamp:
+                self.counters["file_hits"] += 1
+                return reader
+            self.counters["file_updates"] += 1
+            reader.update()
+            self._drop_soundings(path)
+        else:
+            self.counters["file_misses"] += 1
+            reader = WMOReader(path, stations_file=self.stations.stations_file, follow=True, stats=self.stats)
+        ## The stamp only counts once everything up to it has been read
+        if reader.offset < stat.st_size: stamp = None
+        self.files[path] = (stamp, reader)
+        while len(self.files) > self.max_files:
+            old_path, old_entry = self.files.popitem(last=False)
+            self._drop_soundings(old_path)
+        return reader
+
+    def sounding(self, filename, station, time):
+        """
+        Return the assembled levels (see WMOSounding.assemble) of station
+        (a WMO or site ID) at record time (ddhhmm) in filename, and the
+        record time and WMO ID they were found under.
+        """
+        reader = self.reader(filename)
+        path = self._path(filename)
+        wmo_id = self._wmo_id(station)
+        time_str = reader.records.group_time("%06d" % int(time))
+        key = (path, time_str, wmo_id)
+        if key in self.soundings:
+            self.counters["sounding_hits"] += 1
+            self.soundings.move_to_end(key)
+            return self.soundings[key], time_str, wmo_id
+
+        self.counters["sounding_misses"] += 1
+        if wmo_id not in reader.records.get(time_str, {}):
+            raise KeyError("No messages from {stn} at {time}".format(stn=station, time=time_str))
+        sounding = reader.create_sounding(time_str, wmo_id)
+        if sounding is None:
+            raise KeyError("No TTAA from {stn} at {time}".format(stn=station, time=time_str))
+        self.soundings[key] = sounding.levels
+        while len(self.soundings) > self.max_soundings: self.soundings.popitem(last=False)
+        return sounding.levels, time_str, wmo_id
+
+    async def serve_unix(self, path):
+        """
+        Listen on the Unix socket path. Its directory is created if it
+        doesn't exist, and has to belong to the current user with nobody
+        else able to write to it (see WMOStations.check_private). The
+        socket itself is only readable and writable by its owner.
+        """
+        socket_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+        check_private(socket_dir)
+        old_umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._handle_connection, path=path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(path, 0o600)
+        return server
+
+    async def _handle_connection(self, stream, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await stream.readline()
+                if not line: break
+                if not line.strip(): continue
+                try:
+                    request = json.loads(line)
+                except ValueError as err:
+                    response = {"ok": False, "error": "Bad request: {err}".format(err=err)}
+                else:
+                    response = await loop.run_in_executor(self._executor, self.handle, request)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _decode(self, request):
+        reader = self.reader(request["file"])
+        reader.decode_all()
+        records = {}
+        for time_str in sorted(reader.records.keys()):
+            records[time_str] = {wmo_id: sorted(msgs.keys()) for wmo_id, msgs in sorted(reader.records[time_str].items())}
+        return {"ok": True, "file": self._path(request["file"]), "records": records}
+
+    def _sounding(self, request):
+        levels, time_str, wmo_id = self.sounding(request["file"], request["station"], request["time"])
+        response = {"ok": True, "time": time_str, "wmo_id": wmo_id}
+        if request.get("format") == "sharppy":
+            stn = self.stations.get(wmo_id)
+            site_id = stn.site_id if stn is not None and stn.site_id else wmo_id
+            ref_date = default_ref_date(request["file"])
+            valid = valid_time(time_str, ref_date)
+            if valid is None: raise ValueError("{time} isn't a valid time".format(time=time_str))
+            out = io.StringIO()
+            write_sharppy(out, site_id, valid, levels)
+            response["text"] = out.getvalue()
+        else:
+            ## JSON has no NaN, so missing values are null
+            response["levels"] = {name: [None if isinstance(val, float) and math.isnan(val) else val
+                                         for val in levels[name].tolist()] for name in levels.dtype.names}
+        return response
+
+    def _path(self, filename):
+        """
+        Return the real path of a requested file, or raise PermissionError
+        if it isn't inside one of the data directories.
+        """
+        path = os.path.realpath(filename)
+        for data_dir in self.data_dirs:
+            if os.path.commonpath([path, data_dir]) == data_dir: return path
+        raise PermissionError("{file} isn't in a data directory".format(file=filename))
+
+    def _wmo_id(self, station):
+        station = str(station)
+        if station.isdigit(): return station
+        stn = self.stations.get_site(station)
+        if stn is None or not stn.wmo_id: raise KeyError("Unknown station: {stn}".format(stn=station))
+        return stn.wmo_id
+
+    def _check_stations(self):
+        """
+        Reload the station table if it changed on disk. Station elevations
+        go into the decoded surface heights, so everything decoded with
+        the old table is dropped.
+        """
+        stations = get_station_table(self.stations_file)
+        if stations is self.stations: return
+        self.stations = stations
+        self.files.clear()
+        self.soundings.clear()
+        self.counters["station_reloads"] += 1
+
+    def _drop_soundings(self, path):
+        for key in [key for key in self.soundings.keys() if key[0] == path]:
+            del self.soundings[key]
+
+
+def request(socket_path=None, **request):
+    """
+    Send one request to a running daemon and return its response,
+    e.g. request(cmd="sounding", file=X, station="72403", time="140000").
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path or DAEMON_SOCKET)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as sfile:
+            return json.loads(sfile.readline())
+
+
+async def run(args):
+    daemon = WMODecoderDaemon(stations_file=args.stations, max_files=args.max_files, max_soundings=args.max_soundings,
+                              data_dirs=args.data_dir)
+    server = await daemon.serve_unix(args.socket)
+    ## Stop cleanly on SIGTERM (e.g. from systemd) so the socket is removed
+    serving = asyncio.ensure_future(server.serve_forever())
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(args.socket): os.remove(args.socket)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep WMO upper air files decoded in memory and answer requests on a Unix socket.")
+    parser.add_argument("--socket", default=DAEMON_SOCKET, help="Unix socket path (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the daemon")
+    serve.add_argument("--stations", default=None, help="station table (default: snstns.tbl)")
+    serve.add_argument("--max-files", type=int, default=16, help="parsed files to keep in memory")
+    serve.add_argument("--max-soundings", type=int, default=1024, help="assembled soundings to keep in memory")
+    serve.add_argument("--data-dir", action="append", default=None,
+                       help="directory clients may read files from (can be repeated, default: the current directory)")
+
+    decode = commands.add_parser("decode", help="ask the daemon to decode a file")
+    decode.add_argument("file")
+
+    sounding = commands.add_parser("sounding", help="ask the daemon for one sounding")
+    sounding.add_argument("file")
+    sounding.add_argument("station", help="WMO or site ID")
+    sounding.add_argument("time", help="record time (ddhhmm)")
+    sounding.add_argument("--sharppy", action="store_true", help="print it in the SHARPpy format")
+
+    commands.add_parser("stats", help="print the daemon's cache sizes and counters")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(run(args))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.command == "decode":
+        response = request(args.socket, cmd="decode", file=os.path.abspath(args.file))
+    elif args.command == "sounding":
+        response = request(args.socket, cmd="sounding", file=os.path.abspath(args.file), station=args.station,
+                           time=args.time, format="sharppy" if args.sharppy else "json")
+    else:
+        response = request(args.socket, cmd="stats")
+    if not response["ok"]:
+        print(response["error"], file=sys.stderr)
+        sys.exit(1)
+    if "text" in response: print(response["text"], end="")
+    else: print(json.dumps(response, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,214 @@
-from WMOMessage import WMOUpperAirMessage
-import pandas as pd
+from WMOMessage import WMOUpperAirMessage, LEVEL_FIELDS, LEVEL_DTYPE
+from WMOTables import FLAG_SFC, FLAG_WIND_INTERP
+from WMOBatch import decode_messages
 import numpy as np
 
+## Gas constant for dry air (J/kg/K) and gravity (m/s^2)
+## used to integrate the hypsometric equation
+RD = 287.04
+G = 9.80665
+ZEROCNK = 273.15
+
+## Order the message types are merged in. When two messages report
+## the same pressure level, the first one with a value for a field wins.
+PRESSURE_TYPES = ["TTAA", "TTCC", "TTBB", "TTDD", "PPBB", "PPDD"]
+
 class WMOSounding():
     def __init__(self, **kwargs):
+        """
+        A single upper air sounding for one time and station, assembled
+        from its TTAA, TTBB, PPBB, TTCC, TTDD and PPDD messages (messages
+        is a dictionary keyed by message type, as in WMOReader.records).
+        Call assemble() to build the profile.
+        """
         self.time_str = kwargs.get("time_str", None)
         self.wmo_id = kwargs.get("wmo_id", None)
         self.messages = kwargs.get("messages", {})
+        self.stations = kwargs.get("stations", None)
+        self.levels = None
         return
 
+    def assemble(self, interp_winds=False):
+        """
+        Merge the decoded messages into a single profile and return it as
+        a structured array (see WMOMessage.LEVEL_DTYPE) sorted from the
+        surface up by decreasing pressure. Levels reported in more than
+        one message are combined, taking each value from the first
+        message in PRESSURE_TYPES that has it. Messages that can't be
+        decoded are left out. Levels below the surface are dropped.
+
+        Missing heights are filled by integrating the hypsometric equation
+        through the virtual temperature profile between the levels with
+        known (mandatory level) heights, so the result matches both ends
+        of every layer. PPBB and PPDD winds reported at heights (in feet
+        above the ground) are placed on the pressure profile by
+        interpolating in log pressure. Levels without a reported wind
+        have a missing wind, unless interp_winds is True, in which case
+        they get one interpolated (as u and v, in height) between the
+        nearest reported winds and are flagged with FLAG_WIND_INTERP.
+
+        The result is cached in self.levels.
+        """
+        messages = [self.messages[msg_type] for msg_type in PRESSURE_TYPES if msg_type in self.messages]
+        decode_messages(messages)
+        ## Messages that can't be decoded were counted by decode_messages
+        decoded = [wmo_msg.levels for wmo_msg in messages if wmo_msg.levels is not None]
+        if len(decoded) == 0:
+            self.levels = np.zeros(0, dtype=LEVEL_DTYPE)
+            return self.levels
+
+        rows = np.concatenate(decoded)
+        on_pres = np.isfinite(rows["lvl"])
+        profile = _merge_levels(rows[on_pres])
+
+        ## Drop anything reported below the surface
+        sfc = np.flatnonzero(profile["flag"] & FLAG_SFC)
+        if len(sfc) > 0: profile = profile[profile["lvl"] <= profile["lvl"][sfc[0]]]
+        profile["hght"] = _fill_heights(profile["lvl"], profile["hght"], profile["tmpc"], profile["dwpc"])
+
+        winds = rows[~on_pres]
+        if len(winds) > 0 and len(profile) > 0:
+            winds = self._place_height_winds(profile, winds)
+            profile = _merge_levels(np.concatenate([profile, winds]))
+
+        if interp_winds: _fill_winds(profile)
+        self.levels = profile
+        return self.levels
+
+    def _place_height_winds(self, profile, winds):
+        """
+        Convert the heights of winds reported above ground level to
+        heights above sea level, and find their pressure by interpolating
+        log pressure in height on the profile. Winds above or below the
+        profile can't be placed and are dropped.
+        """
+        winds = winds.copy()
+        sfc_elev = self._surface_elevation(profile)
+        winds["hght"] += sfc_elev
+
+        known = np.isfinite(profile["hght"])
+        hght = profile["hght"][known]
+        logp = np.log(profile["lvl"][known])
+        if len(hght) == 0: return winds[:0]
+        order = np.argsort(hght)
+        hght, logp = hght[order], logp[order]
+
+        inside = (winds["hght"] >= hght[0]) & (winds["hght"] <= hght[-1])
+        winds = winds[inside]
+        winds["lvl"] = np.exp(np.interp(winds["hght"], hght, logp))
+
+        ## Put the surface wind exactly on the surface level
+        sfc = np.flatnonzero(profile["flag"] & FLAG_SFC)
+        if len(sfc) > 0:
+            on_sfc = (winds["flag"] & FLAG_SFC) != 0
+            winds["lvl"][on_sfc] = profile["lvl"][sfc[0]]
+            winds["hght"][on_sfc] = profile["hght"][sfc[0]]
+        return winds
+
+    def _surface_elevation(self, profile):
+        if self.stations is not None:
+            elev = self.stations.elevation(self.wmo_id)
+            if elev is not None: return elev
+        sfc = np.flatnonzero((profile["flag"] & FLAG_SFC) & np.isfinite(profile["hght"]))
+        if len(sfc) > 0: return profile["hght"][sfc[0]]
+        return 0.0
+
+
+def _merge_levels(rows):
+    """
+    Sort levels by decreasing pressure and combine the levels with
+    the same pressure into one, taking the first finite value of every
+    field (in the order of rows) and combining the flags.
+    """
+    nrows = len(rows)
+    if nrows == 0: return np.zeros(0, dtype=LEVEL_DTYPE)
+    rows = rows[np.argsort(-rows["lvl"], kind="stable")]
+    starts = np.flatnonzero(np.r_[True, np.diff(rows["lvl"]) != 0])
+
+    merged = np.zeros(len(starts), dtype=LEVEL_DTYPE)
+    position = np.arange(nrows)
+    for name in LEVEL_FIELDS:
+        col = rows[name]
+        first = np.minimum.reduceat(np.where(np.isfinite(col), position, nrows), starts)
+        merged[name] = np.where(first < nrows, col[np.minimum(first, nrows - 1)], np.nan)
+    merged["flag"] = np.bitwise_or.reduceat(rows["flag"], starts)
+    return merged
+
+
+def _virtual_temperature(pres, tmpc, dwpc):
+    """
+    Virtual temperature in K. Where the dewpoint is missing,
+    the temperature is used as is.
+    """
+    vappres = 6.112 * np.exp(17.67 * dwpc / (dwpc + 243.5))
+    mixr = 0.622 * vappres / (pres - vappres)
+    mixr = np.where(np.isfinite(mixr), mixr, 0.0)
+    return (tmpc + ZEROCNK) * (1.0 + 0.61 * mixr)
+
+
+def _fill_heights(pres, hght, tmpc, dwpc):
+    """
+    Fill the missing heights of a profile sorted by decreasing pressure.
+    The thickness of every layer comes from the hypsometric equation using
+    the mean virtual temperature of the layer (temperatures missing at a
+    level are interpolated in log pressure). Between two levels of known
+    height, the thicknesses are scaled so that they add up to the known
+    difference; above the highest (or below the lowest) known height they
+    are used as is. Heights stay missing if there are no temperatures.
+    """
+    hght = hght.copy()
+    known = np.isfinite(hght)
+    has_temp = np.isfinite(tmpc)
+    if known.all() or not known.any() or has_temp.sum() == 0: return hght
+
+    logp = np.log(pres)
+    ## np.interp needs increasing x, and log pressure decreases upward
+    tmpc = np.where(has_temp, tmpc, np.interp(-logp, -logp[has_temp], tmpc[has_temp]))
+    tv = _virtual_temperature(pres, tmpc, dwpc)
+    thickness = (RD / G) * 0.5 * (tv[:-1] + tv[1:]) * (logp[:-1] - logp[1:])
+    depth = np.r_[0.0, np.cumsum(thickness)]
+
+    nlevels = len(pres)
+    index = np.arange(nlevels)
+    below = np.maximum.accumulate(np.where(known, index, -1))
+    above = np.minimum.accumulate(np.where(known, index, nlevels)[::-1])[::-1]
+    has_below = below >= 0
+    has_above = above < nlevels
+    below = np.where(has_below, below, 0)
+    above = np.where(has_above, above, nlevels - 1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = (hght[above] - hght[below]) / (depth[above] - depth[below])
+    scale = np.where(has_below & has_above & (above != below) & np.isfinite(scale), scale, 1.0)
+
+    from_below = hght[below] + (depth - depth[below]) * scale
+    from_above = hght[above] - (depth[above] - depth)
+    filled = np.where(has_below, from_below, from_above)
+    hght[~known] = filled[~known]
+    return hght
+
+
+def _fill_winds(profile):
+    """
+    Interpolate the u and v wind components in height onto the levels of
+    profile that have a height but no wind, between the lowest and highest
+    reported winds, and flag them with FLAG_WIND_INTERP.
+    """
+    hght = profile["hght"]
+    has_wind = np.isfinite(profile["wdir"]) & np.isfinite(profile["wspd"]) & np.isfinite(hght)
+    need = ~has_wind & np.isfinite(hght)
+    if has_wind.sum() < 2 or not need.any(): return
+    obs_hght = hght[has_wind]
+    need &= (hght >= obs_hght.min()) & (hght <= obs_hght.max())
+    if not need.any(): return
+
+    order = np.argsort(obs_hght, kind="stable")
+    obs_hght = obs_hght[order]
+    rad = np.radians(profile["wdir"][has_wind][order])
+    wspd = profile["wspd"][has_wind][order]
+    u = np.interp(hght[need], obs_hght, -wspd * np.sin(rad))
+    v = np.interp(hght[need], obs_hght, -wspd * np.cos(rad))
 
+    profile["wspd"][need] = np.hypot(u, v)
+    profile["wdir"][need] = np.degrees(np.arctan2(-u, -v)) % 360.0
+    profile["flag"][need] |= FLAG_WIND_INTERP
@@ -0,0 +1,124 @@
+from WMOIngest import ingest_files, find_files
+from WMORecords import valid_time, default_ref_date
+from WMOStats import WMOStats, timer
+import numpy as np
+import argparse
+import datetime
+import io
+import os
+import zipfile
+
+## Value SHARPpy reads as missing
+SHARPPY_MISSING = -9999.0
+
+SHARPPY_HEADER = "   LEVEL       HGHT       TEMP       DWPT       WDIR       WSPD\n"
+SHARPPY_HEADER += "-------------------------------------------------------------------\n"
+
+SHARPPY_COLUMNS = ["lvl", "hght", "tmpc", "dwpc", "wdir", "wspd"]
+
+
+def sharppy_name(site_id, valid):
+    return "{time}_{site}.txt".format(time=valid.strftime("%y%m%d%H%M"), site=site_id)
+
+
+def write_sharppy(out, site_id, valid, levels):
+    """
+    Write one sounding (a structured array of WMOMessage.LEVEL_DTYPE,
+    surface first) to the text file out in the SHARPpy %TITLE%/%RAW%
+    format, one level at a time. Levels without a pressure are left out
+    and missing values are written as SHARPPY_MISSING. Wind speeds are
+    written in knots, as SHARPpy expects (the decoders convert m/s).
+    """
+    out.write("%TITLE%\n")
+    out.write(" {site:<5} {time}\n\n".format(site=site_id, time=valid.strftime("%y%m%d/%H%M")))
+    out.write(SHARPPY_HEADER)
+    out.write("%RAW%\n")
+    levels = levels[np.isfinite(levels["lvl"])]
+    values = np.column_stack([levels[name] for name in SHARPPY_COLUMNS])
+    values = np.where(np.isfinite(values), values, SHARPPY_MISSING)
+    for row in values:
+        out.write("{:>8.2f}, {:>9.2f}, {:>9.2f}, {:>9.2f}, {:>9.2f}, {:>9.2f}\n".format(*row))
+    out.write("%END%\n")
+
+
+def export_sharppy(reader, out_dir=None, archive=None, ref_date=None, stats=None):
+    """
+    Write every sounding in reader (a WMOReader) as a SHARPpy text file,
+    one (time, station) at a time so only one sounding's text is ever in
+    memory. The files go in out_dir, or into the zip file archive if it
+    is given (a file name, or an open zipfile.ZipFile to add them to).
+    Soundings without a TTAA, or that can't be assembled, are counted
+    and skipped (see WMOReader.create_sounding). ref_date is used to fill
+    in the year and month of the record times (see valid_time); it
+    defaults to the date in the reader's file name, then today. Full
+    record times, as in the records merged by WMOIngest.ingest_files,
+    don't need it. Record times that don't exist in that month (or the
+    one before) are skipped. Files are named yymmddhhmm_SITE.txt, using
+    the station table's site ID when there is one and the WMO ID
+    otherwise. Returns the names written.
+    """
+    if ref_date is None: ref_date = default_ref_date(reader.filename)
+    with timer(stats, "decode"):
+        reader.decode_all()
+
+    if isinstance(archive, zipfile.ZipFile):
+        dest = archive
+    elif archive is not None:
+        dest = zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED)
+    else:
+        dest = None
+        os.makedirs(out_dir or ".", exist_ok=True)
+
+    names = []
+    try:
+        for time_str in sorted(reader.records.keys()):
+            valid = valid_time(time_str, ref_date)
+            if valid is None: continue
+            for wmo_id in sorted(reader.records[time_str].keys()):
+                sounding = reader.create_sounding(time_str, wmo_id, skip_errors=True)
+                if sounding is None: continue
+                stn = reader.stations.get(wmo_id)
+                site_id = stn.site_id if stn is not None and stn.site_id else wmo_id
+                name = sharppy_name(site_id, valid)
+
+                with timer(stats, "export"):
+                    if dest is not None:
+                        with io.TextIOWrapper(dest.open(name, "w"), encoding="ascii") as out:
+                            write_sharppy(out, site_id, valid, sounding.levels)
+                    else:
+                        with open(os.path.join(out_dir or ".", name), "w") as out:
+                            write_sharppy(out, site_id, valid, sounding.levels)
+                names.append(name)
+                if stats is not None: stats.count("soundings_exported")
+    finally:
+        if dest is not None and dest is not archive: dest.close()
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export WMO upper air soundings as SHARPpy text files.")
+    parser.add_argument("paths", nargs="+", help="files, directories or glob patterns to read")
+    parser.add_argument("-o", "--out-dir", default=".", help="directory to write the soundings in")
+    parser.add_argument("--zip", default=None, help="write one zip archive instead of separate files")
+    parser.add_argument("--date", default=None, help="date (YYYYMMDD) the record times are in (default: from each file name)")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--pattern", default="*.uair", help="file pattern to use for directories")
+    parser.add_argument("--stations", default=None, help="station table (default: snstns.tbl)")
+    parser.add_argument("--stats", action="store_true", help="print stage timings and counters when done")
+    args = parser.parse_args()
+
+    filenames = find_files(args.paths, args.pattern)
+    stats = WMOStats() if args.stats else None
+    ref_date = datetime.datetime.strptime(args.date, "%Y%m%d").date() if args.date else None
+    ## The parts of a sounding can arrive in different (e.g. hourly)
+    ## files, so the files are merged by full record time first, each
+    ## with the year and month of its own date
+    merged = ingest_files(filenames, processes=args.processes, stations_file=args.stations, decode=True,
+                          ref_date=ref_date, stats=stats)
+    merged.stats = stats
+    names = export_sharppy(merged, out_dir=args.out_dir, archive=args.zip, stats=stats)
+    print("Wrote {num} soundings to {dest}".format(num=len(names), dest=args.zip or args.out_dir))
+    if stats is not None: print(stats.report())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+from WMOMessage import WMOUpperAirMessage
+from WMOStations import get_station_table
+from WMOTokenizer import tokenize_buffer, tokenize_message
+from WMORecords import WMORecordStore, FULL_TIME_FORMAT, full_time, default_ref_date
+from WMOIngest import find_files
+from collections import namedtuple
+import argparse
+import datetime
+import hashlib
+import mmap
+import os
+import sqlite3
+
+## Bump this whenever the layout of the index changes
+INDEX_VERSION = 2
+
+## Bytes at the start of a file that are hashed to tell
+## a file that was appended to from one that was replaced
+HEAD_BYTES = 4096
+
+IndexEntry = namedtuple("IndexEntry", ["filename", "heading", "time", "wmo_id", "msg_type", "code", "start", "end"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    dev INTEGER, ino INTEGER,
+    head TEXT,
+    indexed_to INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    file_id INTEGER NOT NULL REFERENCES files(file_id),
+    time INTEGER NOT NULL,
+    wmo_id TEXT NOT NULL,
+    msg_type TEXT NOT NULL,
+    code TEXT,
+    heading TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_station ON messages (wmo_id, time);
+CREATE INDEX IF NOT EXISTS messages_time ON messages (time);
+CREATE INDEX IF NOT EXISTS messages_file ON messages (file_id, start);
+"""
+
+
+class WMOIndex():
+    def __init__(self, index_file, stations_file=None):
+        """
+        A sidecar SQLite index of the messages in raw bulletin files: the
+        full record time (yyyymmddhhmm, see WMORecords.full_time), WMO ID,
+        message type and correction code of every message that isn't a NIL
+        report, and where to find it (file, byte offset and length). The
+        headings only carry the day of the month, so the year and month
+        come from the date of each file (see add_file), and files from
+        different months don't get mixed up. Build it once with
+        add_file() or add_files(), then use query(), messages() or records()
+        to read just the messages you want without parsing whole files.
+
+        Files are indexed up to their last End Of Transmission ('\\x03'),
+        so adding a file again only reads what was appended since. A file
+        that shrank, was replaced (a different inode) or whose first
+        HEAD_BYTES changed is indexed again from the start.
+        """
+        self.index_file = index_file
+        self.stations = get_station_table(stations_file)
+        self.conn = sqlite3.connect(index_file)
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_VERSION:
+            with self.conn:
+                self.conn.executescript("DROP TABLE IF EXISTS messages; DROP TABLE IF EXISTS files;")
+                self.conn.execute("PRAGMA user_version = {version:d}".format(version=INDEX_VERSION))
+        self.conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def add_files(self, filenames, ref_date=None):
+        """
+        Index (or update the index of) every file in filenames and
+        return the number of messages added.
+        """
+        return sum(self.add_file(filename, ref_date=ref_date) for filename in filenames)
+
+    def add_file(self, filename, ref_date=None):
+        """
+        Index the part of filename that hasn't been indexed yet and
+        return the number of messages added. ref_date fills in the year
+        and month of the record times (see WMORecords.valid_time) and
+        defaults to the date in the file's name, then today. Messages
+        whose time can't be read or doesn't exist are indexed with time -1.
+        """
+        if ref_date is None: ref_date = default_ref_date(filename)
+        path = os.path.abspath(filename)
+        with open(path, "rb") as snfile:
+            stat = os.fstat(snfile.fileno())
+            if stat.st_size == 0: return 0
+            with mmap.mmap(snfile.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                with self.conn:
+                    file_id, start = self._file_entry(path, stat, buf)
+                    ## Only index complete transmissions. The rest is picked
+                    ## up the next time, once the transmission has ended.
+                    end = buf.rfind(b"\x03") + 1
+                    if end <= start: return 0
+                    rows = []
+                    for header, msg_type, wmo_id, msg_start, msg_end in tokenize_buffer(buf, start, end):
+                        time = _full_time(header[2], ref_date) if len(header) > 2 else -1
+                        code = header[3] if len(header) == 4 else None
+                        rows.append((file_id, time, wmo_id, msg_type, code, " ".join(header), msg_start, msg_end))
+                    self.conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                    self.conn.execute("UPDATE files SET head = ?, indexed_to = ? WHERE file_id = ?",
+                                      (_head_hash(buf, end), end, file_id))
+        return len(rows)
+
+    def remove_file(self, filename):
+        path = os.path.abspath(filename)
+        with self.conn:
+            row = self.conn.execute("SELECT file_id FROM files WHERE path = ?", (path,)).fetchone()
+            if row is None: return
+            self.conn.execute("DELETE FROM messages WHERE file_id = ?", row)
+            self.conn.execute("DELETE FROM files WHERE file_id = ?", row)
+
+    def prune(self):
+        """
+        Remove the files that no longer exist from the index.
+        """
+        for (path,) in self.conn.execute("SELECT path FROM files").fetchall():
+            if not os.path.exists(path): self.remove_file(path)
+
+    def query(self, wmo_id=None, time=None, msg_type=None, code=None):
+        """
+        Return an IndexEntry for every indexed message matching all of the
+        given fields, in file order. time is a full record time (a datetime,
+        or yyyymmddhhmm as an integer or string), or a ddhhmm record time to
+        match that day and time in every month. For a synoptic hour (minutes
+        00) the messages sent up to 10 minutes past it are included, the
+        same as WMORecordStore.group_time groups them. msg_type may be a
+        list.
+        """
+        where, args = [], []
+        if wmo_id is not None:
+            where.append("m.wmo_id = ?")
+            args.append(str(wmo_id))
+        if time is not None:
+            if isinstance(time, datetime.datetime): time = time.strftime(FULL_TIME_FORMAT)
+            ## ddhhmm is compared with the end of the full record times
+            column = "m.time" if len(str(time)) > 6 else "m.time % 1000000"
+            time = int(time)
+            if time % 100 == 0:
+                where.append("{col} BETWEEN ? AND ?".format(col=column))
+                args += [time, time + 10]
+            else:
+                where.append("{col} = ?".format(col=column))
+                args.append(time)
+        if msg_type is not None:
+            msg_types = [msg_type] if isinstance(msg_type, str) else list(msg_type)
+            where.append("m.msg_type IN ({marks})".format(marks=", ".join("?" * len(msg_types))))
+            args += msg_types
+        if code is not None:
+            where.append("m.code = ?")
+            args.append(code)
+
+        sql = "SELECT f.path, m.heading, m.time, m.wmo_id, m.msg_type, m.code, m.start, m.end "
+        sql += "FROM messages m JOIN files f ON f.file_id = m.file_id"
+        if len(where) > 0: sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY m.file_id, m.start"
+        return [IndexEntry(*row) for row in self.conn.execute(sql, args)]
+
+    def messages(self, entries=None, **query):
+        """
+        Read the messages of the given IndexEntries (or of query(**query))
+        by seeking straight to them, and return a WMOUpperAirMessage for
+        each, in the same order. Their time_str is the full record time
+        they were indexed under. Nothing is decoded until decode() is
+        called on them.
+        """
+        if entries is None: entries = self.query(**query)
+        messages = []
+        snfile = None
+        try:
+            for entry in entries:
+                if snfile is None or snfile.name != entry.filename:
+                    if snfile is not None: snfile.close()
+                    snfile = open(entry.filename, "rb")
+                snfile.seek(entry.start)
+                tokens = tokenize_message(snfile.read(entry.end - entry.start).decode("latin-1"))
+                if tokens is None: continue
+                wmo_msg = WMOUpperAirMessage(stations=self.stations)
+                wmo_msg.set_header(entry.heading.split(" "))
+                wmo_msg.set_message(tokens)
+                if entry.time >= 0: wmo_msg.time_str = "%012d" % entry.time
+                messages.append(wmo_msg)
+        finally:
+            if snfile is not None: snfile.close()
+        return messages
+
+    def records(self, keep_history=True, **query):
+        """
+        Read the messages of query(**query) into a WMORecordStore, grouping
+        times and resolving retransmissions the same way WMOReader does.
+        The records are keyed by full record time (yyyymmddhhmm), as in
+        WMOReader.merge.
+        """
+        records = WMORecordStore(keep_history=keep_history)
+        for wmo_msg in self.messages(**query):
+            records.add(wmo_msg)
+        return records
+
+    def _file_entry(self, path, stat, buf):
+        """
+        Return the file_id of path and the offset it's indexed to,
+        starting it over if the file isn't the one that was indexed.
+        """
+        head = _head_hash(buf, len(buf))
+        row = self.conn.execute("SELECT file_id, dev, ino, head, indexed_to FROM files WHERE path = ?",
+                                (path,)).fetchone()
+        if row is not None:
+            file_id, dev, ino, old_head, indexed_to = row
+            same_file = (dev, ino) == (stat.st_dev, stat.st_ino) and stat.st_size >= indexed_to
+            if same_file and old_head == _head_hash(buf, indexed_to): return file_id, indexed_to
+            self.conn.execute("DELETE FROM messages WHERE file_id = ?", (file_id,))
+            self.conn.execute("UPDATE files SET dev = ?, ino = ?, head = ?, indexed_to = 0 WHERE file_id = ?",
+                              (stat.st_dev, stat.st_ino, head, file_id))
+            return file_id, 0
+        cursor = self.conn.execute("INSERT INTO files (path, dev, ino, head, indexed_to) VALUES (?, ?, ?, ?, 0)",
+                                   (path, stat.st_dev, stat.st_ino, head))
+        return cursor.lastrowid, 0
+
+
+def _full_time(time_str, ref_date):
+    time_str = full_time(time_str, ref_date)
+    if len(time_str) != 12 or not time_str.isdigit(): return -1
+    return int(time_str)
+
+
+def _head_hash(buf, end):
+    return hashlib.sha1(buf[:min(end, HEAD_BYTES)]).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index raw WMO upper air files and read single messages from them.")
+    parser.add_argument("--index", default="wmo_index.sqlite", help="index file (default: wmo_index.sqlite)")
+    parser.add_argument("--stations", default=None, help="station table (default: snstns.tbl)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="index new files and whatever was appended to indexed ones")
+    add.add_argument("paths", nargs="+", help="files, directories or glob patterns to index")
+    add.add_argument("--pattern", default="*.uair", help="file pattern to use for directories")
+    add.add_argument("--prune", action="store_true", help="drop files that no longer exist from the index")
+    add.add_argument("--date", default=None, help="date (YYYYMMDD) the record times are in (default: from each file name)")
+
+    query = commands.add_parser("query", help="print the matching messages")
+    query.add_argument("--station", default=None, help="WMO ID")
+    query.add_argument("--time", default=None, help="record time (yyyymmddhhmm, or ddhhmm for any month)")
+    query.add_argument("--type", default=None, help="message type (e.g. TTAA)")
+    query.add_argument("--decode", action="store_true", help="print the decoded levels instead of the groups")
+    args = parser.parse_args()
+
+    with WMOIndex(args.index, stations_file=args.stations) as index:
+        if args.command == "add":
+            if args.prune: index.prune()
+            ref_date = datetime.datetime.strptime(args.date, "%Y%m%d").date() if args.date else None
+            nmsgs = index.add_files(find_files(args.paths, args.pattern), ref_date=ref_date)
+            print("Indexed {num} new messages".format(num=nmsgs))
+            return
+        records = index.records(wmo_id=args.station, time=args.time, msg_type=args.type)
+        for time_str in sorted(records.keys()):
+            for wmo_id in sorted(records[time_str].keys()):
+                for msg_type, wmo_msg in sorted(records[time_str][wmo_id].items()):
+                    print(time_str, wmo_id, msg_type, wmo_msg.transmission_code or "")
+                    if args.decode: print(wmo_msg.decode())
+                    else: print(" ".join(wmo_msg.message))
+
+if __name__ == "__main__":
+    main()
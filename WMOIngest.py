@@ -0,0 +1,134 @@
+from WMOParser import WMOReader
+from WMOCache import WMOCache
+from WMOStats import WMOStats, timer
+from WMORecords import default_ref_date
+from multiprocessing import Pool
+import argparse
+import glob
+import os
+
+
+def ingest_files(filenames, processes=None, stations_file=None, decode=False, cache_dir=None, store_dir=None,
+                 ref_date=None, stats=None):
+    """
+    Parse many files of WMO upper air bulletins in a pool of worker
+    processes and merge them into a single WMOReader. Each worker parses
+    one file at a time (and decodes it if decode is True) and sends its
+    records back. The records are merged in the order of filenames, using
+    the same synoptic time grouping and retransmission rules as a single
+    file, so the result doesn't depend on which worker finishes first.
+    Files can span months or years, so the merged records are keyed by
+    full record time (yyyymmddhhmm, see WMOReader.merge), with the year
+    and month taken from ref_date if it's given, otherwise from the date
+    in each file's name (or today).
+    If cache_dir is given, each file's decoded records are read from and
+    stored in a WMOCache there (so they are always decoded). If store_dir
+    is given, the decoded levels of each file are appended to the
+    WMOLevelStore there as soon as the file comes back (so they are always
+    decoded too). The counters and timers of every worker are added to
+    stats (a WMOStats), if one is given.
+    """
+    merged = WMOReader(None, stations_file=stations_file)
+    store = None
+    if store_dir is not None:
+        from WMOStore import WMOLevelStore
+        store = WMOLevelStore(store_dir)
+        decode = True
+    for filename, records in iter_files(filenames, processes=processes, stations_file=stations_file, decode=decode,
+                                        cache_dir=cache_dir, stats=stats):
+        file_ref_date = ref_date or default_ref_date(filename)
+        if store is not None: _store_file(store, records, file_ref_date, stats)
+        merged.merge(records, file_ref_date)
+    return merged
+
+
+def iter_files(filenames, processes=None, stations_file=None, decode=False, cache_dir=None, stats=None):
+    """
+    Parse many files in a pool of worker processes, as ingest_files does,
+    and yield (filename, records) for each one, in the order of filenames,
+    without merging them. The counters and timers of every worker are
+    added to stats (a WMOStats), if one is given.
+    """
+    jobs = [(filename, stations_file, decode, cache_dir, stats is not None) for filename in filenames]
+    if len(jobs) == 0: return
+
+    if processes == 1 or len(jobs) == 1:
+        for job in jobs:
+            filename, records, snapshot = _read_file(job)
+            if snapshot is not None: stats.merge(snapshot)
+            yield filename, records
+        return
+
+    with Pool(processes) as pool:
+        ## imap hands results back in order as they finish, which keeps
+        ## the merge deterministic while the other files are still parsing
+        for filename, records, snapshot in pool.imap(_read_file, jobs, chunksize=1):
+            if snapshot is not None: stats.merge(snapshot)
+            yield filename, records
+
+
+def find_files(paths, pattern="*.uair"):
+    """
+    Expand a list of files, directories and glob patterns into a
+    sorted list of files. Directories are searched for pattern.
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames += glob.glob(os.path.join(path, pattern))
+        elif os.path.exists(path):
+            filenames.append(path)
+        else:
+            filenames += glob.glob(path)
+    return sorted(set(filenames))
+
+
+## WMOCache of each cache directory, kept for the life of the (worker)
+## process so the cache's size is only counted once, not for every file
+_CACHES = {}
+
+
+def _read_file(job):
+    filename, stations_file, decode, cache_dir, counting = job
+    stats = WMOStats() if counting else None
+    if cache_dir is not None:
+        cache = _CACHES.get(cache_dir)
+        if cache is None: cache = _CACHES[cache_dir] = WMOCache(cache_dir)
+        reader = cache.read(filename, stations_file=stations_file, stats=stats)
+    else:
+        reader = WMOReader(filename, stations_file=stations_file, stats=stats)
+        if decode: reader.decode_all()
+    if stats is None: return filename, reader.records, None
+    return filename, reader.records, stats.snapshot()
+
+
+def _store_file(store, records, ref_date, stats):
+    ## Only the parent writes to the store, one file at a time
+    with timer(stats, "store"):
+        nadded = store.add_records(records, ref_date, stats=stats)
+    if stats is not None: stats.count("messages_stored", nadded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse and merge many WMO upper air files in parallel.")
+    parser.add_argument("paths", nargs="+", help="files, directories or glob patterns to read")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--pattern", default="*.uair", help="file pattern to use for directories")
+    parser.add_argument("--stations", default=None, help="station table (default: snstns.tbl)")
+    parser.add_argument("--decode", action="store_true", help="decode every message while ingesting")
+    parser.add_argument("--cache", default=None, help="directory to cache decoded files in")
+    parser.add_argument("--store", default=None, help="level store directory to append the decoded levels to")
+    parser.add_argument("--stats", action="store_true", help="print stage timings and counters when done")
+    args = parser.parse_args()
+
+    filenames = find_files(args.paths, args.pattern)
+    stats = WMOStats() if args.stats else None
+    merged = ingest_files(filenames, processes=args.processes, stations_file=args.stations, decode=args.decode,
+                          cache_dir=args.cache, store_dir=args.store, stats=stats)
+    for tid in sorted(merged.records.keys()):
+        nmsgs = sum(len(msgs) for msgs in merged.records[tid].values())
+        print("Time: {time}\tStations: {nstn}\tMessages: {nmsg}".format(time=tid, nstn=len(merged.records[tid]), nmsg=nmsgs))
+    if stats is not None: print(stats.report())
+
+if __name__ == "__main__":
+    main()
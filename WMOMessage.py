@@ -1,7 +1,44 @@
-import pandas as pd
-import numpy as np
+from WMOStations import WMOStationTable, get_station_table
+from WMOTokenizer import message_groups
+from WMOTables import MISSING, KTS_PER_MS, FLAG_SFC, FLAG_TROP, FLAG_MAXW, MAND_TTAA, MAND_TTCC, MAND_DEFAULT
+
+## Columns of the structured array returned by decode(). Wind speeds
+## (wspd) are always in knots, whatever unit they were reported in
+## (see WMOUpperAirMessage.wind_in_kts). LEVEL_DTYPE
+## (see level_dtype) is only built the first time it's used, so that
+## parsing without decoding never imports NumPy.
+LEVEL_FIELDS = ["lvl", "hght", "tmpc", "dwpc", "wdir", "wspd"]
+_LEVEL_DTYPE = None
+
+
+def level_dtype():
+    """
+    Return the NumPy dtype of the decoded levels (WMOMessage.LEVEL_DTYPE).
+    """
+    global _LEVEL_DTYPE
+    if _LEVEL_DTYPE is None:
+        import numpy as np
+        _LEVEL_DTYPE = np.dtype([(name, "f8") for name in LEVEL_FIELDS] + [("flag", "u1")])
+    return _LEVEL_DTYPE
+
+
+def __getattr__(name):
+    if name == "LEVEL_DTYPE": return level_dtype()
+    raise AttributeError("module {mod!r} has no attribute {name!r}".format(mod=__name__, name=name))
+
+## Bump this whenever a change to the decoders changes their
+## output, so decoded results cached on disk get rebuilt.
+DECODER_VERSION = 2
 
 class WMOUpperAirMessage():
+    MISSING = MISSING
+
+    ## These messages are hard stops - exit the loop.
+    MSG_STOP = ["51515", "41414", "31313"]
+
+    ## These messages are to be ignored - continue the loop
+    MSG_PASS = ["88999","77999"]
+
     def __init__(self, **kwargs):
         self.type = None
         self.message = None
@@ -9,26 +46,82 @@ class WMOUpperAirMessage():
         self.time_str = None
         self.id = None
         self.transmission_code = None
-        self.MISSING = -9999.0
         self.lvl_top = None
-        stations_file = "/home/ldm/SHARP-api/snstns.tbl"
-        table_names = ["Site ID", "WMO ID", "Site Name", "State", "Country", "Latitude", "Longitude", "Elevation", "Flag"]
-        self.stations = kwargs.get("stations_df", None)
+        ## Whether the winds were reported in knots (True) or m/s
+        ## (False), from the day group. None until decoded.
+        self.wind_in_kts = None
+        ## Decoded levels, filled in the first time decode() is called,
+        ## or the error that decoding raised
+        self.levels = None
+        self.decode_error = None
+        ## Station metadata comes from the process-wide station
+        ## table unless one is handed to us. An already opened
+        ## pandas dataframe of stations is still accepted.
+        self.stations = kwargs.get("stations", None)
+        if self.stations is None and kwargs.get("stations_df", None) is not None:
+            self.stations = WMOStationTable.from_dataframe(kwargs["stations_df"])
         if self.stations is None:
-            self.stations = pd.read_fwf(stations_file, comment="!", names=table_names, dtype=str)
-
-        ## These messages are hard stops - exit the loop.
-        self.MSG_STOP = ["51515", "41414", "31313"]
-
-        ## These messages are to be ignored - continue the loop
-        self.MSG_PASS = ["88999","77999"]
-
+            self.stations = get_station_table(kwargs.get("stations_file", None))
+        ## Optional WMOStats for counting station misses and
+        ## decode failures. Nothing is recorded if it's None.
+        self.stats = kwargs.get("stats", None)
+
+
+    def __getstate__(self):
+        ## Copy the groups out of any memory mapped file, and send the
+        ## station table by path so it isn't pickled with every message.
+        self.message
+        state = self.__dict__.copy()
+        if self.stations.stations_file is not None:
+            state["stations"] = self.stations.stations_file
+        ## Hooks can't always be pickled, so stats stay behind
+        state["stats"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("stats", None)
+        self.__dict__.setdefault("decode_error", None)
+        self.__dict__.setdefault("wind_in_kts", None)
+        if isinstance(self.stations, str):
+            self.stations = get_station_table(self.stations)
 
     def set_message(self, message):
         self.type = message[0]
         message = message[1:]
         self.id = message[1]
         self.message = message
+        self.levels = None
+        self.decode_error = None
+
+    def set_message_buffer(self, buf, start, end, msg_type, wmo_id):
+        """
+        Set the message from its offsets within buf, as returned by 
+        WMOTokenizer.tokenize_buffer. The groups are only copied out of
+        buf and split up the first time self.message is used, so buf
+        (usually a memory mapped file) needs to stay open until then.
+        """
+        self.type = msg_type
+        self.id = wmo_id
+        self.message = None
+        self._buffer = buf
+        self._span = (start, end)
+        self.levels = None
+        self.decode_error = None
+
+    @property
+    def message(self):
+        if self._span is not None:
+            self._message = message_groups(self._buffer, *self._span)[1:]
+            self._buffer = None
+            self._span = None
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        self._message = message
+        self._buffer = None
+        self._span = None
 
     def set_header(self, header):
         self.header = header
@@ -36,26 +129,78 @@ class WMOUpperAirMessage():
         if len(header) == 4: self.transmission_code = header[-1]
 
     def decode(self):
-        if self.type in ["TTAA", "TTCC"]:
-            levels = self._decode_mand()
-            #print(self.time_str, self.id, self.type)
-            #for lev in levels: print(lev)
-            return
-
-        if self.type in ["TTBB", "TTDD"]:
-            levels = self._decode_sigt()
-            #print(self.time_str, self.id, self.type)
-            #for lev in levels: print(lev)
-            return
-
-        if self.type in ["PPBB", "PPDD"]:
-            levels = self._decode_sigw()
-            #print(self.time_str, self.id, self.type)
-            #for lev in levels: print(lev)
-            return
+        """
+        Decode the message and return the decoded levels as a NumPy
+        structured array (see LEVEL_DTYPE) with one row per level. 
+        Missing values are NaN and the flag column marks the surface,
+        tropopause and max wind levels. The result is cached on the
+        message, so only the first call does any work. Message types 
+        without a decoder return an empty array. A message that can't be
+        decoded is counted in stats once, and every call raises its error.
+        """
+        if self.levels is not None: return self.levels
+        if self.decode_error is not None: raise self.decode_error
 
+        try:
+            self.levels = self._to_columns(self._decode_levels())
+        except Exception as err:
+            self._decode_failed(err)
+            raise
+        return self.levels
+
+    def _decode_failed(self, err):
+        self.decode_error = err
+        if self.stats is None: return
+        self.stats.count("decode_failures." + str(self.type))
+        self.stats.emit("decode_failure", msg_type=self.type, wmo_id=self.id, error=err)
+
+    def _decode_levels(self, decode_groups=True):
+        """
+        Run the decoder for this message type and return the list of
+        level dictionaries. If decode_groups is False, the temperature
+        and wind groups are left undecoded in the "tt" and "ww" keys of
+        each level so they can be decoded in bulk (see WMOBatch).
+        """
+        if self.type in ["TTAA", "TTCC"]:
+            return self._decode_mand(decode_groups=decode_groups)
+        elif self.type in ["TTBB", "TTDD"]:
+            return self._decode_sigt(decode_groups=decode_groups)
+        elif self.type in ["PPBB", "PPDD"]:
+            return self._decode_sigw(decode_groups=decode_groups)
+        return []
+
+    def _decode_groups(self, res_dicts):
+        """
+        Decode the raw temperature ("tt") and wind ("ww") groups
+        collected by the level decoders, one group at a time.
+        """
+        for res in res_dicts:
+            if "tt" in res: res["tmpc"], res["dwpc"] = self._get_t_and_td_from_rpt(res.pop("tt"))
+            if "ww" in res: res["wdir"], res["wspd"] = self._get_spd_and_dir_from_rpt(res.pop("ww"))
+        return res_dicts
 
-    def _decode_mand(self):
+    def _to_columns(self, res_dicts):
+        """
+        Convert a list of decoded level dictionaries into a structured
+        array, replacing self.MISSING with NaN and converting wind speeds
+        reported in m/s to knots. Levels with neither a pressure nor a
+        height can't be placed in a profile and are dropped.
+        """
+        rows = []
+        for res in res_dicts:
+            if res["lvl"] == self.MISSING and res["hght"] == self.MISSING: continue
+            rows.append((res["lvl"], res["hght"], res["tmpc"], res["dwpc"],
+                         res["wdir"], res["wspd"], res.get("flag", 0)))
+        import numpy as np
+        levels = np.array(rows, dtype=level_dtype())
+        for name in LEVEL_FIELDS:
+            col = levels[name]
+            col[col == self.MISSING] = np.nan
+        if self.wind_in_kts is False: levels["wspd"] *= KTS_PER_MS
+        return levels
+
+
+    def _decode_mand(self, decode_groups=True):
         """
         Decode the TTAA block (mandatory levels) and store the data.
         """
@@ -66,7 +211,7 @@ class WMOUpperAirMessage():
 
         ## Parse the date string to get the day, hour,
         ## and top wind report level
-        day, hour, self.lvl_top, wind_in_kts = self._get_date_and_top_from_rpt(datestr)
+        day, hour, self.lvl_top, self.wind_in_kts = self._get_date_and_top_from_rpt(datestr)
         if self.lvl_top == "/": return res_dicts
 
         ## index 0 is the time string,
@@ -83,9 +228,10 @@ class WMOUpperAirMessage():
             res_dicts.append(res)
             idx += 1
 
+        if decode_groups: self._decode_groups(res_dicts)
         return res_dicts
 
-    def _decode_sigt(self):
+    def _decode_sigt(self, decode_groups=True):
         """
         Decode the TTBB and TTDD blocks (significant levels) and store the data.
         """
@@ -97,7 +243,7 @@ class WMOUpperAirMessage():
 
         ## Parse the date string to get the day, hour,
         ## and in this case, the equipment code (rather than max level)
-        day, hour, equipment_code, wind_in_kts = self._get_date_and_top_from_rpt(datestr)
+        day, hour, equipment_code, self.wind_in_kts = self._get_date_and_top_from_rpt(datestr)
 
         ## index 0 is the time string,
         ## index 1 is the WMO ID
@@ -114,9 +260,10 @@ class WMOUpperAirMessage():
             res_dicts.append(res)
             idx += 2
 
+        if decode_groups: self._decode_groups(res_dicts)
         return res_dicts
 
-    def _decode_sigw(self):
+    def _decode_sigw(self, decode_groups=True):
         """
         Decode the PPBB and PPDD (significant lelels) wind reports and 
         return the data.
@@ -128,7 +275,7 @@ class WMOUpperAirMessage():
 
         ## Parse the date string to get the day, hour,
         ## and in this case, the equipment code (rather than max level)
-        day, hour, equipment_code, wind_in_kts = self._get_date_and_top_from_rpt(datestr)
+        day, hour, equipment_code, self.wind_in_kts = self._get_date_and_top_from_rpt(datestr)
 
         idx = 2
         last_altitude_group = None
@@ -174,6 +321,7 @@ class WMOUpperAirMessage():
                 if h1 != -1 and idx+1 < len(self.message):
                     res = self._lvl_sigw(self.message, idx+1)
                     res["hght"] = 0 if h1 == 0 else h1 / 3.281
+                    if h1 == 0: res["flag"] = FLAG_SFC
                     res_dicts.append(res)
                     inc += 1
 
@@ -201,6 +349,7 @@ class WMOUpperAirMessage():
             idx += inc
             last_altitude_group = rpt
 
+        if decode_groups: self._decode_groups(res_dicts)
         return res_dicts
 
 
@@ -218,8 +367,8 @@ class WMOUpperAirMessage():
         so that in its next iteration, it hits the next mandatory level. 
 
         This function returns a dictionary with the returned pressure, height, temperature,
-        and wind data (as well as some intermediate indices needed while computing) along
-        with the appropriately incremented idx value. 
+        and wind data along with the appropriately incremented idx value. The decoding rules
+        for each level code come from the MAND_TTAA and MAND_TTCC tables in WMOTables.
         """
         code = rpt_list[idx]
 
@@ -235,400 +384,29 @@ class WMOUpperAirMessage():
         else: h1 = int(h1)
 
         if (h1 == self.MISSING): misg = 1
-        ## p1 and p2 are pointers to messages
-        ## trop is a flag (1 or 0) if tropopause is found
-        p1 = 1
-        p2 = 2
-        trop = 0
-
-        ## Python doesn't do switch/case control flow.
-        ## This is my best attempt to reproduce this
-        ## type of control flow from the original NSHARP
-        ## code.
-        switch_ttaa = \
-        {
-            0: 
-            {
-                "lvl": 1000,
-                "hght": h1,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            99: 
-            {
-                "lvl": h1 + 1000 if h1 < 300 else h1,
-                "hght": self._get_stn_elev(self.id), 
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            92: 
-            {
-                "lvl": 925, 
-                "hght": h1,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            85: 
-            {
-                "lvl": 850, 
-                "hght": h1 + 1000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            70: 
-            {
-                "lvl": 700, 
-                "hght": h1 + 3000 if h1 < 500 else h1 + 2000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            50: 
-            {
-                "lvl": 500, 
-                "hght": h1 * 10,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            40: 
-            {
-                "lvl": 400, 
-                "hght": h1 * 10,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            30: 
-            {
-                "lvl": 300, 
-                "hght": (h1 * 10) + 10000 if h1 < 300 else h1 * 10,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            25: 
-            {
-                "lvl": 250, 
-                "hght": (h1 * 10) + 10000 if h1 < 600 else h1 * 10,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            20: 
-            {
-                "lvl": 200, 
-                "hght": (h1 * 10) + 10000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            15: 
-            {
-                "lvl": 150, 
-                "hght": (h1 * 10) + 10000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            10: 
-            {
-                "lvl": 100, 
-                "hght": (h1 * 10) + 10000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            88: 
-            {
-                "lvl": h1, 
-                "hght": self.MISSING,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": 1,
-            },
-            77: 
-            {
-                "lvl": h1, 
-                "hght": self.MISSING,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": -1,
-                "p2": 1,
-                "trop": trop,
-            },
-            66: 
-            {
-                "lvl": h1, 
-                "hght": self.MISSING,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": -1,
-                "p2": 1,
-                "trop": trop,
-            },
-            "default": 
-            {
-                "lvl": self.MISSING,
-                "hght": self.MISSING,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-        }
-        switch_ttcc = \
-        {
-            88: 
-            {
-                "lvl": h1 / 10.0, 
-                "hght": self.MISSING,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": 1,
-            },
-            77: 
-            {
-                "lvl": h1 / 10.0, 
-                "hght": self.MISSING,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": -1,
-                "p2": 1,
-                "trop": trop,
-            },
-            66: 
-            {
-                "lvl": h1 / 10.0, 
-                "hght": self.MISSING,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": -1,
-                "p2": 1,
-                "trop": trop,
-            },
-            70: 
-            {
-                "lvl": 70,
-                "hght": (h1 * 10) + 10000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            50: 
-            {
-                "lvl": 50, 
-                "hght": (h1 * 10) + 10000 if h1 > 800 else (h1 * 10) + 20000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            30: 
-            {
-                "lvl": 30, 
-                "hght": (h1 * 10) + 20000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            20: 
-            {
-                "lvl": 20, 
-                "hght": (h1 * 10) + 20000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            10: 
-            {
-                "lvl": 10, 
-                "hght": (h1 * 10) + 30000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            7: 
-            {
-                "lvl": 7, 
-                "hght": (h1 * 10) + 30000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            5: 
-            {
-                "lvl": 5, 
-                "hght": (h1 * 10) + 30000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            3: 
-            {
-                "lvl": 3, 
-                "hght": (h1 * 10) + 30000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            2: 
-            {
-                "lvl": 2, 
-                "hght": (h1 * 10) + 40000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            1: 
-            {
-                "lvl": 1, 
-                "hght": (h1 * 10) + 40000,
-                "tmpc": self.MISSING,
-                "dwpc": self.MISSING,
-                "wdir": self.MISSING,
-                "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-            "default": 
+
+        ## Look up how to decode this level code. The tables are 
+        ## shared by all messages, so this is a single lookup. The
+        ## only other time this function should be called is if
+        ## self.type == "TTCC"
+        table = MAND_TTAA if self.type == "TTAA" else MAND_TTCC
+        entry = table.get(l1, MAND_DEFAULT)
+
+        if (misg): hght = self.MISSING
+        elif entry.hght is None: hght = self._get_stn_elev(self.id)
+        else: hght = entry.hght(h1)
+
+        res = \
             {
-                "lvl": self.MISSING,
-                "hght": self.MISSING,
+                "lvl": entry.lvl(h1),
+                "hght": hght,
                 "tmpc": self.MISSING,
                 "dwpc": self.MISSING,
                 "wdir": self.MISSING,
                 "wspd": self.MISSING,
-                "p1": p1,
-                "p2": p2,
-                "trop": trop,
-            },
-        }
-
+                "flag": entry.flag,
+            }
         inc = 0
-        ## Now we get the result of the switch
-        ## by calling the dictionary. If the key isn't found,
-        ## use the default case.
-        if self.type == "TTAA":
-            switch = switch_ttaa
-        ## The only other time this function
-        ## should be called is if self.type == "TTCC"
-        else:
-            switch = switch_ttcc
-
-        try:
-            res = switch[l1]
-        except:
-            res = switch["default"]
-
-        if (misg): res["hght"] = self.MISSING 
 
         if res["lvl"] == self.MISSING and res["hght"] == self.MISSING:
             return res, idx
@@ -636,45 +414,37 @@ class WMOUpperAirMessage():
         ## Decode the temperature and dewpoint data.
         ## p1 points to the next message which should contain temperature and dewpoint data
         ## p2 points to the message which should contain wind data
-        if res["p1"] > 0:
-            loc = idx + res["p1"]
+        if entry.p1 > 0:
+            loc = idx + entry.p1
             if loc >= len(rpt_list):
                 return res, loc
             rpt = rpt_list[loc]
 
-            tmpc, dwpc = self._get_t_and_td_from_rpt(rpt)
-
-            ## Assign the values to the output dictionary
-            res["tmpc"] = tmpc
-            res["dwpc"] = dwpc
+            ## Keep the temperature group to be decoded 
+            ## later by _decode_groups
+            res["tt"] = rpt
             inc += 1
 
         ## Decode the wind speed and direction data.
-        if res["lvl"] >= self.lvl_top or res["p2"] == 1 or res["trop"] == 1:
-            loc = idx + res["p2"]
+        if res["lvl"] >= self.lvl_top or entry.p2 == 1 or entry.trop == 1:
+            loc = idx + entry.p2
             if loc >= len(rpt_list):
                 return res, loc
             rpt = rpt_list[loc]
 
-            wdir, wspd = self._get_spd_and_dir_from_rpt(rpt)
-
-            ## Assign the values to the output dictionary
-            res["wspd"] = wspd
-            res["wdir"] = wdir
+            ## Keep the wind group to be decoded 
+            ## later by _decode_groups
+            res["ww"] = rpt
             inc += 1
 
         elif res["lvl"] < self.lvl_top and res["hght"] != self.MISSING:
-            wdir, wspd = self._get_spd_and_dir_from_rpt(rpt)
-
-            ## Assign the values to the output dictionary
-            res["wspd"] = wspd
-            res["wdir"] = wdir
+            res["ww"] = rpt
             inc += 1
 
         ## When dealing with the max wind group, we need
         ## to check for the presence of a wind shear code
         ## in order to increment properly
-        if l1 == 77 or l1 == 66:
+        if entry.flag == FLAG_MAXW:
             if idx + 2 < len( rpt_list ): 
                 rpt = rpt_list[idx + 2]
                 if rpt.startswith("4"): inc += 1
@@ -724,6 +494,7 @@ class WMOUpperAirMessage():
         ## The surface pressure may need modification so take care of that
         if sigidx == "00":
             lvl = lvl + 1000 if lvl < 300 else lvl
+            if self.type == "TTBB": res["flag"] = FLAG_SFC
         ## Significant levels when pressure > 1000 hPa
         elif self.type == "TTBB" and lvl < 100:
             lvl = lvl + 1000
@@ -731,16 +502,11 @@ class WMOUpperAirMessage():
         data = rpt_list[idx+1]
         ## The TTBB/TTDD blocks can have wind info 
         ## on pressure surface in them because reasons
+        res["lvl"] = lvl
         if not additional_winds:
-            tmpc, dwpc = self._get_t_and_td_from_rpt(data)
-            res["lvl"] = lvl
-            res["tmpc"] = tmpc
-            res["dwpc"] = dwpc
+            res["tt"] = data
         else:
-            wdir, wspd = self._get_spd_and_dir_from_rpt(data)
-            res["lvl"] = lvl
-            res["wdir"] = wdir
-            res["wspd"] = wspd
+            res["ww"] = data
 
         return res
 
@@ -749,32 +515,30 @@ class WMOUpperAirMessage():
         Parse a PPBB or PPDD wind report.
         """
 
-        rpt = messages[idx]
-
-        wdir, wspd = self._get_spd_and_dir_from_rpt(rpt)
-
         res = \
             {
-                "lvl": -999,
-                "hght": -999,
-                "tmpc": -999,
-                "dwpc": -999,
-                "wdir": wdir,
-                "wspd": wspd,
+                "lvl": self.MISSING,
+                "hght": self.MISSING,
+                "tmpc": self.MISSING,
+                "dwpc": self.MISSING,
+                "wdir": self.MISSING,
+                "wspd": self.MISSING,
+                "ww": messages[idx],
             }
         return res
     
     def _get_stn_elev(self, wmo_id):
-        try:
-            elev = float(self.stations[self.stations["WMO ID"] ==  str(wmo_id)]["Elevation"])
-            return elev
-        except:
-            print(self.stations[self.stations["WMO ID"] == str(wmo_id)])
-            print("Unable to find station: ", wmo_id)
+        elev = self.stations.elevation(wmo_id)
+        if elev is None:
+            if self.stats is not None:
+                self.stats.count("station_misses")
+                self.stats.emit("station_miss", wmo_id=wmo_id)
             return 0
-            
+        return elev
+
 
-    def _get_t_and_td_from_rpt(self, rpt):
+    @classmethod
+    def _get_t_and_td_from_rpt(cls, rpt):
         """
         Parse a text string containing temperature
         and dewpoint depression information and return
@@ -783,7 +547,7 @@ class WMOUpperAirMessage():
 
         ## decode the temperature data. Fill with
         ## a missing value if necessary.
-        if "/" in rpt[:3] or "\\" in rpt[:3]: tmpc = self.MISSING 
+        if "/" in rpt[:3] or "\\" in rpt[:3]: tmpc = cls.MISSING 
         else: 
             tmpc = float(rpt[:3] ) / 10.0
             if int(rpt[:3]) % 2: tmpc *= -1
@@ -791,25 +555,26 @@ class WMOUpperAirMessage():
         ## Decode the dewpoint data. Fill with
         ## a missing value if necessary
         if "/" in rpt[3:] or "\\" in rpt[3:]: 
-            dewpoint_depression = self.MISSING 
+            dewpoint_depression = cls.MISSING 
         else: 
             dewpoint_depression = float(rpt[3:])
             if (dewpoint_depression <= 55.0): dewpoint_depression *= .1
             else: dewpoint_depression -= 50.0
 
-        if dewpoint_depression == self.MISSING: dwpc = self.MISSING
+        if dewpoint_depression == cls.MISSING or tmpc == cls.MISSING: dwpc = cls.MISSING
         else: dwpc = tmpc - dewpoint_depression
         return tmpc, dwpc
 
-    def _get_spd_and_dir_from_rpt(self, rpt):
+    @classmethod
+    def _get_spd_and_dir_from_rpt(cls, rpt):
         """
         Parse a text string containing wind speed
         and direction information and return the
         decoded values.
         """
         if "/" in rpt or "\\" in rpt: 
-            wspd = self.MISSING
-            wdir = self.MISSING
+            wspd = cls.MISSING
+            wdir = cls.MISSING
             return wdir, wspd
         ## Wind direction. 
         wdir = float(rpt[:3])
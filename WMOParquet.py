@@ -0,0 +1,242 @@
+from WMOParser import WMOReader
+from WMOMessage import LEVEL_FIELDS, LEVEL_DTYPE
+from WMORecords import valid_time, default_ref_date
+from WMOIngest import find_files
+from WMOStats import WMOStats, timer
+from multiprocessing import Pool
+import numpy as np
+import argparse
+import datetime
+import os
+import tempfile
+
+## Columns of the exported tables, in order. time is the record time,
+## code the heading correction code of the message ("" if it has none).
+PARQUET_COLUMNS = ["time", "station", "msg_type", "code"] + LEVEL_FIELDS + ["flag"]
+
+## Columns the output can be partitioned by
+PARTITION_KEYS = ["date", "station"]
+
+
+def level_columns(records, ref_date):
+    """
+    Flatten the decoded levels of a WMOReader's records into a dictionary
+    of NumPy columns (see PARQUET_COLUMNS), one row per level, in record
+    order. ref_date fills in the year and month of the record times (see
+    WMORecords.valid_time). Record times that don't exist, and messages
+    that couldn't be decoded (see WMOReader.decode_all), are left out.
+    """
+    arrays, counts = [], []
+    times, stations, types, codes = [], [], [], []
+    for time_str in records.keys():
+        valid = valid_time(time_str, ref_date)
+        if valid is None: continue
+        valid = np.datetime64(valid, "s")
+        for wmo_id in records[time_str].keys():
+            for msg_type, wmo_msg in records[time_str][wmo_id].items():
+                levels = wmo_msg.levels
+                if levels is None or len(levels) == 0: continue
+                arrays.append(levels)
+                counts.append(len(levels))
+                times.append(valid)
+                stations.append(wmo_id)
+                types.append(msg_type)
+                codes.append(wmo_msg.transmission_code or "")
+
+    columns = {
+        "time": np.repeat(np.array(times, dtype="datetime64[s]"), counts),
+        "station": np.repeat(np.array(stations, dtype=object), counts),
+        "msg_type": np.repeat(np.array(types, dtype=object), counts),
+        "code": np.repeat(np.array(codes, dtype=object), counts),
+    }
+    levels = np.concatenate(arrays) if len(arrays) > 0 else np.zeros(0, dtype=LEVEL_DTYPE)
+    for name in LEVEL_FIELDS + ["flag"]:
+        columns[name] = np.ascontiguousarray(levels[name])
+    return columns
+
+
+def to_arrow(columns, drop=()):
+    """
+    Return the columns from level_columns, except the ones in drop, as a
+    pyarrow Table. The string columns are dictionary encoded, since they
+    repeat for every level of a message.
+    """
+    pa = _import_pyarrow()
+    names = [name for name in PARQUET_COLUMNS if name not in drop]
+    arrays = []
+    for name in names:
+        if columns[name].dtype == object:
+            arrays.append(pa.array(columns[name].tolist(), type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[name]))
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def read_dataset(out_dir):
+    """
+    Open a directory written by export_parquet (or write_parquet) as a
+    pyarrow.dataset.Dataset. The partition keys are read from the
+    directory names as strings, so station IDs keep their leading zeros.
+    Partitions that aren't there are left out of the schema.
+    """
+    pa = _import_pyarrow()
+    import pyarrow.dataset as ds
+    keys = []
+    for key in PARTITION_KEYS:
+        for dirpath, dirnames, filenames in os.walk(out_dir):
+            if any(name.startswith(key + "=") for name in dirnames):
+                keys.append(key)
+                break
+    partitioning = ds.partitioning(pa.schema([(key, pa.string()) for key in keys]), flavor="hive")
+    return ds.dataset(out_dir, format="parquet", partitioning=partitioning)
+
+
+def partition_rows(columns, partition_by):
+    """
+    Return a dictionary of partition values (a tuple with one value per
+    key in partition_by) -> row indices of columns, in order.
+    """
+    if len(partition_by) == 0: return {(): np.arange(len(columns["time"]))}
+    keys = []
+    for key in partition_by:
+        if key == "date":
+            keys.append(np.datetime_as_string(columns["time"], unit="D"))
+        elif key == "station":
+            keys.append(columns["station"].astype(str))
+        else:
+            raise ValueError("Can't partition by {key!r}, only by {keys}".format(key=key, keys=PARTITION_KEYS))
+
+    ## Rows come grouped by record time and station, so this is a
+    ## handful of np.unique calls, not a Python loop over every row.
+    combined = keys[0].astype(object)
+    for extra in keys[1:]: combined = combined + "/" + extra.astype(object)
+    values, inverse = np.unique(combined.astype(str), return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(values) + 1))
+    parts = {}
+    for idx, value in enumerate(values):
+        parts[tuple(value.split("/"))] = order[bounds[idx]:bounds[idx + 1]]
+    return parts
+
+
+def write_parquet(columns, out_dir, name, partition_by=("date", "station"), row_group_size=1 << 16,
+                  compression="zstd"):
+    """
+    Write columns (from level_columns) under out_dir as Parquet files
+    named name + ".parquet", one per partition in Hive layout (e.g.
+    date=2022-07-14/station=72403/), in row groups of row_group_size rows.
+    Every file is written to a temporary file first and moved into place,
+    so a file that's exported again replaces its old partitions. As with
+    pyarrow.parquet.write_to_dataset, the partition columns are only in
+    the directory names, not in the files (see read_dataset). Returns
+    the paths written.
+    """
+    pq = _import_pyarrow("parquet")
+    drop = [key for key in partition_by if key in PARQUET_COLUMNS]
+    paths = []
+    for values, rows in partition_rows(columns, list(partition_by)).items():
+        part_dir = os.path.join(out_dir, *["{key}={value}".format(key=key, value=value)
+                                           for key, value in zip(partition_by, values)])
+        os.makedirs(part_dir, exist_ok=True)
+        table = to_arrow({col: columns[col][rows] for col in PARQUET_COLUMNS}, drop=drop)
+        path = os.path.join(part_dir, name + ".parquet")
+
+        fd, tmp_name = tempfile.mkstemp(dir=part_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp_name, row_group_size=row_group_size, compression=compression)
+            os.replace(tmp_name, path)
+        finally:
+            if os.path.exists(tmp_name): os.remove(tmp_name)
+        paths.append(path)
+    return paths
+
+
+def export_parquet(filenames, out_dir, processes=None, stations_file=None, ref_date=None,
+                   partition_by=("date", "station"), row_group_size=1 << 16, stats=None):
+    """
+    Decode every file in filenames and write its levels as partitioned
+    Parquet files under out_dir (see write_parquet), one file at a time
+    in a pool of worker processes, so only the files being worked on are
+    ever in memory. Each file's output is named after the file, so
+    exporting a file again replaces it. Retransmissions are resolved
+    within each file only; the code column tells versions from different
+    files apart. ref_date fills in the year and month of the record times
+    and defaults to the date in each file's name, then today. Returns the
+    paths written, in the order of filenames.
+
+    Needs pyarrow, which is only imported when this is called.
+    """
+    _import_pyarrow("parquet")
+    jobs = [(filename, out_dir, stations_file, ref_date, tuple(partition_by), row_group_size, stats is not None)
+            for filename in filenames]
+    if len(jobs) == 0: return []
+
+    paths = []
+    if processes == 1 or len(jobs) == 1:
+        for file_paths, snapshot in map(_export_file, jobs):
+            if snapshot is not None: stats.merge(snapshot)
+            paths += file_paths
+        return paths
+
+    with Pool(processes) as pool:
+        for file_paths, snapshot in pool.imap(_export_file, jobs, chunksize=1):
+            if snapshot is not None: stats.merge(snapshot)
+            paths += file_paths
+    return paths
+
+
+def _export_file(job):
+    filename, out_dir, stations_file, ref_date, partition_by, row_group_size, counting = job
+    stats = WMOStats() if counting else None
+    if ref_date is None: ref_date = default_ref_date(filename)
+    reader = WMOReader(filename, stations_file=stations_file, stats=stats)
+    reader.decode_all()
+    with timer(stats, "export"):
+        columns = level_columns(reader.records, ref_date)
+        name = os.path.splitext(os.path.basename(filename))[0]
+        paths = write_parquet(columns, out_dir, name, partition_by=partition_by, row_group_size=row_group_size)
+    if stats is None: return paths, None
+    stats.count("levels_exported", len(columns["time"]))
+    return paths, stats.snapshot()
+
+
+def _import_pyarrow(module=None):
+    """
+    pyarrow is optional and only needed for the Parquet export.
+    """
+    try:
+        import pyarrow
+        if module == "parquet":
+            import pyarrow.parquet
+            return pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise ImportError("The Parquet export needs pyarrow (pip install pyarrow)") from None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export decoded WMO upper air levels as partitioned Parquet files.")
+    parser.add_argument("paths", nargs="+", help="files, directories or glob patterns to read")
+    parser.add_argument("-o", "--out-dir", required=True, help="directory to write the dataset in")
+    parser.add_argument("--date", default=None, help="date (YYYYMMDD) the record times are in (default: from each file name)")
+    parser.add_argument("--partition", default="date,station", help="comma separated partition keys (date, station or none)")
+    parser.add_argument("--row-group-size", type=int, default=1 << 16, help="rows per Parquet row group")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--pattern", default="*.uair", help="file pattern to use for directories")
+    parser.add_argument("--stations", default=None, help="station table (default: snstns.tbl)")
+    parser.add_argument("--stats", action="store_true", help="print stage timings and counters when done")
+    args = parser.parse_args()
+
+    filenames = find_files(args.paths, args.pattern)
+    stats = WMOStats() if args.stats else None
+    ref_date = datetime.datetime.strptime(args.date, "%Y%m%d").date() if args.date else None
+    partition_by = [key for key in args.partition.split(",") if key and key != "none"]
+    paths = export_parquet(filenames, args.out_dir, processes=args.processes, stations_file=args.stations,
+                           ref_date=ref_date, partition_by=partition_by, row_group_size=args.row_group_size,
+                           stats=stats)
+    print("Wrote {num} files to {dest}".format(num=len(paths), dest=args.out_dir))
+    if stats is not None: print(stats.report())
+
+if __name__ == "__main__":
+    main()
@@ -1,238 +1,463 @@
 from WMOMessage import WMOUpperAirMessage
-#from WMOData import WMOSounding
-import pandas as pd
-import numpy as np
+from WMOStations import get_station_table
+from WMOTokenizer import tokenize, tokenize_buffer
+from WMOStats import WMOStats, timer
+from WMORecords import WMORecordStore, full_time
 import sys, os
-import glob
+import mmap
+
+## NumPy (WMOBatch, WMOData) and multiprocessing are imported where
+## they're used, so parsing a single bulletin starts up quickly.
 
 class WMOReader():
-    def __init__(self, filename):
+    def __init__(self, filename, stations_file=None, stream=False, chunk_size=1 << 20, use_mmap=False, processes=None, follow=False, stats=None, keep_history=True):
+        """
+        Read and parse a file of WMO upper air bulletins. If filename is
+        None, the reader starts with empty records that can be filled with
+        merge() (see WMOIngest). If stream is
+        True, nothing is read up front - use iter_messages() to read the
+        file chunk_size characters at a time and receive decoded messages
+        one transmission at a time.
+
+        If use_mmap is True, the file is memory mapped and parsed as bytes.
+        Messages only keep the offsets of their groups in the mapping until
+        they are decoded, so the file stays mapped until close() is called.
+
+        If processes is more than 1, the file is split into that many
+        chunks at transmission boundaries and each chunk is tokenized in a
+        worker process. The records are then rebuilt in file order, so
+        they're exactly the same as reading the file serially, and the
+        messages in them are decoded in the workers (see decode_all).
+
+        If follow is True, the file is treated as one that is still being
+        written to (e.g. by an LDM pqact FILE action). Only complete
+        transmissions are read, and update() picks up whatever has been
+        appended since the last call.
+
+        stats is an optional WMOStats that collects stage timings and
+        counters and receives the events (e.g. unknown stations) that
+        used to be printed. Nothing is counted or printed without one.
+
+        The messages are kept in self.records, a WMORecordStore. Unless
+        keep_history is False, it also keeps every retransmission that was
+        replaced or ignored (see WMORecordStore.superseded).
+        """
         self.filename = filename
-        self.headers = ["TTAA", "TTBB", "PPBB", "PPDD", "TTCC", "TTDD", "PPAA", "PPCC"]
-        self.ignore = ["", "\n\n\n", "\n\n", [""], [], "\n"]
-        self.transmissions = []
-        self.records = {}
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.use_mmap = use_mmap
+        self.processes = processes
+        self.follow = follow
+        ## Follow mode: byte offset just past the last complete
+        ## transmission read, and the identity of the file it's in
+        self.offset = 0
+        self._file_id = None
+        self.stats = stats
+        self._mmap = None
+        self.records = WMORecordStore(keep_history=keep_history)
         self.text = None
-        stations_file = "/home/ldm/SHARP-api/snstns.tbl"
-        table_names = ["Site ID", "WMO ID", "Site Name", "State", "Country", "Latitude", "Longitude", "Elevation", "Flag"]
-        self.stations = pd.read_fwf(stations_file, comment="!", names=table_names, dtype=str)
-        with open(self.filename, "r", newline="") as snfile:
-            print("FILE: ", self.filename)
-            self._parse(snfile.read())
+        ## Station metadata is parsed once per process and
+        ## shared by every reader and message.
+        self.stations = get_station_table(stations_file)
+        if self.filename is None or self.stream: return
+
+        if self.stats is not None: self.stats.emit("file", filename=self.filename)
+        if self.follow:
+            self.update()
+            return
+
+        if self.processes is not None and self.processes > 1:
+            self._parse_parallel()
+            return
+
+        if self.use_mmap:
+            with open(self.filename, "rb") as snfile:
+                ## Empty files can't be mapped
+                if os.fstat(snfile.fileno()).st_size == 0: return
+                self._mmap = mmap.mmap(snfile.fileno(), 0, access=mmap.ACCESS_READ)
+            self._parse_buffer(self._mmap)
+            return
+
+        with timer(self.stats, "read"):
+            with open(self.filename, "r", newline="") as snfile:
+                text = snfile.read()
+        self._parse(text)
+
+        ## Messages are only tokenized and indexed here. Decoding
+        ## is deferred until a message is asked for with decode().
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Release the memory mapped file (use_mmap=True). Any message that
+        hasn't been decoded yet has its groups copied out first, so the
+        records stay usable.
+        """
+        if self._mmap is None: return
+        for tid in self.records.keys():
+            for sid in self.records[tid].keys():
+                for wmo_msg in self.records[tid][sid].values():
+                    wmo_msg.message
+        self._mmap.close()
+        self._mmap = None
 
-        for tid in list(self.records.keys()):
-            for sid in list(self.records[tid].keys()):
-                #snd = self.create_sounding(tid, sid)
-                #if snd is None: continue
-                for msg in self.records[tid][sid].keys():
-                    wmo_msg = self.records[tid][sid][msg]
-                    print(self.filename, tid, sid, msg) 
-                    wmo_msg.decode()
-                #print("Time: {time}\tSite ID: {sid}".format(time=tid, sid=sid))
+    def merge(self, records, ref_date=None):
+        """
+        Merge the records of another reader (time -> station -> type)
+        into this one. Times are grouped and retransmissions resolved
+        the same way as messages read from a file, in the order they
+        appear in records. If records is a WMORecordStore, its history
+        of superseded messages is merged too.
+
+        Record times only carry the day of the month, so records from
+        different months would be mixed up. If ref_date is given (see
+        WMORecords.valid_time), the messages are filed under their full
+        record time (yyyymmddhhmm, see WMORecords.full_time) instead.
+        """
+        for tid in records.keys():
+            for sid in records[tid].keys():
+                for wmo_msg in records[tid][sid].values():
+                    if ref_date is not None: wmo_msg.time_str = full_time(wmo_msg.time_str, ref_date)
+                    self._add_message(wmo_msg)
+        if isinstance(records, WMORecordStore): self.records.add_history(records)
+
+    def update(self):
+        """
+        Follow mode: read the complete transmissions appended to the file
+        since the last update and add them to the records. Returns a list
+        of (time_str, wmo_id, msg_type, status) tuples, in file order,
+        for every record entry that changed, where status is "added" for
+        a new entry or "replaced" when a retransmission replaced the old
+        message. A trailing transmission without its End Of Transmission
+        ('\x03') character is left for the next update. If the file has
+        been truncated or replaced, the records are cleared and the file
+        is read again from the start.
+        """
+        with timer(self.stats, "read"), open(self.filename, "rb") as snfile:
+            stat = os.fstat(snfile.fileno())
+            file_id = (stat.st_dev, stat.st_ino)
+            if file_id != self._file_id or stat.st_size < self.offset:
+                self.records = WMORecordStore(keep_history=self.records.keep_history)
+                self.offset = 0
+                self._file_id = file_id
+            snfile.seek(self.offset)
+            data = snfile.read(stat.st_size - self.offset)
+
+        end = data.rfind(b"\x03")
+        if end == -1: return []
+        self.offset += end + 1
+
+        return self.add_text(data[:end + 1].decode("latin-1"))
+
+    def add_text(self, text):
+        """
+        Parse raw bulletin text (one or more complete transmissions) and
+        add its messages to the records. Returns the entries that changed,
+        the same as update().
+        """
+        changes = []
+        with timer(self.stats, "parse"):
+            for wmo_msg in self._messages_from_text(text):
+                status = self._add_message(wmo_msg)
+                if status is not None:
+                    changes.append((wmo_msg.time_str, wmo_msg.id, wmo_msg.type, status))
+        return changes
+
+    def get_message(self, time_str, wmo_id, msg_type):
+        """
+        Return the WMOUpperAirMessage for the given record time, WMO ID
+        and message type (e.g. TTAA), or None if it isn't in the file.
+        """
+        return self.records.get_message(time_str, wmo_id, msg_type)
+
+    def decode(self, time_str, wmo_id, msg_type):
+        """
+        Decode and return the levels of a single message, or None if
+        the message isn't in the file. The decoded levels are cached
+        on the message, so asking again is free.
+        """
+        wmo_msg = self.get_message(time_str, wmo_id, msg_type)
+        if wmo_msg is None: return None
+        return wmo_msg.decode()
+
+    def decode_all(self, batch=True):
+        """
+        Decode every message in the record. By default the temperature
+        and wind groups of the whole file are decoded together with
+        NumPy (see WMOBatch.decode_messages); pass batch=False to decode
+        each message on its own. Either way the results are the same: a
+        message that can't be decoded is counted in stats and left
+        undecoded (decode() raises its error), and the rest are decoded.
+        Returns the messages that couldn't be decoded.
+        """
+        messages = [wmo_msg for tid in self.records.keys()
+                            for sid in self.records[tid].keys()
+                            for wmo_msg in self.records[tid][sid].values()]
+        with timer(self.stats, "decode"):
+            if batch:
+                from WMOBatch import decode_messages
+                decode_messages(messages)
+            else:
+                for wmo_msg in messages:
+                    try:
+                        wmo_msg.decode()
+                    except Exception:
+                        pass
+        return [wmo_msg for wmo_msg in messages if wmo_msg.levels is None]
 
-    def create_sounding(self, record_time, site_id):
+    def create_sounding(self, record_time, site_id, skip_errors=False):
         """
         For a given record time and site id, construct 
         and return a WMOSounding object. If no TTAA message
         is found, which is required to construct a full profile,
-        then print a warning and return None. 
+        then report it (see WMOStats) and return None. The messages are merged
+        into a single profile (see WMOSounding.assemble). If skip_errors
+        is True, a sounding that can't be assembled is reported the same
+        way and None is returned, so one bad station doesn't stop a loop
+        over all of them; otherwise the error is raised.
         """
         record = self.records[record_time][site_id]
         if "TTAA" not in list(record.keys()):
-            warning = "WARNING: Skipping {time}/{id} because no TTAA message was found."
-            warning += "\nMessages in the record: {msgs}"
-            warning += "\nFilename: {fname}"
-            warning = warning.format(time=record_time, id=site_id, msgs=list(record.keys()), fname=self.filename)
-            print(warning)
+            if self.stats is not None:
+                self.stats.count("soundings_skipped")
+                self.stats.emit("no_ttaa", time_str=record_time, wmo_id=site_id,
+                                messages=list(record.keys()), filename=self.filename)
+            return None
+        from WMOData import WMOSounding
+        sounding = WMOSounding(time_str=record_time, wmo_id=site_id, messages=record, stations=self.stations)
+        try:
+            with timer(self.stats, "assemble"):
+                sounding.assemble()
+        except Exception as err:
+            if not skip_errors: raise
+            if self.stats is not None:
+                self.stats.count("soundings_failed")
+                self.stats.emit("sounding_failure", time_str=record_time, wmo_id=site_id, error=err,
+                                filename=self.filename)
             return None
-        sounding = WMOSounding()
-        sounding.messages = record
-        sounding.time_str = record_time
-        sounding.wmo_id = site_id
         return sounding
 
     def _add_time_to_record(self, time_str):
         """
-        Add a new time entry to the record. When corrected broadcasts
-        are sent, sometimes the headers list the time as a few minutes 
-        past the hour. This handles grouping the times to the synoptic 
-        hour if the time is past (not before) and returns the proper
-        time_str if corrected. 
-        """
-
-        ## If there are times in the record, compare the
-        ## record and the current time to determine which
-        ## one corresponds to the synoptic time.
-        times = list(self.records.keys())
-        for time in times:
-            ## Check to see if the times are from the same day/hour
-            if time.startswith(time_str[:4]):
-                ## Which one is the synoptic time?
-                if time[-2:] == "00": 
-                    synop = time
-                    other = time_str
-                else: 
-                    synop = time_str
-                    other = time
-                remainder = abs(int(synop[-2:]) - int(other[-2:]))
-                if remainder <= 10: time_str = synop
-        try:
-            data = self.records[time_str] 
-        except:
-            self.records[time_str] = {}
-        return time_str
-
-    def _add_stn_to_record(self, time_str, wmo_num):
-        try: 
-            data = self.records[time_str]
-            stn = data[wmo_num]
-        except:
-            data = self.records[time_str]
-            data[wmo_num] = {}
+        Add a new time entry to the record, grouping times a few
+        minutes past the synoptic hour with it (see 
+        WMORecordStore.group_time), and return the record time.
+        """
+        return self.records.add_time(time_str)
+
+    def iter_transmissions(self):
+        """
+        Read the file chunk_size characters at a time and yield the raw
+        text of one transmission at a time (without its End Of Transmission
+        '\x03' character) as the end of it is found. Nothing is stored on
+        the reader, so memory use is bounded by the largest transmission.
+        """
+        buf = ""
+        with open(self.filename, "r", newline="") as snfile:
+            while True:
+                chunk = snfile.read(self.chunk_size)
+                if not chunk: break
+                buf += chunk
+                if "\x03" not in chunk: continue
+
+                ## Everything after the last end of transmission 
+                ## marker is carried over to the next chunk
+                transmissions = buf.split("\x03")
+                buf = transmissions.pop()
+                yield from transmissions
+
+        if buf: yield buf
+
+    def iter_messages(self, decode=True):
+        """
+        Stream the file and yield a WMOUpperAirMessage for every message
+        in it, in file order, decoding each one first unless decode is
+        False. Nothing is added to self.records, so every retransmission
+        is yielded - compare transmission_code to pick which one to keep.
+        Times are still grouped to the synoptic hour the same way as when
+        the whole file is parsed, using an index of the record times seen
+        so far that only lives as long as the generator. As in decode_all,
+        a message that can't be decoded is counted in stats and yielded
+        undecoded (its levels are None), so it doesn't end the stream.
+        """
+        times = WMORecordStore(keep_history=False)
+        for transmission in self.iter_transmissions():
+            for wmo_msg in self._messages_from_text(transmission):
+                wmo_msg.time_str = times.add_time(wmo_msg.time_str)
+                if decode:
+                    try:
+                        wmo_msg.decode()
+                    except Exception:
+                        pass
+                yield wmo_msg
 
     def _parse(self, text):
         """
         Parses the supplied raw text and creates instances of WMOUpperAirMessage
-        and appending the messages to self.messages
-        """
-        self._parse_for_transmissions(text)
-
-        for tidx in range(len(self.transmissions)):
-            header, messages = self._format_messages(self.transmissions[tidx])
-            
-            ## Iterate over the formatted messages
-            for message in messages:
-                ## These messages usually are NIL transmissions
-                if len(message) <= 2: continue
-                ## Check a little more explicitly for NIL transmissions
-                ## just in case...
-                missing = False
-                if message[0].upper() in ["/////", "MISDA", "SUSPENDED", "NIL", "NILL", "NNNN", "XMTD", "@"]: continue
-                if message[1].upper() in ["/////", "MISDA", "SUSPENDED", "NIL", "NILL", "NNNN", "XMTD", "@"]: continue
-
-
-                ## Construct a WMO Message and set the attributes
-                ## while passing through an already opened pandas
-                ## dataframe of stations. Not doing this takes a massive
-                ## performance hit
-                wmo_msg = WMOUpperAirMessage(stations_df=self.stations)
-                ## Set the WMO message header
+        and adds the messages to self.records
+        """
+        with timer(self.stats, "parse"):
+            for wmo_msg in self._messages_from_text(text):
+                self._add_message(wmo_msg)
+
+    def _parse_buffer(self, buf):
+        """
+        Same as _parse, but for a bytes-like buffer such as a memory 
+        mapped file. Messages only hold their offsets in the buffer
+        until they are decoded.
+        """
+        with timer(self.stats, "parse"):
+            for header, msg_type, wmo_id, start, end in tokenize_buffer(buf, stats=self.stats):
+                wmo_msg = WMOUpperAirMessage(stations=self.stations, stats=self.stats)
                 wmo_msg.set_header(header)
-                wmo_msg.set_message(message)
-
-                ## Create dictionary record entries if they 
-                ## do not already exist
-                time_str = self._add_time_to_record(wmo_msg.time_str)
-                ## When adding the time to the record, it groups observations
-                ## within 10 minutes of the synoptic time. Re-set the time_str
-                ## in case this grouping happens. 
-                wmo_msg.time_str = time_str
-                self._add_stn_to_record(wmo_msg.time_str, wmo_msg.id)
-                ## Check for retransmissions. If there is a previous entry
-                ## for this record, compare the headers to determine
-                ## what to do or which one to keeo
-                try:
-                    old_record = self.records[wmo_msg.time_str][wmo_msg.id][wmo_msg.type]
-                    retr_code_1 = old_record.transmission_code
-                    retr_code_2 = wmo_msg.transmission_code
-                    ## Sometimes there's no rebroadcast header but still two entries
-                    ## in the file. If so, take the longer of the two entries
-                    if retr_code_2 is None and retr_code_1 is None:
-                        if len(old_record.message) > len(wmo_msg.message): wmo_msg = old_record
-                        else: pass 
-                    elif retr_code_1 > retr_code_2: wmo_msg = old_record
-                    else: pass 
-                except: pass
-                self.records[wmo_msg.time_str][wmo_msg.id][wmo_msg.type] = wmo_msg
-
-    def _parse_for_transmissions(self, text):
-        """
-        Parses the raw text string and splits the string into it's
-        individual LDM transmissions. This is done by splitting the
-        string on the End Of Transmission ('\x03') character. The 
-        '\r' and Start Of Transmission ('\x01') characters are removed.
-
-        Each transmission is split into it's individual messages by breaking
-        on the '=' character. 
-
-        Sets the class attribute self.transmissions, which is a list of lists.
-        Each entry is a list of the messages in each transmission.
-        """
-        all_transmissions = text.replace("\r", "").replace("\x01", "").split("\x03")
-
-        for tidx in range(len(all_transmissions)):
-            transmission = all_transmissions[tidx]
-            if transmission in self.ignore: continue
-
-            ## The "=" character marks the end of a message,
-            ## so use that to divide up the transmission
-            messages = transmission.split("=")
-            messages = [msg for msg in messages if msg not in self.ignore]
-            self.transmissions.append(messages)
-
-    def _format_messages(self, messages):
-        """
-        Called after _parse_for_transmissions or after self.transmissions
-        manually set. Iterates over the transmissions available assuming they
-        have already been spit on the '=' character.
-        """
-        header = None
-        messages_out = []
-        for midx in range(len(messages)):
-            ## Split our message on the newline first and then
-            ## filter out the junk
-            message = messages[midx].split("\n")
-            message = [msg for msg in message if msg not in self.ignore]
-
-            if len(message) == 1:
-                message = message[0].split(" ")
-
-            ## If we are the first message in the 
-            ## transmission, get the header info
-            if midx == 0:
-                header = message[1].split(" ")
-                message = message[2:]
-
-            ## Find where our data starts by searching for a matching
-            ## header string in the list
-            start = [n for n in range(len(message)) for head in self.headers if head in message[n]]
-            if len(start) > 0: start = start[0]
-            else: start = 0
-            message = message[start:]
-
-            ## Take our message segments that were split on the newline character
-            ## and then split those on the whitespace character. Append all of the
-            ## data to a new ist that should contain nicely separated message data
-            split_message = []
-            for n in range(len(message)):
-                msg = message[n].split(" ")
-                [split_message.append(m) for m in msg if m not in self.ignore]
-                #split_message += msg
-            #split_message = [m for m in split_message if m not in self.ignore]
-            ## Find where our data header is in this new list
-            start = [n for n in range(len(split_message)) for head in self.headers if head in split_message[n]]
-            if len(start) > 0:
-                start = start[0]
-            else:
+                wmo_msg.set_message_buffer(buf, start, end, msg_type, wmo_id)
+                self._add_message(wmo_msg)
+
+    def _parse_parallel(self):
+        """
+        Split the file into self.processes chunks that end on a transmission
+        boundary and tokenize the chunks in a process pool, then add the
+        messages to self.records in file order. Grouping times to the
+        synoptic hour depends on the times seen earlier in the file, so
+        the records are only built once all of the chunks are back. Only
+        then are the messages that made it into the records decoded, in
+        the same pool, so retransmissions that were replaced or ignored
+        are never decoded, the same as reading the file serially.
+        """
+        jobs = [(self.filename, self.stations.stations_file, start, end, self.stats is not None)
+                for start, end in self._transmission_chunks(self.processes)]
+        if len(jobs) == 0: return
+        from multiprocessing import Pool
+        with Pool(min(self.processes, len(jobs))) as pool:
+            for messages, snapshot in pool.imap(_tokenize_chunk, jobs):
+                if snapshot is not None: self.stats.merge(snapshot)
+                for wmo_msg in messages:
+                    wmo_msg.stats = self.stats
+                    self._add_message(wmo_msg)
+
+            messages = [wmo_msg for tid in self.records.keys()
+                                for sid in self.records[tid].keys()
+                                for wmo_msg in self.records[tid][sid].values()]
+            if len(messages) == 0: return
+            nbatches = min(len(jobs), len(messages))
+            bounds = [len(messages) * idx // nbatches for idx in range(nbatches + 1)]
+            batches = [messages[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+            jobs = [(batch, self.stats is not None) for batch in batches]
+            with timer(self.stats, "decode"):
+                for batch, (levels, snapshot) in zip(batches, pool.imap(_decode_batch, jobs)):
+                    if snapshot is not None: self.stats.merge(snapshot)
+                    for wmo_msg, msg_levels in zip(batch, levels): wmo_msg.levels = msg_levels
+
+    def _transmission_chunks(self, nchunks):
+        """
+        Return a list of (start, end) byte offsets that split the file into
+        about nchunks pieces, each ending just after an End Of Transmission
+        ('\x03') character (or at the end of the file).
+        """
+        with open(self.filename, "rb") as snfile:
+            size = os.fstat(snfile.fileno()).st_size
+            if size == 0: return []
+            with mmap.mmap(snfile.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                chunks = []
                 start = 0
+                for idx in range(1, nchunks + 1):
+                    if start >= size: break
+                    end = size * idx // nchunks
+                    if end <= start: continue
+                    if end < size:
+                        end = buf.find(b"\x03", end - 1)
+                        end = size if end == -1 else end + 1
+                    chunks.append((start, end))
+                    start = end
+        return chunks
+
+    def _messages_from_text(self, text):
+        """
+        Tokenize raw bulletin text in a single pass (see WMOTokenizer) and
+        yield a WMOUpperAirMessage for every message that isn't a NIL report.
+        """
+        for header, msg_type, tokens, start, end in tokenize(text, stats=self.stats):
+            ## Construct a WMO Message and set the attributes
+            ## while passing through the already loaded station
+            ## table so each message doesn't have to look it up.
+            wmo_msg = WMOUpperAirMessage(stations=self.stations, stats=self.stats)
+            ## Set the WMO message header
+            wmo_msg.set_header(header)
+            wmo_msg.set_message(tokens)
+            yield wmo_msg
+
+    def _add_message(self, wmo_msg):
+        """
+        Add a WMOUpperAirMessage to self.records, resolving 
+        retransmissions of the same time/station/type by their heading
+        correction codes (see WMORecords.correction_rank). Returns "added"
+        if this is a new record entry, "replaced" if it replaced an older
+        message, or None if the older message was kept.
+        """
+        status = self.records.add(wmo_msg)
+        if self.stats is not None: self._count_message(wmo_msg, status)
+        return status
+
+    def _count_message(self, wmo_msg, status):
+        self.stats.count("messages")
+        if status == "added": return
+        event = "retransmissions_replaced" if status == "replaced" else "retransmissions_kept"
+        self.stats.count(event)
+        self.stats.emit("replaced" if status == "replaced" else "kept", time_str=wmo_msg.time_str,
+                        wmo_id=wmo_msg.id, msg_type=wmo_msg.type)
+
+
+def _tokenize_chunk(job):
+    """
+    Worker for WMOReader._parse_parallel. Tokenize one chunk of a file
+    and return its messages in file order, along with a snapshot of its
+    WMOStats if counting is True.
+    """
+    filename, stations_file, start, end, counting = job
+    stations = get_station_table(stations_file)
+    stats = WMOStats() if counting else None
+    messages = []
+    with timer(stats, "parse"), open(filename, "rb") as snfile:
+        with mmap.mmap(snfile.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for header, msg_type, wmo_id, msg_start, msg_end in tokenize_buffer(buf, start, end, stats=stats):
+                wmo_msg = WMOUpperAirMessage(stations=stations, stats=stats)
+                wmo_msg.set_header(header)
+                wmo_msg.set_message_buffer(buf, msg_start, msg_end, msg_type, wmo_id)
+                wmo_msg.message
+                messages.append(wmo_msg)
+    if stats is None: return messages, None
+    return messages, stats.snapshot()
+
 
-            if len(split_message[start:]) != 0:
-                out = split_message[start:]
-                for ignore in ["NIL", "NILL", "XMTD"]:
-                    if ignore in out: out.pop(out.index(ignore))
-                    elif ignore.lower() in out: out.pop(out.index(ignore.lower()))
-                messages_out.append(out)
-        return header, messages_out
+def _decode_batch(job):
+    """
+    Worker for WMOReader._parse_parallel. Decode a list of messages (see
+    WMOBatch.decode_messages) and return their levels, None for the ones
+    that couldn't be decoded, along with a snapshot of its WMOStats if
+    counting is True.
+    """
+    messages, counting = job
+    stats = WMOStats() if counting else None
+    for wmo_msg in messages: wmo_msg.stats = stats
+    from WMOBatch import decode_messages
+    decode_messages(messages)
+    levels = [wmo_msg.levels for wmo_msg in messages]
+    if stats is None: return levels, None
+    return levels, stats.snapshot()
 
 
 def main():
     filepath = sys.argv[1]
-    mydata = WMOReader(filepath)
+    stats = WMOStats(verbose=True)
+    mydata = WMOReader(filepath, stats=stats)
     print(mydata)
     print(mydata.records)
-    #files = glob.glob("/ldm/data/upperair/sonde/20220104*.uair")
-    #for file in files:
-    #    WMOReader(file)
+    print(stats.report())
 
 if __name__ == "__main__":
     main()
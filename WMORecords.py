@@ -0,0 +1,233 @@
+import datetime
+import os
+import re
+
+## Ranks of the correction codes at the end of a WMO heading. A
+## message only replaces one with a lower rank (or the same rank, if
+## it arrived later): originals < delayed retransmissions (RRx) <
+## corrections (CCx) < amendments (AAx), then by the letter.
+CORRECTION_RANKS = {"RR": 1, "CC": 2, "AA": 3}
+
+## Dates in file names like 20220714_00Z_KLWX.uair
+FILE_DATE_RE = re.compile(r"(\d{4})(\d{2})(\d{2})")
+
+## Format of full record times (see full_time)
+FULL_TIME_FORMAT = "%Y%m%d%H%M"
+
+
+def correction_rank(code):
+    """
+    Return a sortable rank for a heading correction code (e.g. RRA,
+    CCB, AAA), or for None when the heading doesn't have one. Unknown
+    codes rank with the delayed retransmissions.
+    """
+    if code is None: return (0, "")
+    return (CORRECTION_RANKS.get(code[:2], 1), code[2:])
+
+
+def valid_time(time_str, ref_date):
+    """
+    Return the datetime of a record time (ddhhmm). Bulletins only carry
+    the day of the month, so the year and month come from ref_date (a
+    date or datetime at or after the record time, e.g. the date of the
+    file). A day after ref_date's is taken to be in the previous month.
+    Full record times (yyyymmddhhmm, see full_time) don't need ref_date.
+    Returns None if the time doesn't exist (e.g. day 31 of a 30 day month).
+    """
+    try:
+        if len(time_str) == 12: return datetime.datetime.strptime(time_str, FULL_TIME_FORMAT)
+        day, hour, minute = int(time_str[:2]), int(time_str[2:4]), int(time_str[4:6])
+        month_start = datetime.date(ref_date.year, ref_date.month, 1)
+        if day > ref_date.day + 1: month_start = (month_start - datetime.timedelta(days=1)).replace(day=1)
+        return datetime.datetime(month_start.year, month_start.month, day, hour, minute)
+    except ValueError:
+        return None
+
+
+def full_time(time_str, ref_date):
+    """
+    Return a record time (ddhhmm) with the year and month filled in from
+    ref_date (see valid_time) as yyyymmddhhmm. Record times that aren't
+    ddhhmm, or that don't exist, are returned as they are.
+    """
+    if len(time_str) != 6 or not time_str.isdigit(): return time_str
+    valid = valid_time(time_str, ref_date)
+    if valid is None: return time_str
+    return valid.strftime(FULL_TIME_FORMAT)
+
+
+def file_date(filename):
+    """
+    Return the date in the name of filename (YYYYMMDD), or None.
+    """
+    if filename is None: return None
+    match = FILE_DATE_RE.search(os.path.basename(filename))
+    if match is None: return None
+    try:
+        return datetime.date(*[int(val) for val in match.groups()])
+    except ValueError:
+        return None
+
+
+def default_ref_date(filename=None):
+    """
+    Return the date in the name of filename (see file_date), or today's
+    date in UTC, to fill in the year and month of its record times.
+    """
+    return file_date(filename) or datetime.datetime.now(datetime.timezone.utc).date()
+
+
+class WMORecordStore(dict):
+    def __init__(self, keep_history=True):
+        """
+        The records of a WMOReader: a dictionary of time_str -> WMO ID ->
+        message type -> WMOUpperAirMessage, with an index of the record
+        times as integers (ddhhmm, or yyyymmddhhmm for full record times,
+        see full_time) so that grouping a time with its synoptic hour and
+        adding a message are constant time.
+
+        When the same time/station/type is sent more than once, the
+        message with the highest correction_rank is kept. If keep_history
+        is True, every other version is kept in arrival order and can be
+        queried with superseded() and versions().
+        """
+        super().__init__()
+        self.keep_history = keep_history
+        self.history = {}
+        self._times = {}
+
+    def group_time(self, time_str):
+        """
+        Return the record time that time_str belongs to. When corrected
+        broadcasts are sent, sometimes the headers list the time as a few
+        minutes past the hour. These are grouped with the synoptic hour
+        if it's already in the records and the time is no more than 10
+        minutes past (not before) it.
+        """
+        if not _is_time(time_str): return self._scan_time(time_str)
+        time_int = int(time_str)
+        minutes = time_int % 100
+        if minutes > 10: return time_str
+        return self._times.get(time_int - minutes, time_str)
+
+    def add_time(self, time_str):
+        """
+        Group time_str with its synoptic hour, add it to the
+        records if it's new and return the record time.
+        """
+        time_str = self.group_time(time_str)
+        if time_str not in self:
+            self[time_str] = {}
+            if _is_time(time_str): self._times[int(time_str)] = time_str
+        return time_str
+
+    def add(self, wmo_msg):
+        """
+        Add a WMOUpperAirMessage to the records, resolving retransmissions
+        of the same time/station/type. The message's time_str is set to
+        its record time. Returns "added" if this is a new record entry,
+        "replaced" if it replaced an older message, or None if the older
+        message was kept.
+        """
+        wmo_msg.time_str = self.add_time(wmo_msg.time_str)
+        messages = self[wmo_msg.time_str].setdefault(wmo_msg.id, {})
+        old_msg = messages.get(wmo_msg.type)
+        if old_msg is None:
+            messages[wmo_msg.type] = wmo_msg
+            return "added"
+
+        if self._supersedes(wmo_msg, old_msg):
+            messages[wmo_msg.type] = wmo_msg
+            self._retire(wmo_msg, old_msg)
+            return "replaced"
+        self._retire(wmo_msg, wmo_msg)
+        return None
+
+    def drop_time(self, time_str):
+        """
+        Remove a record time, with every message and superseded
+        message filed under it.
+        """
+        self.pop(time_str, None)
+        if _is_time(time_str): self._times.pop(int(time_str), None)
+        for key in [key for key in self.history.keys() if key[0] == time_str]:
+            del self.history[key]
+
+    def add_history(self, records):
+        """
+        Add the superseded messages of another WMORecordStore whose
+        current messages have been added to this one.
+        """
+        if not self.keep_history: return
+        for (time_str, wmo_id, msg_type), old_msgs in records.history.items():
+            current = records[time_str][wmo_id][msg_type]
+            for old_msg in old_msgs: self._retire(current, old_msg)
+
+    def get_message(self, time, wmo_id, msg_type):
+        """
+        Return the current message for a record time (ddhhmm or
+        yyyymmddhhmm, as a string or integer), WMO ID and message type,
+        or None.
+        """
+        return self.get(self._time_key(time), {}).get(str(wmo_id), {}).get(msg_type)
+
+    def superseded(self, time, wmo_id, msg_type):
+        """
+        Return the versions of a message that were replaced or ignored,
+        in the order they arrived.
+        """
+        return list(self.history.get((self._time_key(time), str(wmo_id), msg_type), []))
+
+    def versions(self, time, wmo_id, msg_type):
+        """
+        Return every version of a message received, lowest correction
+        rank first, so the last one is the current message.
+        """
+        versions = self.superseded(time, wmo_id, msg_type)
+        current = self.get_message(time, wmo_id, msg_type)
+        if current is not None: versions.append(current)
+        return sorted(versions, key=lambda wmo_msg: correction_rank(wmo_msg.transmission_code))
+
+    def times(self):
+        """
+        Return the record times as sorted integers (ddhhmm or yyyymmddhhmm).
+        """
+        return sorted(self._times.keys())
+
+    def _time_key(self, time):
+        if isinstance(time, int): return self._times.get(time, "%06d" % time)
+        return time
+
+    def _supersedes(self, new_msg, old_msg):
+        new_rank = correction_rank(new_msg.transmission_code)
+        old_rank = correction_rank(old_msg.transmission_code)
+        if new_rank != old_rank: return new_rank > old_rank
+        ## Sometimes there's no rebroadcast header but still two entries
+        ## in the file. If so, take the longer of the two entries
+        if new_msg.transmission_code is None:
+            return len(new_msg.message) >= len(old_msg.message)
+        return True
+
+    def _retire(self, wmo_msg, old_msg):
+        if not self.keep_history: return
+        key = (wmo_msg.time_str, wmo_msg.id, wmo_msg.type)
+        self.history.setdefault(key, []).append(old_msg)
+
+    def _scan_time(self, time_str):
+        ## Anything that isn't a ddhhmm time string is compared
+        ## against every record time, as it always was.
+        for time in list(self.keys()):
+            if time.startswith(time_str[:4]):
+                if time[-2:] == "00":
+                    synop = time
+                    other = time_str
+                else:
+                    synop = time_str
+                    other = time
+                remainder = abs(int(synop[-2:]) - int(other[-2:]))
+                if remainder <= 10: time_str = synop
+        return time_str
+
+
+def _is_time(time_str):
+    return len(time_str) in (6, 12) and time_str.isdigit()
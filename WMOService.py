@@ -0,0 +1,235 @@
+from WMOParser import WMOReader
+from WMOBatch import decode_messages
+from WMOStats import WMOStats
+from WMORecords import valid_time, default_ref_date
+import argparse
+import asyncio
+import datetime
+import sys
+
+## Default seconds a record time is kept after the newest one received
+RETENTION = 2 * 86400
+
+## Default largest transmission (bytes) that is buffered. A peer that
+## sends more than this without an End Of Transmission is cut off
+## until its next one.
+MAX_TRANSMISSION = 1 << 20
+
+
+class WMOIngestService():
+    def __init__(self, stations_file=None, decode=True, max_pending=256, chunk_size=1 << 16, on_change=None,
+                 retention=RETENTION, max_transmission=MAX_TRANSMISSION, keep_history=False, stats=None):
+        """
+        Long running ingest of raw WMO upper air bulletins from an LDM
+        stream (pqact PIPE on stdin, a Unix socket or TCP). Incoming bytes
+        are split into transmissions on the End Of Transmission ('\\x03')
+        character and put on a queue of at most max_pending transmissions.
+        A single task takes them off the queue, parses them into an
+        in memory WMOReader (self.reader) and decodes the new messages
+        unless decode is False. When the queue is full, the connections
+        stop being read until it drains, which pushes back on the sender.
+
+        The service is meant to run for good, so memory is bounded: record
+        times more than retention seconds older than the newest one are
+        dropped (None keeps everything), superseded retransmissions are only
+        kept if keep_history is True, and a transmission longer than
+        max_transmission bytes is dropped and counted
+        ("transmissions_dropped") instead of being buffered.
+
+        on_change, if given, is called with the list of (time_str, wmo_id,
+        msg_type, status) entries changed by each transmission (see
+        WMOReader.update). stats is an optional WMOStats handed to the reader,
+        which also counts and receives the transmissions that couldn't be
+        ingested ("transmission_error").
+        """
+        self.reader = WMOReader(None, stations_file=stations_file, stats=stats, keep_history=keep_history)
+        self.stats = stats
+        self.retention = retention
+        self.max_transmission = max_transmission
+        self.decode = decode
+        self.chunk_size = chunk_size
+        self.on_change = on_change
+        self.queue = asyncio.Queue(max_pending)
+        self.ntransmissions = 0
+        self.nchanges = 0
+        self.nerrors = 0
+        self.ndropped = 0
+        self._consumer = None
+
+    async def start(self):
+        if self._consumer is None:
+            self._consumer = asyncio.ensure_future(self._consume())
+
+    async def join(self):
+        """
+        Wait until every queued transmission has been added to the records.
+        """
+        await self.queue.join()
+
+    async def stop(self):
+        await self.join()
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+
+    async def feed_stream(self, stream):
+        """
+        Read an asyncio.StreamReader until EOF, queueing one transmission
+        at a time. Anything left after the last End Of Transmission
+        character is queued once the stream closes.
+        """
+        buf = b""
+        while True:
+            chunk = await stream.read(self.chunk_size)
+            if not chunk: break
+            buf = await self._feed(buf, chunk)
+        if buf is not None and buf.strip(): await self.queue.put(buf)
+
+    async def feed_stdin(self):
+        """
+        Read stdin (e.g. a pqact PIPE action or a redirected file) until
+        EOF. The blocking reads run in the default executor so that this
+        works for pipes and regular files alike.
+        """
+        loop = asyncio.get_running_loop()
+        stdin = sys.stdin.buffer
+        buf = b""
+        while True:
+            chunk = await loop.run_in_executor(None, stdin.read1, self.chunk_size)
+            if not chunk: break
+            buf = await self._feed(buf, chunk)
+        if buf is not None and buf.strip(): await self.queue.put(buf)
+
+    async def serve_unix(self, path):
+        return await asyncio.start_unix_server(self._handle_connection, path=path)
+
+    async def serve_tcp(self, host, port):
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def _handle_connection(self, stream, writer):
+        try:
+            await self.feed_stream(stream)
+        finally:
+            writer.close()
+
+    async def _feed(self, buf, chunk):
+        """
+        Queue the transmissions completed by chunk and return what's left
+        over for the next one. buf is None while the rest of a transmission
+        that was too long is being skipped.
+        """
+        if buf is None:
+            if b"\x03" not in chunk: return None
+            chunk = chunk[chunk.index(b"\x03") + 1:]
+            buf = b""
+        buf += chunk
+        if b"\x03" in chunk:
+            ## Everything after the last end of transmission
+            ## marker is carried over to the next chunk
+            transmissions = buf.split(b"\x03")
+            buf = transmissions.pop()
+            for transmission in transmissions:
+                if len(transmission) >= self.max_transmission:
+                    self._dropped()
+                    continue
+                await self.queue.put(transmission + b"\x03")
+        if len(buf) >= self.max_transmission:
+            self._dropped()
+            return None
+        return buf
+
+    def _dropped(self):
+        self.ndropped += 1
+        if self.stats is not None: self.stats.count("transmissions_dropped")
+
+    async def _consume(self):
+        while True:
+            transmission = await self.queue.get()
+            try:
+                self._add_transmission(transmission)
+            except Exception as err:
+                ## A bad bulletin shouldn't take the whole service down
+                self.nerrors += 1
+                if self.stats is not None:
+                    self.stats.count("transmission_errors")
+                    self.stats.emit("transmission_error", error=err)
+            finally:
+                self.queue.task_done()
+
+    def _add_transmission(self, transmission):
+        changes = self.reader.add_text(transmission.decode("latin-1"))
+        self.ntransmissions += 1
+        self.nchanges += len(changes)
+        if len(changes) == 0: return
+        if self.decode:
+            decode_messages([self.reader.get_message(*change[:3]) for change in changes])
+        if self.on_change is not None: self.on_change(changes)
+        if any(status == "added" for time_str, wmo_id, msg_type, status in changes): self.expire()
+
+    def expire(self):
+        """
+        Drop the record times that are more than retention seconds older
+        than the newest one, and return them.
+        """
+        if self.retention is None: return []
+        ## Record times only carry the day of the month, so they're all
+        ## placed relative to today (see valid_time)
+        today = default_ref_date()
+        times = {time_str: valid_time(time_str, today) for time_str in self.reader.records.keys()}
+        valid = [time for time in times.values() if time is not None]
+        if len(valid) == 0: return []
+        oldest = max(valid) - datetime.timedelta(seconds=self.retention)
+        expired = [time_str for time_str, time in times.items() if time is not None and time < oldest]
+        for time_str in expired: self.reader.records.drop_time(time_str)
+        if self.stats is not None and len(expired) > 0: self.stats.count("record_times_expired", len(expired))
+        return expired
+
+
+async def run(args):
+    service = WMOIngestService(stations_file=args.stations, decode=not args.no_decode, max_pending=args.max_pending,
+                               retention=args.retention * 3600.0, stats=WMOStats(verbose=args.verbose))
+    if args.verbose:
+        service.on_change = lambda changes: [print("\t".join(change)) for change in changes]
+    await service.start()
+
+    servers = []
+    if args.unix: servers.append(await service.serve_unix(args.unix))
+    if args.tcp:
+        host, port = args.tcp.rsplit(":", 1)
+        servers.append(await service.serve_tcp(host or None, int(port)))
+
+    if len(servers) == 0:
+        await service.feed_stdin()
+        await service.stop()
+    else:
+        try:
+            await asyncio.gather(*[server.serve_forever() for server in servers])
+        finally:
+            await service.stop()
+    return service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a stream of WMO upper air bulletins and keep the decoded records in memory.")
+    parser.add_argument("--unix", default=None, help="listen on this Unix socket path instead of reading stdin")
+    parser.add_argument("--tcp", default=None, help="listen on HOST:PORT instead of reading stdin")
+    parser.add_argument("--stations", default=None, help="station table (default: snstns.tbl)")
+    parser.add_argument("--max-pending", type=int, default=256, help="transmissions to queue before applying backpressure")
+    parser.add_argument("--no-decode", action="store_true", help="only parse and index messages, don't decode them")
+    parser.add_argument("--retention", type=float, default=RETENTION / 3600.0,
+                        help="hours of record times to keep before the newest one (default: %(default)s)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every added or replaced record entry and every error")
+    args = parser.parse_args()
+
+    service = asyncio.run(run(args))
+    records = service.reader.records
+    for tid in sorted(records.keys()):
+        nmsgs = sum(len(msgs) for msgs in records[tid].values())
+        print("Time: {time}\tStations: {nstn}\tMessages: {nmsg}".format(time=tid, nstn=len(records[tid]), nmsg=nmsgs))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import json
+import os
+import re
+import tempfile
+import zlib
+from collections import namedtuple
+
+## Default location of the station table. Can be overridden
+## per-process with the WMO_STATIONS_FILE environment variable
+## or per-reader with the stations_file keyword.
+STATIONS_FILE = os.environ.get("WMO_STATIONS_FILE", "/home/ldm/SHARP-api/snstns.tbl")
+TABLE_NAMES = ["Site ID", "WMO ID", "Site Name", "State", "Country", "Latitude", "Longitude", "Elevation", "Flag"]
+
+## Number of rows the column positions of the table are worked out
+## from, the same as pandas.read_fwf used to look at.
+INFER_ROWS = 100
+
+## Column positions of a standard GEMPAK station table, used when they
+## can't be worked out from the table (e.g. station names with spaces)
+TABLE_COLSPECS = [(0, 9), (9, 16), (16, 49), (49, 52), (52, 55), (55, 61), (61, 68), (68, 74), (74, 79)]
+
+## Bump this whenever the layout of the cached station
+## records changes so stale caches get rebuilt.
+CACHE_VERSION = 3
+
+## Per-user directory for caches that can't go next to their source.
+## Can be overridden with the WMO_USER_CACHE_DIR environment variable.
+USER_CACHE_DIR = os.environ.get("WMO_USER_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "wmo_upperair")
+
+Station = namedtuple("Station", ["site_id", "wmo_id", "name", "state", "country", "lat", "lon", "elev"])
+
+## Process-wide registry of parsed station tables, keyed
+## by the absolute path of the table file.
+_TABLES = {}
+
+
+def get_station_table(stations_file=None):
+    """
+    Return the process-wide WMOStationTable for the given table
+    file (or the default STATIONS_FILE). The table is only parsed
+    the first time it is requested, or again if the file on disk
+    has been modified since it was loaded.
+    """
+    path = os.path.abspath(stations_file or STATIONS_FILE)
+    table = _TABLES.get(path)
+    if table is None or table.is_stale():
+        table = WMOStationTable(path)
+        _TABLES[path] = table
+    return table
+
+
+def user_cache_dir(name=None):
+    """
+    Return USER_CACHE_DIR, or its name subdirectory, creating it if it
+    doesn't exist. Cache directories are only used if they belong to the
+    current user and nobody else can write to them, since whatever is
+    in them gets loaded; otherwise this raises PermissionError.
+    """
+    path = USER_CACHE_DIR if name is None else os.path.join(USER_CACHE_DIR, name)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    check_private(path)
+    return path
+
+
+def check_private(path):
+    """
+    Raise PermissionError unless path belongs to the current user and
+    nobody else can write to it.
+    """
+    stat = os.stat(path)
+    if hasattr(os, "getuid") and stat.st_uid != os.getuid():
+        raise PermissionError("{path} belongs to another user".format(path=path))
+    if stat.st_mode & 0o022:
+        raise PermissionError("{path} can be written to by other users".format(path=path))
+
+
+class WMOStationTable():
+    def __init__(self, stations_file=None, cache_file=None):
+        """
+        Load a GEMPAK style fixed width station table (snstns.tbl) and
+        index it by WMO ID and site ID. The parsed table is stored in
+        a JSON cache next to the table (or in the per-user cache directory,
+        see user_cache_dir, if that isn't writable) and reused for as long
+        as the table's modification time and size are unchanged.
+        """
+        self.stations_file = stations_file or STATIONS_FILE
+        self.cache_file = cache_file
+        self.mtime = None
+        self.size = None
+        self.by_wmo_id = {}
+        self.by_site_id = {}
+        self._load()
+
+    @classmethod
+    def from_dataframe(cls, stations_df):
+        """
+        Build a station table from an already opened pandas
+        dataframe with the TABLE_NAMES columns.
+        """
+        table = cls.__new__(cls)
+        table.stations_file = None
+        table.cache_file = None
+        table.mtime = None
+        table.size = None
+        rows = stations_df[TABLE_NAMES[:8]].itertuples(index=False, name=None)
+        table._index([table._make_station(row) for row in rows])
+        return table
+
+    def __len__(self):
+        return len(self.by_wmo_id)
+
+    def __contains__(self, wmo_id):
+        return str(wmo_id) in self.by_wmo_id
+
+    def get(self, wmo_id):
+        """
+        Return the Station for the given WMO ID, or None.
+        """
+        return self.by_wmo_id.get(str(wmo_id))
+
+    def get_site(self, site_id):
+        """
+        Return the Station for the given site ID (e.g. KLWX), or None.
+        """
+        return self.by_site_id.get(str(site_id).upper())
+
+    def elevation(self, wmo_id):
+        stn = self.by_wmo_id.get(str(wmo_id))
+        if stn is None: return None
+        return stn.elev
+
+    def latitude(self, wmo_id):
+        stn = self.by_wmo_id.get(str(wmo_id))
+        if stn is None: return None
+        return stn.lat
+
+    def longitude(self, wmo_id):
+        stn = self.by_wmo_id.get(str(wmo_id))
+        if stn is None: return None
+        return stn.lon
+
+    def is_stale(self):
+        """
+        Returns True if the table file has changed on disk
+        since it was loaded.
+        """
+        if self.stations_file is None: return False
+        try:
+            stat = os.stat(self.stations_file)
+        except OSError:
+            return False
+        return (stat.st_mtime_ns, stat.st_size) != (self.mtime, self.size)
+
+    def _load(self):
+        stat = os.stat(self.stations_file)
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+
+        stations = self._read_cache()
+        if stations is None:
+            stations = self._parse_table()
+            self._write_cache(stations)
+        self._index(stations)
+
+    def _index(self, stations):
+        self.by_wmo_id = {}
+        self.by_site_id = {}
+        for stn in stations:
+            ## Some sites share a WMO ID - the first entry wins
+            if stn.wmo_id and stn.wmo_id not in self.by_wmo_id:
+                self.by_wmo_id[stn.wmo_id] = stn
+            if stn.site_id and stn.site_id not in self.by_site_id:
+                self.by_site_id[stn.site_id] = stn
+
+    def _parse_table(self):
+        """
+        Parse the fixed width station table into a list of Stations.
+        """
+        with open(self.stations_file, "r", encoding="latin-1") as tfile:
+            lines = [line.partition("!")[0].rstrip("\r\n") for line in tfile]
+        lines = [line for line in lines if line.strip()]
+        colspecs = _infer_colspecs(lines[:INFER_ROWS])
+        if len(colspecs) != len(TABLE_NAMES): colspecs = TABLE_COLSPECS
+        rows = []
+        for line in lines:
+            row = [line[start:end] for start, end in colspecs]
+            rows.append((row + [""] * 8)[:8])
+        return [self._make_station(row) for row in rows]
+
+    def _make_station(self, row):
+        site_id, wmo_id, name, state, country, lat, lon, elev = [self._clean(val) for val in row]
+        return Station(site_id.upper(), wmo_id, name, state, country,
+                       self._to_degrees(lat), self._to_degrees(lon), self._to_float(elev))
+
+    def _clean(self, val):
+        ## Dataframes (see from_dataframe) fill empty columns with NaN
+        if not isinstance(val, str): return ""
+        return val.strip()
+
+    def _to_float(self, val):
+        try:
+            return float(val)
+        except ValueError:
+            return None
+
+    def _to_degrees(self, val):
+        ## GEMPAK tables store latitude and longitude as
+        ## integer hundredths of a degree.
+        deg = self._to_float(val)
+        if deg is None or "." in val: return deg
+        return deg / 100.0
+
+    def _default_cache_file(self):
+        cache_file = self.stations_file + ".cache"
+        if os.access(os.path.dirname(os.path.abspath(cache_file)), os.W_OK):
+            return cache_file
+        try:
+            cache_dir = user_cache_dir()
+        except OSError:
+            return None
+        key = zlib.crc32(os.path.abspath(self.stations_file).encode())
+        return os.path.join(cache_dir, "snstns_%08x.cache" % key)
+
+    def _read_cache(self):
+        cache_file = self.cache_file or self._default_cache_file()
+        if cache_file is None: return None
+        try:
+            with open(cache_file, "r") as cfile:
+                cache = json.load(cfile)
+            if cache.get("version") != CACHE_VERSION: return None
+            if cache.get("mtime") != self.mtime or cache.get("size") != self.size: return None
+            return [Station(*stn) for stn in cache["stations"]]
+        except (OSError, ValueError, TypeError, AttributeError):
+            return None
+
+    def _write_cache(self, stations):
+        cache_file = self.cache_file or self._default_cache_file()
+        if cache_file is None: return
+        cache = {
+            "version": CACHE_VERSION,
+            "mtime": self.mtime,
+            "size": self.size,
+            "stations": [tuple(stn) for stn in stations],
+        }
+        ## Write to a temporary file and move it into place so
+        ## concurrent readers never see a partial cache.
+        try:
+            fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)))
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "w") as cfile:
+                json.dump(cache, cfile)
+            os.replace(tmp_name, cache_file)
+        except OSError:
+            if os.path.exists(tmp_name): os.remove(tmp_name)
+
+
+def _infer_colspecs(lines):
+    """
+    Work out the (start, end) of every column of a fixed width table
+    from the character positions that hold something other than
+    whitespace in any of lines, the same way pandas.read_fwf does.
+    """
+    used = []
+    for line in lines:
+        if len(line) > len(used): used += [False] * (len(line) - len(used))
+        for match in _FIELD_RE.finditer(line):
+            used[match.start():match.end()] = [True] * (match.end() - match.start())
+    colspecs = []
+    start = None
+    for idx, flag in enumerate(used + [False]):
+        if flag and start is None: start = idx
+        elif not flag and start is not None:
+            colspecs.append((start, idx))
+            start = None
+    return colspecs
+
+
+_FIELD_RE = re.compile(r"[^ \t]+")
@@ -0,0 +1,118 @@
+import contextlib
+import sys
+import time
+from collections import defaultdict
+
+## Shared do-nothing timer for when instrumentation is off
+NULL_TIMER = contextlib.nullcontext()
+
+
+class WMOStats():
+    def __init__(self, verbose=False, hooks=None):
+        """
+        Counters, stage timers and event hooks for the parser and
+        decoders. Hand one to WMOReader (stats=...) to turn them on;
+        everything that takes a stats object does nothing extra when
+        it is None, which is the default.
+
+        counters holds the number of transmissions, messages, NIL reports,
+        retransmissions, station misses and decode failures (per message
+        type), and timers the total seconds spent in each stage. Every
+        hook is called as hook(event, info) for the events that used to
+        be printed ("file", "station_miss", "no_ttaa", "decode_failure",
+        "sounding_failure", "transmission_error") and for retransmissions
+        ("replaced" and "kept"). If verbose is True, the events are printed
+        the way they used to be.
+        """
+        self.counters = defaultdict(int)
+        self.timers = defaultdict(float)
+        self.hooks = list(hooks or [])
+        if verbose: self.hooks.append(print_event)
+
+    def count(self, name, num=1):
+        self.counters[name] += num
+
+    def add_time(self, name, seconds):
+        self.timers[name] += seconds
+
+    def timer(self, name):
+        """
+        Context manager adding the time spent inside it to timers[name].
+        """
+        return _Timer(self, name)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def emit(self, event, **info):
+        for hook in self.hooks:
+            hook(event, info)
+
+    def snapshot(self):
+        """
+        Return the counters and timers as plain dictionaries, e.g. to send
+        them back from a worker process or to dump them as JSON.
+        """
+        return {"counters": dict(self.counters), "timers": dict(self.timers)}
+
+    def merge(self, snapshot):
+        """
+        Add the counters and timers of a snapshot() to this one.
+        """
+        for name, num in snapshot["counters"].items(): self.counters[name] += num
+        for name, seconds in snapshot["timers"].items(): self.timers[name] += seconds
+
+    def report(self):
+        lines = []
+        for name in sorted(self.timers.keys()):
+            lines.append("{name:<24}{seconds:>12.4f} s".format(name=name, seconds=self.timers[name]))
+        for name in sorted(self.counters.keys()):
+            lines.append("{name:<24}{num:>12d}".format(name=name, num=self.counters[name]))
+        return "\n".join(lines)
+
+
+def timer(stats, name):
+    """
+    stats.timer(name), or a shared do-nothing context manager
+    if stats is None.
+    """
+    if stats is None: return NULL_TIMER
+    return _Timer(stats, name)
+
+
+def print_event(event, info):
+    """
+    Hook printing the events that the parser used to print unconditionally.
+    """
+    if event == "file":
+        print("FILE: ", info["filename"])
+    elif event == "station_miss":
+        print("Unable to find station: ", info["wmo_id"])
+    elif event == "no_ttaa":
+        warning = "WARNING: Skipping {time}/{id} because no TTAA message was found."
+        warning += "\nMessages in the record: {msgs}"
+        warning += "\nFilename: {fname}"
+        print(warning.format(time=info["time_str"], id=info["wmo_id"], msgs=info["messages"], fname=info["filename"]))
+    elif event == "decode_failure":
+        print("Unable to decode {type} {id}: {err!r}".format(type=info["msg_type"], id=info["wmo_id"], err=info["error"]),
+              file=sys.stderr)
+    elif event == "sounding_failure":
+        print("Unable to assemble {time}/{id}: {err!r}".format(time=info["time_str"], id=info["wmo_id"], err=info["error"]),
+              file=sys.stderr)
+    elif event == "transmission_error":
+        print("Unable to ingest transmission: ", repr(info["error"]), file=sys.stderr)
+
+
+class _Timer():
+    __slots__ = ["stats", "name", "start"]
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.timers[self.name] += time.perf_counter() - self.start
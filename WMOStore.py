@@ -0,0 +1,236 @@
+from WMOMessage import LEVEL_FIELDS
+from WMORecords import correction_rank
+from WMORecords import valid_time, default_ref_date
+import numpy as np
+import hashlib
+import json
+import os
+import re
+
+## Bump this whenever the layout of the store files changes
+STORE_VERSION = 2
+
+## Message types are stored as their index in this list, so
+## new types may only ever be added at the end.
+STORE_MSG_TYPES = ["TTAA", "TTBB", "PPBB", "TTCC", "TTDD", "PPDD", "PPAA", "PPCC"]
+
+## One decoded level. Values are float32 (NaN when missing), which
+## keeps every value the decoders produce to well within its precision.
+RECORD_DTYPE = np.dtype([(name, "<f4") for name in LEVEL_FIELDS] + [("flag", "u1")])
+
+## One stored message: its record time (seconds since 1970), the first
+## level record and number of levels, the message type, correction code
+## and a digest of its level records (see _digest)
+INDEX_DTYPE = np.dtype([("time", "<i8"), ("start", "<u8"), ("count", "<u4"), ("msg_type", "u1"), ("code", "S3"),
+                        ("digest", "S8")])
+
+META_FILE = "store.json"
+LEVELS_SUFFIX = ".lvl"
+INDEX_SUFFIX = ".idx"
+
+_STATION_RE = re.compile("^[A-Za-z0-9]+$")
+
+
+class WMOLevelStore():
+    def __init__(self, store_dir):
+        """
+        An append-only store of every decoded level ever added, kept per
+        station so that one station's whole history is two sequential
+        reads. For every station there is a file of fixed width level
+        records (RECORD_DTYPE) and an index (INDEX_DTYPE) with one entry
+        per message saying which record time, message type and correction
+        code its levels belong to. Both are only ever appended to, levels
+        first, so an interrupted write leaves at most some unreferenced
+        levels behind. Both are read through np.memmap.
+        """
+        self.store_dir = store_dir
+        meta_file = os.path.join(store_dir, META_FILE)
+        if os.path.exists(meta_file):
+            with open(meta_file, "r") as mfile:
+                meta = json.load(mfile)
+            if meta.get("version") != STORE_VERSION:
+                raise ValueError("{store} is a version {version} store, not {ours}".format(
+                    store=store_dir, version=meta.get("version"), ours=STORE_VERSION))
+        else:
+            os.makedirs(store_dir, exist_ok=True)
+            meta = {"version": STORE_VERSION, "msg_types": STORE_MSG_TYPES, "record": RECORD_DTYPE.descr,
+                    "index": [(name, fmt) for name, fmt in INDEX_DTYPE.descr]}
+            with open(meta_file, "w") as mfile:
+                json.dump(meta, mfile, indent=2)
+
+    def stations(self):
+        """
+        Return the WMO IDs of the stations in the store, sorted.
+        """
+        names = os.listdir(self.store_dir)
+        return sorted(name[:-len(INDEX_SUFFIX)] for name in names if name.endswith(INDEX_SUFFIX))
+
+    def add_reader(self, reader, ref_date=None):
+        """
+        Decode every message of a WMOReader and add it (see add_records).
+        ref_date defaults to the date in the reader's file name, then today.
+        """
+        if ref_date is None: ref_date = default_ref_date(reader.filename)
+        reader.decode_all()
+        return self.add_records(reader.records, ref_date, stats=reader.stats)
+
+    def add_records(self, records, ref_date, stats=None):
+        """
+        Append the decoded levels of every message in records (as in
+        WMOReader.records, already decoded) to the store. ref_date fills in
+        the year and month of the record times (see WMORecords.valid_time).
+        Messages that can't be decoded are left out and counted in stats
+        (a WMOStats), if given.
+        Messages that are already stored (same time, type, correction code
+        and levels) are skipped, so adding a file again does nothing, but a
+        retransmission that changed the levels without changing the code is
+        still added. Record times that don't exist in ref_date's month (or
+        the one before) are left out. Returns the number of messages added.
+        """
+        by_station = {}
+        for time_str in records.keys():
+            valid = valid_time(time_str, ref_date)
+            if valid is None: continue
+            seconds = int(np.datetime64(valid, "s").astype(np.int64))
+            for wmo_id, messages in records[time_str].items():
+                for msg_type, wmo_msg in messages.items():
+                    if msg_type not in STORE_MSG_TYPES or not _STATION_RE.match(wmo_id): continue
+                    by_station.setdefault(wmo_id, []).append((seconds, msg_type, wmo_msg))
+
+        nadded = 0
+        for wmo_id, messages in by_station.items():
+            nadded += self._append(wmo_id, messages, stats)
+        return nadded
+
+    def index(self, wmo_id):
+        """
+        Return the index entries (INDEX_DTYPE) of a station, in the order
+        they were added, ignoring any whose levels were never written.
+        """
+        index = self._map(wmo_id, INDEX_SUFFIX, INDEX_DTYPE)
+        nrecords = len(self._map(wmo_id, LEVELS_SUFFIX, RECORD_DTYPE))
+        return index[index["start"] + index["count"] <= nrecords]
+
+    def history(self, wmo_id, start=None, end=None, msg_types=None, resolve=True):
+        """
+        Return every stored level of a station as one structured array with
+        the record time (datetime64[s]), message type, correction code and
+        the level fields, ordered by time and then message type. start and
+        end (datetimes, inclusive) and msg_types limit what is read. If
+        resolve is True, only the current version of each time and message
+        type is returned: the one with the highest correction rank (see
+        WMORecords.correction_rank), the last one added among equal ranks.
+        """
+        index = self.index(wmo_id)
+        keep = np.ones(len(index), dtype=bool)
+        if start is not None: keep &= index["time"] >= _seconds(start)
+        if end is not None: keep &= index["time"] <= _seconds(end)
+        if msg_types is not None:
+            keep &= np.isin(index["msg_type"], [STORE_MSG_TYPES.index(msg_type) for msg_type in msg_types])
+        entries = index[keep]
+        order = np.flatnonzero(keep)
+
+        if resolve and len(entries) > 0:
+            ranks = _code_ranks(entries["code"])
+            ## Sort by time, type, rank and arrival, then keep the last of each time and type
+            sort = np.lexsort((order, ranks, entries["msg_type"], entries["time"]))
+            entries = entries[sort]
+            last = np.r_[(entries["time"][1:] != entries["time"][:-1]) |
+                         (entries["msg_type"][1:] != entries["msg_type"][:-1]), True]
+            entries = entries[last]
+        elif len(entries) > 0:
+            entries = entries[np.lexsort((order, entries["msg_type"], entries["time"]))]
+
+        levels = self._map(wmo_id, LEVELS_SUFFIX, RECORD_DTYPE)
+        counts = entries["count"].astype(np.intp)
+        ## Record numbers of every level of every entry, in entry order
+        rows = np.repeat(entries["start"].astype(np.intp) - np.r_[0, np.cumsum(counts)[:-1]], counts)
+        rows += np.arange(counts.sum())
+
+        dtype = [("time", "datetime64[s]"), ("msg_type", "U4"), ("code", "U3")] + RECORD_DTYPE.descr
+        out = np.zeros(len(rows), dtype=dtype)
+        out["time"] = np.repeat(entries["time"], counts).astype("datetime64[s]")
+        out["msg_type"] = np.array(STORE_MSG_TYPES)[np.repeat(entries["msg_type"], counts)]
+        out["code"] = np.repeat(entries["code"], counts).astype("U3")
+        selected = levels[rows]
+        for name in RECORD_DTYPE.names: out[name] = selected[name]
+        return out
+
+    def _append(self, wmo_id, messages, stats=None):
+        index = self.index(wmo_id)
+        stored = set(zip(index["time"].tolist(), index["msg_type"].tolist(), index["code"].tolist(),
+                         index["digest"].tolist()))
+
+        rows, entries = [], []
+        levels_file = os.path.join(self.store_dir, wmo_id + LEVELS_SUFFIX)
+        nrecords = os.path.getsize(levels_file) // RECORD_DTYPE.itemsize if os.path.exists(levels_file) else 0
+        for seconds, msg_type, wmo_msg in messages:
+            try:
+                levels = _to_records(wmo_msg.decode())
+            except Exception:
+                ## Already counted as a decode failure, if stats were on
+                if stats is not None: stats.count("messages_not_stored")
+                continue
+            type_idx = STORE_MSG_TYPES.index(msg_type)
+            code = (wmo_msg.transmission_code or "").encode("ascii", "replace")[:3]
+            digest = _digest(levels)
+            key = (seconds, type_idx, code, digest)
+            if key in stored: continue
+            stored.add(key)
+            rows.append(levels)
+            entries.append((seconds, nrecords, len(levels), type_idx, code, digest))
+            nrecords += len(levels)
+        if len(entries) == 0: return 0
+
+        records = np.concatenate(rows)
+        ## Levels first, then the index. Writing at the end of the last
+        ## whole record drops anything left over from an interrupted write.
+        self._write_at(levels_file, entries[0][1] * RECORD_DTYPE.itemsize, records.tobytes())
+        index_file = os.path.join(self.store_dir, wmo_id + INDEX_SUFFIX)
+        nentries = os.path.getsize(index_file) // INDEX_DTYPE.itemsize if os.path.exists(index_file) else 0
+        self._write_at(index_file, nentries * INDEX_DTYPE.itemsize, np.array(entries, dtype=INDEX_DTYPE).tobytes())
+        return len(entries)
+
+    def _write_at(self, path, offset, data):
+        with open(path, "r+b" if os.path.exists(path) else "wb") as ofile:
+            ofile.seek(offset)
+            ofile.write(data)
+            ofile.truncate()
+
+    def _map(self, wmo_id, suffix, dtype):
+        path = os.path.join(self.store_dir, str(wmo_id) + suffix)
+        try:
+            nitems = os.path.getsize(path) // dtype.itemsize
+        except OSError:
+            return np.zeros(0, dtype=dtype)
+        if nitems == 0: return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(nitems,))
+
+
+def _seconds(time):
+    return int(np.datetime64(time, "s").astype(np.int64))
+
+
+def _to_records(levels):
+    records = np.zeros(len(levels), dtype=RECORD_DTYPE)
+    for name in RECORD_DTYPE.names: records[name] = levels[name]
+    return records
+
+
+def _digest(records):
+    ## Tells apart messages with the same time, type and code whose
+    ## levels differ, e.g. a correction that kept its heading. numpy
+    ## drops trailing NULs from bytes fields, so they're dropped here too.
+    digest = hashlib.blake2b(records.tobytes(), digest_size=INDEX_DTYPE["digest"].itemsize).digest()
+    return digest.rstrip(b"\0")
+
+
+def _code_ranks(codes):
+    """
+    Sortable integers for stored correction codes (see correction_rank).
+    """
+    ranks = {}
+    for code in set(codes.tolist()):
+        rank, letters = correction_rank(code.decode("ascii") or None)
+        ranks[code] = rank * 1000 + (ord(letters[0]) if letters else 0)
+    return np.array([ranks[code] for code in codes.tolist()], dtype=np.int64)
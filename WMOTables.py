@@ -0,0 +1,99 @@
+from collections import namedtuple
+
+## Fill value used while decoding. Decoded levels
+## returned by decode() use NaN instead.
+MISSING = -9999.0
+
+## Knots in one m/s. Winds reported in m/s are converted to knots.
+KTS_PER_MS = 1.943844
+
+## Bit flags for the "flag" column of decoded levels
+FLAG_SFC = 1
+FLAG_TROP = 2
+FLAG_MAXW = 4
+## Set by WMOSounding.assemble(interp_winds=True) on levels whose
+## wind was interpolated rather than reported
+FLAG_WIND_INTERP = 8
+
+## One entry of the mandatory level decode tables.
+##   lvl  - function of the 3 digit height group returning the pressure
+##   hght - function of the 3 digit height group returning the height
+##          in meters, or None for the surface (station elevation)
+##   p1   - offset from the level group to the temperature group, or -1
+##   p2   - offset from the level group to the wind group
+##   trop - 1 if this is the tropopause group
+##   flag - FLAG_* bits for the decoded level
+MandLevel = namedtuple("MandLevel", ["lvl", "hght", "p1", "p2", "trop", "flag"])
+
+
+def _const(value):
+    return lambda h1: value
+
+def _missing(h1):
+    return MISSING
+
+def _same(h1):
+    return h1
+
+def _tenths(h1):
+    return h1 / 10.0
+
+def _offset(add):
+    return lambda h1: h1 + add
+
+def _dam_offset(add):
+    return lambda h1: (h1 * 10) + add
+
+
+def _level(lvl, hght):
+    return MandLevel(lvl, hght, 1, 2, 0, 0)
+
+def _trop(lvl):
+    return MandLevel(lvl, _missing, 1, 2, 1, FLAG_TROP)
+
+def _maxw(lvl):
+    return MandLevel(lvl, _missing, -1, 1, 0, FLAG_MAXW)
+
+
+## Returned for any level code not in the tables below
+MAND_DEFAULT = MandLevel(_const(MISSING), _missing, 1, 2, 0, 0)
+
+## These tables reproduce the switch/case control flow of the
+## original NSHARP decoder. They're keyed by the integer value of
+## the first two digits of a mandatory level group, and built once
+## when the module is imported rather than for every level.
+MAND_TTAA = {
+    99: MandLevel(lambda h1: h1 + 1000 if h1 < 300 else h1, None, 1, 2, 0, FLAG_SFC),
+    0:  _level(_const(1000), _same),
+    92: _level(_const(925), _same),
+    85: _level(_const(850), _offset(1000)),
+    70: _level(_const(700), lambda h1: h1 + 3000 if h1 < 500 else h1 + 2000),
+    50: _level(_const(500), _dam_offset(0)),
+    40: _level(_const(400), _dam_offset(0)),
+    30: _level(_const(300), lambda h1: (h1 * 10) + 10000 if h1 < 300 else h1 * 10),
+    25: _level(_const(250), lambda h1: (h1 * 10) + 10000 if h1 < 600 else h1 * 10),
+    20: _level(_const(200), _dam_offset(10000)),
+    15: _level(_const(150), _dam_offset(10000)),
+    10: _level(_const(100), _dam_offset(10000)),
+    88: _trop(_same),
+    77: _maxw(_same),
+    66: _maxw(_same),
+}
+
+MAND_TTCC = {
+    70: _level(_const(70), _dam_offset(10000)),
+    50: _level(_const(50), lambda h1: (h1 * 10) + 10000 if h1 > 800 else (h1 * 10) + 20000),
+    30: _level(_const(30), _dam_offset(20000)),
+    20: _level(_const(20), _dam_offset(20000)),
+    10: _level(_const(10), _dam_offset(30000)),
+    7:  _level(_const(7), _dam_offset(30000)),
+    5:  _level(_const(5), _dam_offset(30000)),
+    3:  _level(_const(3), _dam_offset(30000)),
+    2:  _level(_const(2), _dam_offset(40000)),
+    1:  _level(_const(1), _dam_offset(40000)),
+    88: _trop(_tenths),
+    77: _maxw(_tenths),
+    66: _maxw(_tenths),
+}
+
+MAND_TABLES = {"TTAA": MAND_TTAA, "TTCC": MAND_TTCC}
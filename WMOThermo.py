@@ -0,0 +1,284 @@
+from WMOTables import MISSING
+from WMOData import RD, G, ZEROCNK
+import numpy as np
+
+## Specific heat of dry air at constant pressure (J/kg/K), latent heat
+## of vaporization (J/kg), Rd/Rv and Rd/cp
+CP = 1005.7
+LV = 2.501e6
+EPS = 0.62197
+KAPPA = RD / CP
+
+## Pressure (hPa) precipitable water is integrated up to
+PW_TOP = 400.0
+
+## Largest pressure step (hPa) used when lifting parcels moist adiabatically
+MOIST_STEP = 10.0
+
+## Fields of the decoded levels the batch arrays are built from
+BATCH_FIELDS = ["lvl", "hght", "tmpc", "dwpc"]
+
+
+def pad_levels(profiles, fields=BATCH_FIELDS):
+    """
+    Stack a list of decoded level arrays (see WMOMessage.LEVEL_DTYPE,
+    e.g. from WMOSounding.assemble) into a dictionary of padded
+    (n_soundings x n_levels) float arrays, one per field. Rows shorter
+    than the longest profile are padded with NaN, and any value still
+    equal to the decoder's MISSING is turned into NaN as well, so every
+    kernel here only has to deal with NaN.
+    """
+    nlevels = max([len(levels) for levels in profiles] + [0])
+    batch = {name: np.full((len(profiles), nlevels), np.nan) for name in fields}
+    for idx, levels in enumerate(profiles):
+        for name in fields:
+            batch[name][idx, :len(levels)] = levels[name]
+    for name in fields:
+        col = batch[name]
+        col[col == MISSING] = np.nan
+    return batch
+
+
+def batch_from_reader(reader, time_str=None):
+    """
+    Assemble every sounding of a WMOReader (or only those at time_str)
+    and return the list of (time_str, wmo_id) they belong to and their
+    padded arrays (see pad_levels). Records without a TTAA, and soundings
+    that can't be assembled, are skipped and counted in the reader's stats
+    (see WMOReader.create_sounding).
+    """
+    keys, profiles = [], []
+    times = [time_str] if time_str is not None else sorted(reader.records.keys())
+    reader.decode_all()
+    for tid in times:
+        for sid in sorted(reader.records[tid].keys()):
+            if "TTAA" not in reader.records[tid][sid]: continue
+            sounding = reader.create_sounding(tid, sid, skip_errors=True)
+            if sounding is None: continue
+            keys.append((tid, sid))
+            profiles.append(sounding.levels)
+    return keys, pad_levels(profiles)
+
+
+def saturation_vapor_pressure(tmpc):
+    """
+    Saturation vapor pressure (hPa) over water (Bolton 1980).
+    """
+    return 6.112 * np.exp(17.67 * tmpc / (tmpc + 243.5))
+
+
+def mixing_ratio(pres, dwpc):
+    """
+    Mixing ratio (g/kg) from the pressure (hPa) and dewpoint (C).
+    """
+    vappres = saturation_vapor_pressure(dwpc)
+    return 1000.0 * EPS * vappres / (pres - vappres)
+
+
+def potential_temperature(pres, tmpc):
+    """
+    Potential temperature (K).
+    """
+    return (tmpc + ZEROCNK) * (1000.0 / pres) ** KAPPA
+
+
+def virtual_temperature(pres, tmpc, dwpc):
+    """
+    Virtual temperature (K). Where the dewpoint is missing, the
+    temperature is used as is.
+    """
+    mixr = mixing_ratio(pres, dwpc) / 1000.0
+    mixr = np.where(np.isfinite(mixr), mixr, 0.0)
+    return (tmpc + ZEROCNK) * (1.0 + mixr / EPS) / (1.0 + mixr)
+
+
+def surface_parcel(pres, tmpc, dwpc):
+    """
+    Return the pressure, temperature and dewpoint of the lowest level of
+    every sounding that has all three (NaN for soundings that have none).
+    """
+    valid = np.isfinite(pres) & np.isfinite(tmpc) & np.isfinite(dwpc)
+    first = np.argmax(valid, axis=1)[:, None]
+    has = valid.any(axis=1)
+    pick = lambda col: np.where(has, np.take_along_axis(col, first, axis=1)[:, 0], np.nan)
+    return pick(pres), pick(tmpc), pick(dwpc)
+
+
+def lcl(pres, tmpc, dwpc):
+    """
+    Pressure (hPa) and temperature (C) of the lifting condensation level
+    of parcels at pres, tmpc and dwpc (Bolton 1980). Works on arrays of
+    any shape.
+    """
+    tmpk = tmpc + ZEROCNK
+    dwpk = dwpc + ZEROCNK
+    lcl_tmpk = 1.0 / (1.0 / (dwpk - 56.0) + np.log(tmpk / dwpk) / 800.0) + 56.0
+    lcl_pres = pres * (lcl_tmpk / tmpk) ** (1.0 / KAPPA)
+    return lcl_pres, lcl_tmpk - ZEROCNK
+
+
+def precipitable_water(pres, dwpc, top=PW_TOP):
+    """
+    Precipitable water (mm) of every sounding from the surface up to top
+    (hPa), integrating the specific humidity in pressure over the levels
+    that have a dewpoint. Levels without one (e.g. wind only levels) are
+    skipped, so the layers span from one dewpoint to the next.
+    """
+    pres, dwpc = _compress(np.isfinite(pres) & np.isfinite(dwpc), pres, dwpc)
+    mixr = mixing_ratio(pres, dwpc) / 1000.0
+    spfh = mixr / (1.0 + mixr)
+    ## Layer means in kg/kg times the thickness in Pa
+    layer = 0.5 * (spfh[:, :-1] + spfh[:, 1:]) * (pres[:, :-1] - pres[:, 1:]) * 100.0
+    inside = (pres[:, 1:] >= top) & np.isfinite(layer)
+    ## kg/m^2 of water is mm
+    return np.where(inside, layer, 0.0).sum(axis=1) / G
+
+
+def lift_parcels(pres, parcel_pres, parcel_tmpc, parcel_dwpc):
+    """
+    Lift parcels (one per sounding) from parcel_pres along a dry adiabat to
+    their LCL and a moist (pseudo) adiabat above it, and return the
+    parcel temperature (C) at every pressure of pres. Levels below the
+    parcel's starting pressure are NaN. The moist adiabat is integrated
+    with fourth order Runge-Kutta steps of at most MOIST_STEP hPa, for all
+    of the soundings at once, one level at a time.
+    """
+    nsoundings, nlevels = pres.shape
+    lcl_pres, lcl_tmpc = lcl(parcel_pres, parcel_tmpc, parcel_dwpc)
+    theta = potential_temperature(parcel_pres, parcel_tmpc)
+    dry = theta[:, None] * (pres / 1000.0) ** KAPPA - ZEROCNK
+
+    parcel = np.full((nsoundings, nlevels), np.nan)
+    prev_pres = lcl_pres.copy()
+    prev_tmpk = lcl_tmpc + ZEROCNK
+    for idx in range(nlevels):
+        level_pres = pres[:, idx]
+        above_lcl = level_pres < lcl_pres
+        ## Start from the LCL until the parcel has passed it
+        start_pres = np.where(prev_pres < lcl_pres, prev_pres, lcl_pres)
+        start_tmpk = np.where(prev_pres < lcl_pres, prev_tmpk, lcl_tmpc + ZEROCNK)
+        moist = _moist_lapse(start_pres, start_tmpk, np.where(above_lcl, level_pres, start_pres))
+
+        tmpc = np.where(above_lcl, moist - ZEROCNK, dry[:, idx])
+        tmpc = np.where(level_pres <= parcel_pres, tmpc, np.nan)
+        parcel[:, idx] = tmpc
+        lifted = above_lcl & np.isfinite(moist)
+        prev_pres = np.where(lifted, level_pres, prev_pres)
+        prev_tmpk = np.where(lifted, moist, prev_tmpk)
+    return parcel
+
+
+def cape_cin(pres, tmpc, dwpc):
+    """
+    Surface based CAPE and CIN (J/kg) of every sounding. The lowest level
+    with a temperature and dewpoint is lifted (see lift_parcels), and the
+    virtual temperature difference between the parcel and the environment
+    is integrated in log pressure over the levels with a temperature.
+    CAPE is the area between the level of free convection (the first
+    level above the surface where the parcel is warmer than the
+    environment) and the equilibrium level (the last such level); CIN is
+    the negative area below the LFC. Soundings without an LFC have zero
+    CAPE and CIN.
+    """
+    pres, tmpc, dwpc = _compress(np.isfinite(pres) & np.isfinite(tmpc), pres, tmpc, dwpc)
+    parcel_pres, parcel_tmpc, parcel_dwpc = surface_parcel(pres, tmpc, dwpc)
+    parcel_tmpc_lev = lift_parcels(pres, parcel_pres, parcel_tmpc, parcel_dwpc)
+
+    ## Below the LCL the parcel keeps its surface mixing ratio,
+    ## above it it is saturated
+    lcl_pres = lcl(parcel_pres, parcel_tmpc, parcel_dwpc)[0]
+    parcel_dwpc_lev = np.where(pres < lcl_pres[:, None], parcel_tmpc_lev,
+                               _dewpoint(pres, mixing_ratio(parcel_pres, parcel_dwpc)[:, None]))
+    diff = virtual_temperature(pres, parcel_tmpc_lev, parcel_dwpc_lev) - virtual_temperature(pres, tmpc, dwpc)
+
+    area = RD * 0.5 * (diff[:, :-1] + diff[:, 1:]) * np.log(pres[:, :-1] / pres[:, 1:])
+    area = np.where(np.isfinite(area), area, 0.0)
+    nlayers = area.shape[1]
+    layer = np.arange(nlayers)[None, :]
+
+    ## First and last layer whose top is positively buoyant
+    positive = np.isfinite(diff[:, 1:]) & (diff[:, 1:] > 0)
+    has_lfc = positive.any(axis=1)
+    lfc = np.where(has_lfc, np.argmax(positive, axis=1), nlayers)[:, None]
+    el = np.where(has_lfc, nlayers - 1 - np.argmax(positive[:, ::-1], axis=1), -1)[:, None]
+
+    cape = np.where((layer >= lfc) & (layer <= el), area, 0.0).sum(axis=1)
+    cin = np.where((layer < lfc) & (area < 0), area, 0.0).sum(axis=1)
+    cape = np.where(has_lfc, np.maximum(cape, 0.0), 0.0)
+    cin = np.where(has_lfc, cin, 0.0)
+    return cape, cin
+
+
+def thermo_batch(batch):
+    """
+    Run every kernel on a padded batch (see pad_levels) and return a
+    dictionary of the per level arrays (theta, mixr, tv) and per sounding
+    values (lcl_pres, lcl_tmpc, pw, cape, cin).
+    """
+    pres, tmpc, dwpc = batch["lvl"], batch["tmpc"], batch["dwpc"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        parcel_pres, parcel_tmpc, parcel_dwpc = surface_parcel(pres, tmpc, dwpc)
+        lcl_pres, lcl_tmpc = lcl(parcel_pres, parcel_tmpc, parcel_dwpc)
+        cape, cin = cape_cin(pres, tmpc, dwpc)
+        return {
+            "theta": potential_temperature(pres, tmpc),
+            "mixr": mixing_ratio(pres, dwpc),
+            "tv": virtual_temperature(pres, tmpc, dwpc),
+            "lcl_pres": lcl_pres,
+            "lcl_tmpc": lcl_tmpc,
+            "pw": precipitable_water(pres, dwpc),
+            "cape": cape,
+            "cin": cin,
+        }
+
+
+def _dewpoint(pres, mixr):
+    """
+    Dewpoint (C) of air with mixing ratio mixr (g/kg) at pres (hPa).
+    """
+    mixr = mixr / 1000.0
+    vappres = pres * mixr / (EPS + mixr)
+    logval = np.log(vappres / 6.112)
+    return 243.5 * logval / (17.67 - logval)
+
+
+def _moist_lapse(start_pres, start_tmpk, end_pres):
+    """
+    Temperature (K) reached following a pseudoadiabat from start_pres and
+    start_tmpk to end_pres, element-wise.
+    """
+    nsteps = np.nanmax(np.abs(end_pres - start_pres), initial=0.0) / MOIST_STEP
+    nsteps = max(1, int(np.ceil(nsteps))) if np.isfinite(nsteps) else 1
+    step = (end_pres - start_pres) / nsteps
+    tmpk = start_tmpk
+    pres = start_pres
+    for idx in range(nsteps):
+        k1 = _moist_gradient(pres, tmpk)
+        k2 = _moist_gradient(pres + 0.5 * step, tmpk + 0.5 * step * k1)
+        k3 = _moist_gradient(pres + 0.5 * step, tmpk + 0.5 * step * k2)
+        k4 = _moist_gradient(pres + step, tmpk + step * k3)
+        tmpk = tmpk + step * (k1 + 2.0 * k2 + 2.0 * k3 + k4) / 6.0
+        pres = pres + step
+    return tmpk
+
+
+def _moist_gradient(pres, tmpk):
+    """
+    dT/dp (K/hPa) along a pseudoadiabat.
+    """
+    vappres = saturation_vapor_pressure(tmpk - ZEROCNK)
+    mixr = EPS * vappres / (pres - vappres)
+    num = RD * tmpk + LV * mixr
+    den = CP + LV * LV * mixr * EPS / (RD * tmpk * tmpk)
+    return num / den / pres
+
+
+def _compress(valid, *cols):
+    """
+    Move the levels where valid is True to the front of every row of
+    each of cols, keeping their order, so that missing levels in the
+    middle of a profile don't break up the integrals. The rest is NaN.
+    """
+    order = np.argsort(~valid, axis=1, kind="stable")
+    keep = np.take_along_axis(valid, order, axis=1)
+    return tuple(np.where(keep, np.take_along_axis(col, order, axis=1), np.nan) for col in cols)
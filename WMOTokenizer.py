@@ -0,0 +1,257 @@
+import re
+
+## Message types we know how to find the start of
+HEADERS = ["TTAA", "TTBB", "PPBB", "PPDD", "TTCC", "TTDD", "PPAA", "PPCC"]
+
+## If either of the first two groups of a message is one of these,
+## the message is a NIL (or otherwise empty) report and is skipped.
+NIL_REPORTS = frozenset(["/////", "MISDA", "SUSPENDED", "NIL", "NILL", "NNNN", "XMTD", "@"])
+
+## Groups removed (once) from a message before it is used
+NIL_GROUPS = ["NIL", "NILL", "XMTD"]
+
+## Leftover pieces between messages that don't count as a message
+_EMPTY_SEGMENTS = frozenset(["", "\n", "\n\n", "\n\n\n"])
+
+_HEADER_SET = frozenset(HEADERS)
+_HEADER_RE = re.compile("|".join(HEADERS))
+_BOUNDARY_RE = re.compile("[=\x03]")
+
+
+def tokenize(text, pos=0, endpos=None, stats=None):
+    """
+    Walk raw bulletin text once and yield a (header, msg_type, tokens,
+    start, end) tuple for every message that isn't a NIL report.
+
+    Transmissions end with the End Of Transmission ('\\x03') character
+    and messages end with '='. The second line of the first message
+    in a transmission is the WMO heading (e.g. USUS50 KWBC 130000 RRA),
+    which is returned split on spaces as header. tokens is the message
+    split into its groups, starting at the message type (tokens[0] is
+    msg_type), ready for WMOUpperAirMessage.set_message. start and end
+    are the offsets of the message groups within text, so that
+    text[start:end] can be tokenized again on its own (see
+    tokenize_message). The '\\r' and Start Of Transmission ('\\x01')
+    characters are ignored. If stats (a WMOStats) is given, the
+    transmissions and NIL reports are counted.
+    """
+    if endpos is None: endpos = len(text)
+    header = None
+    first = True
+    seg_start = pos
+    for match in _BOUNDARY_RE.finditer(text, pos, endpos):
+        seg_end = match.start()
+        raw = text[seg_start:seg_end]
+        seg = raw.replace("\r", "").replace("\x01", "")
+        if seg not in _EMPTY_SEGMENTS:
+            start = seg_start
+            if first:
+                ## The first message holds the transmission heading.
+                ## If there is no heading, skip the whole transmission.
+                first = False
+                header, body_offset, seg = _split_heading(raw, seg)
+                start += body_offset
+            if header is not None:
+                tokens = _message_tokens(seg)
+                if tokens is not None:
+                    yield header, tokens[0], tokens, start, seg_end
+                elif stats is not None: stats.count("nil_reports")
+
+        if match.group() == "\x03":
+            if stats is not None: stats.count("transmissions")
+            header = None
+            first = True
+        seg_start = match.end()
+
+    ## Anything after the last end of message marker
+    raw = text[seg_start:endpos]
+    seg = raw.replace("\r", "").replace("\x01", "")
+    if seg in _EMPTY_SEGMENTS: return
+    start = seg_start
+    if first:
+        header, body_offset, seg = _split_heading(raw, seg)
+        start += body_offset
+    if header is None: return
+    tokens = _message_tokens(seg)
+    if tokens is not None:
+        yield header, tokens[0], tokens, start, endpos
+    elif stats is not None: stats.count("nil_reports")
+
+
+def tokenize_message(text):
+    """
+    Split the text of a single message (without its heading) into its
+    groups, or return None if it is a NIL report.
+    """
+    return _message_tokens(text.replace("\r", "").replace("\x01", ""))
+
+
+def _split_heading(raw, seg):
+    """
+    Split the first message of a transmission into the heading (split
+    on spaces), the offset of the message body within raw, and the
+    body text. The heading is the second non-empty line - the first
+    is the LDM sequence number.
+    """
+    lines = [line for line in seg.split("\n") if line]
+    if len(lines) == 0: return None, 0, ""
+    if len(lines) == 1:
+        ## Everything is on one line, so the heading
+        ## is the second group on that line
+        groups = lines[0].split(" ")
+        if len(groups) < 2: return None, 0, ""
+        body_offset = len(raw)
+        nspaces = 0
+        for idx in range(len(raw)):
+            if raw[idx] == " ":
+                nspaces += 1
+                if nspaces == 2:
+                    body_offset = idx + 1
+                    break
+        return [groups[1]], body_offset, " ".join(groups[2:])
+
+    ## Find where the third non-empty line starts in the raw text
+    body_offset = len(raw)
+    offset = 0
+    nlines = 0
+    for line in raw.split("\n"):
+        if line.replace("\r", "").replace("\x01", ""):
+            nlines += 1
+            if nlines == 3:
+                body_offset = offset
+                break
+        offset += len(line) + 1
+    return lines[1].split(" "), body_offset, "\n".join(lines[2:])
+
+
+def _message_tokens(seg):
+    """
+    Split the text of a message into its groups, drop anything before
+    the message type and remove the NIL groups. Returns None for NIL
+    and empty reports.
+    """
+    tokens = seg.replace("\n", " ").split(" ")
+    tokens = list(filter(None, tokens))
+    if len(tokens) == 0: return None
+
+    ## Find where our data starts by searching for a
+    ## matching header string in the list
+    if tokens[0] not in _HEADER_SET:
+        for idx in range(len(tokens)):
+            if _HEADER_RE.search(tokens[idx]):
+                tokens = tokens[idx:]
+                break
+
+    for ignore in NIL_GROUPS:
+        if ignore in tokens: tokens.remove(ignore)
+        elif ignore.lower() in tokens: tokens.remove(ignore.lower())
+
+    ## These messages usually are NIL transmissions
+    if len(tokens) <= 2: return None
+    ## Check a little more explicitly for NIL transmissions
+    ## just in case...
+    if tokens[0].upper() in NIL_REPORTS or tokens[1].upper() in NIL_REPORTS: return None
+    return tokens
+
+
+## Patterns for the bytes (memory mapped) path. A group is a run of
+## anything but spaces, newlines and message/transmission boundaries.
+## '\r' and '\x01' are dropped from the text, so they may appear inside
+## a group but a run of only those characters isn't a group.
+_GROUP_RE_B = re.compile(b"[^ \n\r\x01=\x03]+(?:[\r\x01]+[^ \n\r\x01=\x03]+)*")
+_BOUNDARY_RE_B = re.compile(b"[=\x03]")
+## Any NIL group contains one of these characters. Numeric
+## groups never do, so most messages skip the NIL check.
+_NIL_CHARS_RE_B = re.compile(b"[NnXx]")
+
+
+def tokenize_buffer(buf, pos=0, endpos=None, stats=None):
+    """
+    Same as tokenize, but for bytes-like objects such as a memory mapped
+    file, and without splitting the messages up. Yields a (header,
+    msg_type, wmo_id, start, end) tuple for every message that isn't a
+    NIL report, where buf[start:end] holds the message groups starting
+    at the message type. Only the first few groups of each message are
+    read from buf; use message_groups to get the rest when they're needed.
+    """
+    if endpos is None: endpos = len(buf)
+    header = None
+    first = True
+    seg_start = pos
+    bounds = [match.start() for match in _BOUNDARY_RE_B.finditer(buf, pos, endpos)]
+    bounds.append(endpos)
+    for seg_end in bounds:
+        start = seg_start
+        if first:
+            ## Only the first message of each transmission is copied
+            ## out of the buffer, to find the transmission heading.
+            raw = buf[seg_start:seg_end].decode("latin-1")
+            seg = raw.replace("\r", "").replace("\x01", "")
+            if seg not in _EMPTY_SEGMENTS:
+                first = False
+                header, body_offset, seg = _split_heading(raw, seg)
+                start += body_offset
+        if not first and header is not None:
+            head = _message_head(buf, start, seg_end)
+            if head is not None:
+                yield header, head[1], head[2], head[0], seg_end
+            elif stats is not None and _GROUP_RE_B.search(buf, start, seg_end):
+                stats.count("nil_reports")
+
+        if seg_end < endpos and buf[seg_end:seg_end + 1] == b"\x03":
+            if stats is not None: stats.count("transmissions")
+            header = None
+            first = True
+        seg_start = seg_end + 1
+
+
+def message_groups(buf, start, end):
+    """
+    Copy a message yielded by tokenize_buffer out of buf and split it
+    into its groups, the same as tokenize would have.
+    """
+    return tokenize_message(buf[start:end].decode("latin-1"))
+
+
+def _group_text(buf, span):
+    group = buf[span[0]:span[1]]
+    if b"\r" in group or b"\x01" in group:
+        group = group.replace(b"\r", b"").replace(b"\x01", b"")
+    return group.decode("latin-1")
+
+
+def _message_head(buf, start, end):
+    """
+    Bytes version of _message_tokens that stops as soon as it knows the
+    message isn't a NIL report. Returns the offset where the message
+    type starts, the message type and the WMO ID, or None for NIL and
+    empty reports.
+    """
+    groups = _GROUP_RE_B.finditer(buf, start, end)
+    spans = []
+    for match in groups:
+        ## Find where our data starts by searching for a
+        ## matching header string in the list
+        if len(spans) == 0 and not _HEADER_RE.search(_group_text(buf, match.span())):
+            continue
+        spans.append(match.span())
+        if len(spans) == 3: break
+
+    ## No header in the message, so the data starts at the first group
+    if len(spans) == 0:
+        spans = [match.span() for match in _GROUP_RE_B.finditer(buf, start, end)][:3]
+    if len(spans) == 0: return None
+    data_start = spans[0][0]
+
+    ## Messages containing a NIL group need all of their groups
+    ## checked. Numeric groups never contain these characters.
+    if _NIL_CHARS_RE_B.search(buf, data_start, end):
+        tokens = message_groups(buf, data_start, end)
+        if tokens is None: return None
+        return data_start, tokens[0], tokens[2]
+
+    if len(spans) <= 2: return None
+    msg_type = _group_text(buf, spans[0])
+    if msg_type.upper() in NIL_REPORTS: return None
+    if _group_text(buf, spans[1]).upper() in NIL_REPORTS: return None
+    return data_start, msg_type, _group_text(buf, spans[2])
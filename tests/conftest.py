@@ -0,0 +1,37 @@
+import os
+import sys
+
+## The modules live at the top of the repository
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+TEST_FILE = os.path.join(REPO_DIR, "test.wmo")
+
+
+def corrupt_copy(tmp_path, old, new, which=None):
+    """
+    Write a copy of test.wmo with old replaced by new and return its
+    path. which is a list of the occurrences to replace (0 is the first),
+    or None to replace all of them.
+    """
+    with open(TEST_FILE, "r", newline="") as snfile:
+        parts = snfile.read().split(old)
+    assert len(parts) > 1
+    text = parts[0]
+    for idx, part in enumerate(parts[1:]):
+        text += (new if which is None or idx in which else old) + part
+    path = tmp_path / "corrupt.wmo"
+    with open(path, "w", newline="") as snfile:
+        snfile.write(text)
+    return str(path)
+
+
+def all_messages(records):
+    return [(tid, sid, msg_type, wmo_msg) for tid in sorted(records.keys())
+            for sid in sorted(records[tid].keys())
+            for msg_type, wmo_msg in sorted(records[tid][sid].items())]
+
+
+def same_levels(levels1, levels2):
+    if levels1 is None or levels2 is None: return levels1 is None and levels2 is None
+    return levels1.dtype == levels2.dtype and levels1.tobytes() == levels2.tobytes()
@@ -0,0 +1,47 @@
+from conftest import TEST_FILE, corrupt_copy, all_messages, same_levels
+from WMOParser import WMOReader
+from WMOStats import WMOStats
+import pytest
+
+
+def _decode(filename, batch):
+    stats = WMOStats()
+    reader = WMOReader(filename, stats=stats)
+    failed = reader.decode_all(batch=batch)
+    failures = {name: num for name, num in stats.counters.items() if name.startswith("decode_failures")}
+    return reader, failed, failures
+
+
+def _assert_same(filename):
+    batch, batch_failed, batch_failures = _decode(filename, True)
+    scalar, scalar_failed, scalar_failures = _decode(filename, False)
+    batch_msgs = all_messages(batch.records)
+    scalar_msgs = all_messages(scalar.records)
+    assert [msg[:3] for msg in batch_msgs] == [msg[:3] for msg in scalar_msgs]
+    for (tid, sid, msg_type, batch_msg), (_, _, _, scalar_msg) in zip(batch_msgs, scalar_msgs):
+        assert same_levels(batch_msg.levels, scalar_msg.levels), (tid, sid, msg_type)
+    assert [(msg.time_str, msg.id, msg.type) for msg in batch_failed] == \
+           [(msg.time_str, msg.id, msg.type) for msg in scalar_failed]
+    assert batch_failures == scalar_failures
+    return batch, batch_failed, batch_failures
+
+
+def test_batch_matches_scalar():
+    reader, failed, failures = _assert_same(TEST_FILE)
+    assert failed == []
+    assert failures == {}
+
+
+@pytest.mark.parametrize("old, new", [
+    ("99870 36683 08505", "99870 3A683 08505"),
+    ("99870 36683 08505", "99870 36683 0A505"),
+])
+def test_bad_group_only_fails_its_message(tmp_path, old, new):
+    filename = corrupt_copy(tmp_path, old, new)
+    reader, failed, failures = _assert_same(filename)
+    assert [(msg.id, msg.type) for msg in failed] == [("72572", "TTAA")]
+    assert failures == {"decode_failures.TTAA": 1}
+    with pytest.raises(ValueError):
+        failed[0].decode()
+    nmessages = len(all_messages(reader.records))
+    assert sum(msg.levels is not None for tid, sid, msg_type, msg in all_messages(reader.records)) == nmessages - 1
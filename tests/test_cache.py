@@ -0,0 +1,90 @@
+from conftest import TEST_FILE, corrupt_copy, all_messages, same_levels
+from WMOCache import WMOCache, TEMP_SUFFIX, TEMP_MAX_AGE, CACHE_SUFFIX
+from WMOParser import WMOReader
+import os
+import pytest
+import shutil
+import time
+
+
+def _copy(tmp_path, name="20220713_00Z.uair"):
+    filename = str(tmp_path / name)
+    shutil.copy(TEST_FILE, filename)
+    return filename
+
+
+def _same(reader1, reader2):
+    msgs1, msgs2 = all_messages(reader1.records), all_messages(reader2.records)
+    assert [msg[:3] for msg in msgs1] == [msg[:3] for msg in msgs2]
+    for (_, _, _, msg1), (_, _, _, msg2) in zip(msgs1, msgs2):
+        assert same_levels(msg1.levels, msg2.levels)
+
+
+def test_hits_until_the_file_changes(tmp_path):
+    filename = _copy(tmp_path)
+    cache = WMOCache(str(tmp_path / "cache"))
+    first = cache.read(filename)
+    second = cache.read(filename)
+    assert (cache.hits, cache.misses) == (1, 1)
+    _same(first, second)
+
+    ## Touched but not changed is still a hit
+    os.utime(filename, ns=(0, 0))
+    cache.read(filename)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    with open(filename, "ab") as snfile:
+        snfile.write(b"\n")
+    cache.read(filename)
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_decode_failures_are_cached(tmp_path):
+    filename = corrupt_copy(tmp_path, "99870 36683 08505", "99870 3A683 08505")
+    cache = WMOCache(str(tmp_path / "cache"))
+    failed = [msg[:3] for msg in all_messages(cache.read(filename).records) if msg[3].levels is None]
+    reader = cache.read(filename)
+    assert cache.hits == 1 and len(failed) > 0
+    assert [msg[:3] for msg in all_messages(reader.records) if msg[3].levels is None] == failed
+    with pytest.raises(ValueError):
+        reader.records.get_message(*failed[0]).decode()
+
+
+def test_cache_is_private(tmp_path):
+    filename = _copy(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    cache = WMOCache(cache_dir)
+    cache.read(filename)
+    assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+
+    ## Entries anyone else can write to are ignored
+    for name in os.listdir(cache_dir): os.chmod(os.path.join(cache_dir, name), 0o666)
+    WMOCache(cache_dir).read(filename)
+    other = WMOCache(cache_dir)
+    other.read(filename)
+    assert other.hits == 1
+
+    shared = str(tmp_path / "shared")
+    os.makedirs(shared)
+    os.chmod(shared, 0o777)
+    with pytest.raises(PermissionError):
+        WMOCache(shared).read(filename)
+
+
+def test_evict_keeps_the_cache_under_max_bytes(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    cache = WMOCache(cache_dir)
+    filenames = [_copy(tmp_path, "2022071{day}_00Z.uair".format(day=day)) for day in range(3)]
+    cache.read(filenames[0])
+    entry_size = cache.size
+
+    stale = os.path.join(cache_dir, "stale" + TEMP_SUFFIX)
+    open(stale, "w").close()
+    os.utime(stale, (time.time() - TEMP_MAX_AGE - 60,) * 2)
+
+    small = WMOCache(cache_dir, max_bytes=2 * entry_size)
+    for filename in filenames: small.read(filename)
+    entries = [name for name in os.listdir(cache_dir) if name.endswith(CACHE_SUFFIX)]
+    assert len(entries) == 2
+    assert small.size <= 2 * entry_size
+    assert not os.path.exists(stale)
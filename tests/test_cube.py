@@ -0,0 +1,88 @@
+from conftest import TEST_FILE, corrupt_copy, same_levels
+from WMOCube import WMOSoundingCube, interp_profile
+from WMOData import WMOSounding
+from WMOMessage import LEVEL_DTYPE
+from WMOParser import WMOReader
+from WMOStats import WMOStats
+from WMOTables import KTS_PER_MS
+import numpy as np
+import datetime
+
+REF_DATE = datetime.date(2022, 7, 13)
+VALID = datetime.datetime(2022, 7, 13, 0, 0)
+
+
+def _levels(pres, tmpc, wdir=np.nan, wspd=np.nan):
+    levels = np.zeros(len(pres), dtype=LEVEL_DTYPE)
+    levels["lvl"] = pres
+    levels["tmpc"] = tmpc
+    levels["hght"] = np.nan
+    levels["dwpc"] = np.nan
+    levels["wdir"] = wdir
+    levels["wspd"] = wspd
+    return levels
+
+
+def test_interp_profile_is_linear_in_log_pressure():
+    levels = _levels([1000.0, 500.0, 250.0], [20.0, -10.0, -40.0], wdir=[270.0, 270.0, 180.0],
+                     wspd=[10.0, 20.0, 40.0])
+    grid = [1000.0, 707.1067811865476, 500.0, 300.0, 100.0]
+    out = interp_profile(levels, grid, ["tmpc", "u", "v"])
+
+    ## Grid levels on a reported level get its value, halfway in log
+    ## pressure gets the mean, and nothing is extrapolated
+    assert np.allclose(out[[0, 2], 0], [20.0, -10.0])
+    assert np.isclose(out[1, 0], 5.0)
+    assert np.isnan(out[4]).all()
+    assert np.allclose(out[0, 1:], [10.0, 0.0], atol=1e-5)
+    assert np.allclose(out[2, 1:], [20.0, 0.0], atol=1e-5)
+
+
+def test_winds_reported_in_ms_are_converted_to_knots(tmp_path):
+    ## A day group under 50 means the winds are in m/s
+    filename = corrupt_copy(tmp_path, "TTAA 63001 72572", "TTAA 13001 72572")
+    knots = WMOReader(TEST_FILE).records.get_message("130000", "72572", "TTAA")
+    ms = WMOReader(filename).records.get_message("130000", "72572", "TTAA")
+    ms.decode()
+    knots.decode()
+    assert ms.wind_in_kts is False and knots.wind_in_kts is True
+    assert np.allclose(ms.levels["wspd"], knots.levels["wspd"] * KTS_PER_MS, equal_nan=True)
+
+    ## Batch decoding converts them the same way
+    batch = WMOReader(filename)
+    batch.decode_all()
+    assert same_levels(batch.records.get_message("130000", "72572", "TTAA").levels, ms.levels)
+
+
+def test_cube_matches_the_soundings(tmp_path):
+    cube = WMOSoundingCube(str(tmp_path / "cube"), max_stations=1000)
+    nsoundings = cube.add_reader(WMOReader(TEST_FILE), ref_date=REF_DATE)
+    assert nsoundings > 0
+    assert cube.time_list() == [VALID]
+
+    reader = WMOReader(TEST_FILE)
+    reader.decode_all()
+    sounding = reader.create_sounding("130000", "72572")
+    expected = interp_profile(sounding.levels, cube.grid, cube.variables)
+    assert np.array_equal(cube.select(station="72572", time=VALID), expected, equal_nan=True)
+
+    ## Reopening the cube reads back the same data
+    again = WMOSoundingCube(str(tmp_path / "cube"))
+    assert np.array_equal(again.select(station="72572", time=VALID), expected, equal_nan=True)
+
+
+def test_bad_station_does_not_stop_the_cube(tmp_path, monkeypatch):
+    assemble = WMOSounding.assemble
+
+    def broken(sounding, *args, **kwargs):
+        if sounding.wmo_id == "72572": raise ValueError("bad sounding")
+        return assemble(sounding, *args, **kwargs)
+
+    good = WMOSoundingCube(str(tmp_path / "good"), max_stations=1000)
+    ngood = good.add_reader(WMOReader(TEST_FILE), ref_date=REF_DATE)
+    monkeypatch.setattr(WMOSounding, "assemble", broken)
+    stats = WMOStats()
+    cube = WMOSoundingCube(str(tmp_path / "cube"), max_stations=1000)
+    assert cube.add_reader(WMOReader(TEST_FILE, stats=stats), ref_date=REF_DATE) == ngood - 1
+    assert "72572" not in cube.stations
+    assert stats.counters["soundings_failed"] == 1
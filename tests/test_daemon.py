@@ -0,0 +1,66 @@
+from conftest import TEST_FILE
+from WMODaemon import WMODecoderDaemon, default_socket
+from WMOParser import WMOReader
+import asyncio
+import json
+import os
+import shutil
+import stat
+
+
+def _data_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    filename = str(data_dir / "20220713_00Z.uair")
+    shutil.copy(TEST_FILE, filename)
+    return str(data_dir), filename
+
+
+def test_default_socket_is_per_user(monkeypatch, tmp_path):
+    monkeypatch.delenv("WMO_DAEMON_SOCKET", raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert default_socket() == str(tmp_path / "wmo_decoder.sock")
+    monkeypatch.setenv("WMO_DAEMON_SOCKET", str(tmp_path / "other.sock"))
+    assert default_socket() == str(tmp_path / "other.sock")
+
+
+def test_only_files_in_the_data_dirs_are_read(tmp_path):
+    data_dir, filename = _data_dir(tmp_path)
+    outside = str(tmp_path / "outside.uair")
+    shutil.copy(TEST_FILE, outside)
+    link = os.path.join(data_dir, "link.uair")
+    os.symlink(outside, link)
+    daemon = WMODecoderDaemon(data_dirs=[data_dir])
+
+    response = daemon.handle({"cmd": "decode", "file": filename})
+    assert response["ok"]
+    assert sorted(response["records"].keys()) == sorted(WMOReader(TEST_FILE).records.keys())
+    for path in [outside, link, os.path.join(data_dir, "..", "outside.uair"), "/etc/passwd"]:
+        response = daemon.handle({"cmd": "decode", "file": path})
+        assert not response["ok"]
+        assert response["error"].startswith("PermissionError")
+    assert daemon.handle({"cmd": "sounding", "file": outside, "station": "72572", "time": "130000"})["ok"] is False
+
+
+def test_socket_is_private(tmp_path):
+    data_dir, filename = _data_dir(tmp_path)
+    path = str(tmp_path / "run" / "wmo.sock")
+    daemon = WMODecoderDaemon(data_dirs=[data_dir])
+
+    async def serve():
+        server = await daemon.serve_unix(path)
+        try:
+            reader, writer = await asyncio.open_unix_connection(path)
+            request = {"cmd": "sounding", "file": filename, "station": "72572", "time": "130000"}
+            writer.write(json.dumps(request).encode() + b"\n")
+            response = json.loads(await reader.readline())
+            writer.close()
+            return response
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    response = asyncio.run(serve())
+    assert response["ok"] and response["wmo_id"] == "72572"
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
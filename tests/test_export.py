@@ -0,0 +1,47 @@
+from conftest import TEST_FILE, corrupt_copy
+from WMOExport import export_sharppy, main
+from WMOParser import WMOReader
+from WMOStats import WMOStats
+import datetime
+import sys
+import zipfile
+
+REF_DATE = datetime.date(2022, 7, 13)
+
+
+def test_undecodable_message_does_not_stop_the_export(tmp_path):
+    filename = corrupt_copy(tmp_path, "99870 36683 08505", "99870 3A683 08505")
+    stats = WMOStats()
+    archive = str(tmp_path / "soundings.zip")
+    names = export_sharppy(WMOReader(filename, stats=stats), archive=archive, ref_date=REF_DATE, stats=stats)
+    good = export_sharppy(WMOReader(TEST_FILE), out_dir=str(tmp_path / "good"), ref_date=REF_DATE)
+
+    assert sum(num for name, num in stats.counters.items() if name.startswith("decode_failures")) > 0
+    assert names == good
+    with zipfile.ZipFile(archive) as zfile:
+        assert sorted(zfile.namelist()) == sorted(names)
+
+
+def test_main_merges_files_before_exporting(tmp_path, monkeypatch):
+    ## Split test.wmo into two files at a transmission boundary, so the
+    ## parts of some soundings are in different files
+    with open(TEST_FILE, "r", newline="") as snfile:
+        text = snfile.read()
+    split = text.index("\x01", len(text) // 2)
+    filenames = []
+    for hour, part in [("00", text[:split]), ("01", text[split:]), ("02", text)]:
+        filename = str(tmp_path / "20220713_{hour}Z.uair".format(hour=hour))
+        with open(filename, "w", newline="") as snfile:
+            snfile.write(part)
+        filenames.append(filename)
+
+    archive = str(tmp_path / "soundings.zip")
+    monkeypatch.setattr(sys, "argv", ["WMOExport.py", "-j", "1", "--zip", archive] + filenames)
+    main()
+    good = export_sharppy(WMOReader(TEST_FILE), out_dir=str(tmp_path / "good"), ref_date=REF_DATE)
+    with zipfile.ZipFile(archive) as zfile:
+        names = zfile.namelist()
+        assert sorted(names) == sorted(good)
+        for name in good:
+            with open(str(tmp_path / "good" / name), "r") as gfile:
+                assert zfile.read(name).decode("ascii") == gfile.read()
@@ -0,0 +1,54 @@
+from conftest import TEST_FILE, all_messages
+from WMOParser import WMOReader
+import os
+
+
+def _current(records):
+    return [(tid, sid, msg_type, wmo_msg.transmission_code, wmo_msg.message)
+            for tid, sid, msg_type, wmo_msg in all_messages(records)]
+
+
+def _read():
+    with open(TEST_FILE, "rb") as snfile:
+        return snfile.read()
+
+
+def test_follow_reads_only_complete_transmissions(tmp_path):
+    data = _read()
+    ## Cut in the middle of a transmission
+    cut = data.index(b"\x03", len(data) // 2) - 100
+    filename = str(tmp_path / "growing.uair")
+    with open(filename, "wb") as snfile:
+        snfile.write(data[:cut])
+
+    reader = WMOReader(filename, follow=True)
+    assert reader.offset == data.rfind(b"\x03", 0, cut) + 1
+    first = _current(reader.records)
+    assert reader.update() == []
+
+    with open(filename, "ab") as snfile:
+        snfile.write(data[cut:])
+    changes = reader.update()
+    assert reader.offset == data.rfind(b"\x03") + 1
+    assert len(changes) > 0
+    assert all(status in ("added", "replaced") for time_str, wmo_id, msg_type, status in changes)
+    assert len(_current(reader.records)) > len(first)
+    assert _current(reader.records) == _current(WMOReader(TEST_FILE).records)
+
+
+def test_follow_starts_over_when_the_file_is_replaced(tmp_path):
+    data = _read()
+    filename = str(tmp_path / "growing.uair")
+    with open(filename, "wb") as snfile:
+        snfile.write(data)
+    reader = WMOReader(filename, follow=True)
+
+    ## A new file in its place, shorter than what was read
+    first = data[:data.index(b"\x03") + 1]
+    replacement = str(tmp_path / "replacement.uair")
+    with open(replacement, "wb") as snfile:
+        snfile.write(first)
+    os.replace(replacement, filename)
+    reader.update()
+    assert reader.offset == len(first)
+    assert _current(reader.records) == _current(WMOReader(filename).records)
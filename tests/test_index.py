@@ -0,0 +1,43 @@
+from conftest import TEST_FILE, all_messages
+from WMOIndex import WMOIndex
+from WMOParser import WMOReader
+import datetime
+import shutil
+
+
+def _copies(tmp_path, dates):
+    filenames = []
+    for date in dates:
+        filename = str(tmp_path / (date + "_00Z.uair"))
+        shutil.copy(TEST_FILE, filename)
+        filenames.append(filename)
+    return filenames
+
+
+def test_query_matches_the_reader(tmp_path):
+    filename, = _copies(tmp_path, ["20220713"])
+    with WMOIndex(str(tmp_path / "index.sqlite")) as index:
+        index.add_file(filename)
+        records = index.records(time=202207130000)
+
+    reader = WMOReader(filename)
+    expected = [(sid, msg_type, wmo_msg.transmission_code, wmo_msg.message)
+                for tid, sid, msg_type, wmo_msg in all_messages(reader.records)]
+    assert sorted(records.keys()) == ["202207130000"]
+    assert [(sid, msg_type, wmo_msg.transmission_code, wmo_msg.message)
+            for tid, sid, msg_type, wmo_msg in all_messages(records)] == expected
+
+
+def test_files_from_different_months_are_kept_apart(tmp_path):
+    july, august = _copies(tmp_path, ["20220713", "20220813"])
+    with WMOIndex(str(tmp_path / "index.sqlite")) as index:
+        assert index.add_files([july, august]) > 0
+        july_entries = index.query(wmo_id="72572", time="202207130000", msg_type="TTAA")
+        assert {entry.filename for entry in july_entries} == {july}
+        assert index.query(wmo_id="72572", time=datetime.datetime(2022, 8, 13), msg_type="TTAA") == \
+               [entry._replace(filename=august, time=entry.time + 1000000) for entry in july_entries]
+
+        ## A ddhhmm time matches every month, but the records stay apart
+        records = index.records(wmo_id="72572", time=130000, msg_type="TTAA")
+        assert sorted(records.keys()) == ["202207130000", "202208130000"]
+        assert len(records.versions("202207130000", "72572", "TTAA")) == len(july_entries)
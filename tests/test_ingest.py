@@ -0,0 +1,18 @@
+from conftest import TEST_FILE, all_messages
+from WMOIngest import ingest_files
+from WMOParser import WMOReader
+import shutil
+
+
+def test_merge_keeps_files_from_different_months(tmp_path):
+    filenames = []
+    for date in ["20220713", "20220813", "20230713"]:
+        filename = str(tmp_path / (date + "_00Z.uair"))
+        shutil.copy(TEST_FILE, filename)
+        filenames.append(filename)
+    single = all_messages(WMOReader(TEST_FILE).records)
+
+    merged = ingest_files(filenames, processes=1)
+    assert len(all_messages(merged.records)) == 3 * len(single)
+    assert sorted(merged.records.keys()) == ["202207130000", "202208130000", "202307130000"]
+    assert merged.records.get_message("202208130000", "72572", "TTAA") is not None
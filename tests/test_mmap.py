@@ -0,0 +1,33 @@
+from conftest import TEST_FILE, all_messages, same_levels
+from WMOParser import WMOReader
+from WMOTokenizer import tokenize, tokenize_buffer, message_groups
+
+
+def test_buffer_tokens_match_text_tokens():
+    with open(TEST_FILE, "rb") as snfile:
+        buf = snfile.read()
+    text = buf.decode("latin-1")
+    expected = [(header, msg_type, groups[2], groups) for header, msg_type, groups, start, end in tokenize(text)]
+    actual = [(header, msg_type, wmo_id, message_groups(buf, start, end))
+              for header, msg_type, wmo_id, start, end in tokenize_buffer(buf)]
+    assert actual == expected
+
+
+def test_mmap_reader_matches_the_text_reader():
+    text_reader = WMOReader(TEST_FILE)
+    mmap_reader = WMOReader(TEST_FILE, use_mmap=True)
+    try:
+        text_msgs = all_messages(text_reader.records)
+        mmap_msgs = all_messages(mmap_reader.records)
+        assert [msg[:3] for msg in mmap_msgs] == [msg[:3] for msg in text_msgs]
+        for (tid, sid, msg_type, mmap_msg), (_, _, _, text_msg) in zip(mmap_msgs, text_msgs):
+            assert mmap_msg.header == text_msg.header
+            assert mmap_msg.message == text_msg.message
+            assert [old.message for old in mmap_reader.records.superseded(tid, sid, msg_type)] == \
+                   [old.message for old in text_reader.records.superseded(tid, sid, msg_type)]
+        mmap_reader.decode_all()
+        text_reader.decode_all()
+        for (tid, sid, msg_type, mmap_msg), (_, _, _, text_msg) in zip(mmap_msgs, text_msgs):
+            assert same_levels(mmap_msg.levels, text_msg.levels), (tid, sid, msg_type)
+    finally:
+        mmap_reader.close()
@@ -0,0 +1,51 @@
+from conftest import TEST_FILE, corrupt_copy, all_messages, same_levels
+from WMOParser import WMOReader
+from WMOStats import WMOStats
+import pytest
+
+
+def _read(filename, processes):
+    stats = WMOStats()
+    reader = WMOReader(filename, processes=processes, stats=stats)
+    if processes is None: reader.decode_all()
+    return reader, stats
+
+
+def _assert_same(filename, processes):
+    serial, serial_stats = _read(filename, None)
+    parallel, parallel_stats = _read(filename, processes)
+    serial_msgs = all_messages(serial.records)
+    parallel_msgs = all_messages(parallel.records)
+    assert [msg[:3] for msg in parallel_msgs] == [msg[:3] for msg in serial_msgs]
+    for (tid, sid, msg_type, serial_msg), (_, _, _, parallel_msg) in zip(serial_msgs, parallel_msgs):
+        assert parallel_msg.header == serial_msg.header, (tid, sid, msg_type)
+        assert parallel_msg.message == serial_msg.message, (tid, sid, msg_type)
+        assert same_levels(parallel_msg.levels, serial_msg.levels), (tid, sid, msg_type)
+    for tid, sid, msg_type, serial_msg in serial_msgs:
+        assert [msg.header for msg in parallel.records.superseded(tid, sid, msg_type)] == \
+               [msg.header for msg in serial.records.superseded(tid, sid, msg_type)]
+    assert parallel_stats.counters == serial_stats.counters
+    return parallel
+
+
+@pytest.mark.parametrize("processes", [2, 3, 7])
+def test_parallel_matches_serial(processes):
+    _assert_same(TEST_FILE, processes)
+
+
+def test_corrupt_superseded_retransmission(tmp_path):
+    ## The first (RRA) and third (original) copies of this TTAA are
+    ## superseded by the second (a later RRA), so the bad group is never
+    ## decoded when reading serially
+    filename = corrupt_copy(tmp_path, "99870 36683 08505", "99870 3A683 08505", which=[0, 2])
+    parallel = _assert_same(filename, 2)
+    current = parallel.records.get_message("130000", "72572", "TTAA")
+    assert current.header == ["USUS90", "KWBC", "130000", "RRA"]
+    assert current.levels is not None
+    assert all(msg.levels is None for msg in parallel.records.superseded("130000", "72572", "TTAA"))
+
+
+def test_corrupt_current_message(tmp_path):
+    filename = corrupt_copy(tmp_path, "99870 36683 08505", "99870 3A683 08505")
+    parallel = _assert_same(filename, 2)
+    assert parallel.records.get_message("130000", "72572", "TTAA").levels is None
@@ -0,0 +1,60 @@
+from conftest import TEST_FILE, corrupt_copy, all_messages
+from WMOParquet import export_parquet, level_columns, read_dataset
+from WMOParser import WMOReader
+from WMOStats import WMOStats
+import numpy as np
+import datetime
+import pytest
+import shutil
+
+pq = pytest.importorskip("pyarrow.parquet")
+ds = pytest.importorskip("pyarrow.dataset")
+
+
+@pytest.mark.parametrize("partition_by", [("date", "station"), ("station",), ("date",), ()])
+def test_partitioned_export_reads_back(tmp_path, partition_by):
+    filename = str(tmp_path / "20220713_00Z.uair")
+    shutil.copy(TEST_FILE, filename)
+    out_dir = str(tmp_path / "levels")
+    export_parquet([filename], out_dir, processes=1, partition_by=partition_by)
+
+    reader = WMOReader(filename)
+    reader.decode_all()
+    columns = level_columns(reader.records, datetime.date(2022, 7, 13))
+
+    ## The partition keys must not be stored in the files as well,
+    ## or the directory can't be read as one dataset
+    assert pq.read_table(out_dir).num_rows == len(columns["time"])
+    assert ds.dataset(out_dir, partitioning="hive").to_table().num_rows == len(columns["time"])
+
+    table = read_dataset(out_dir).to_table()
+    assert table.num_rows == len(columns["time"])
+    if "date" in partition_by: assert set(table.column("date").to_pylist()) == {"2022-07-13"}
+
+    ## Every row comes back, whatever order the partitions are read in
+    names = ["station", "msg_type", "code", "lvl", "hght", "tmpc", "dwpc", "wdir", "wspd", "flag"]
+    expected = _rows([columns[name].tolist() for name in names])
+    actual = _rows([table.column(name).to_pylist() for name in names])
+    assert actual == expected
+
+
+def _rows(columns):
+    ## NaN != NaN, so missing values are compared as None
+    columns = [[None if isinstance(val, float) and np.isnan(val) else val for val in col] for col in columns]
+    return sorted(zip(*columns), key=repr)
+
+
+def test_undecodable_message_is_left_out(tmp_path):
+    filename = corrupt_copy(tmp_path, "99870 36683 08505", "99870 3A683 08505")
+    dated = str(tmp_path / "20220713_00Z.uair")
+    shutil.move(filename, dated)
+    stats = WMOStats()
+    paths = export_parquet([dated], str(tmp_path / "levels"), processes=1, partition_by=(), stats=stats)
+
+    reader = WMOReader(dated)
+    failed = reader.decode_all()
+    assert len(failed) > 0
+    nlevels = sum(len(wmo_msg.levels) for tid, sid, msg_type, wmo_msg in all_messages(reader.records)
+                  if wmo_msg.levels is not None)
+    assert pq.read_table(paths[0]).num_rows == nlevels
+    assert stats.counters["levels_exported"] == nlevels
@@ -0,0 +1,16 @@
+from WMORecords import valid_time, full_time
+import datetime
+
+
+def test_day_after_ref_date_is_in_the_previous_month():
+    assert valid_time("141200", datetime.date(2022, 7, 13)) == datetime.datetime(2022, 7, 14, 12, 0)
+    assert valid_time("311200", datetime.date(2022, 8, 1)) == datetime.datetime(2022, 7, 31, 12, 0)
+    assert valid_time("311200", datetime.date(2023, 1, 1)) == datetime.datetime(2022, 12, 31, 12, 0)
+
+
+def test_days_the_previous_month_does_not_have():
+    assert valid_time("310000", datetime.date(2022, 3, 1)) is None
+    assert valid_time("300000", datetime.date(2022, 3, 2)) is None
+    assert valid_time("290000", datetime.date(2024, 3, 1)) == datetime.datetime(2024, 2, 29)
+    assert full_time("310000", datetime.date(2022, 3, 1)) == "310000"
+    assert full_time("280000", datetime.date(2022, 3, 1)) == "202202280000"
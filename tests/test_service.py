@@ -0,0 +1,72 @@
+from conftest import REPO_DIR, TEST_FILE, all_messages
+from WMOParser import WMOReader
+from WMOService import WMOIngestService
+from WMOStats import WMOStats
+import asyncio
+import os
+import subprocess
+import sys
+
+
+def _text():
+    with open(TEST_FILE, "rb") as snfile:
+        return snfile.read()
+
+
+def _ingest(data, chunk_size=1000, **kwargs):
+    async def ingest():
+        service = WMOIngestService(max_pending=4, **kwargs)
+        await service.start()
+        stream = asyncio.StreamReader()
+        for start in range(0, len(data), chunk_size): stream.feed_data(data[start:start + chunk_size])
+        stream.feed_eof()
+        await service.feed_stream(stream)
+        await service.stop()
+        return service
+    return asyncio.run(ingest())
+
+
+def _current(records):
+    return [(tid, sid, msg_type, wmo_msg.transmission_code, wmo_msg.message)
+            for tid, sid, msg_type, wmo_msg in all_messages(records)]
+
+
+def test_stream_matches_the_reader():
+    service = _ingest(_text())
+    reader = WMOReader(TEST_FILE)
+    reader.decode_all()
+    assert _current(service.reader.records) == _current(reader.records)
+    for (_, _, _, msg), (_, _, _, expected) in zip(all_messages(service.reader.records), all_messages(reader.records)):
+        assert msg.levels is not None and msg.levels.tobytes() == expected.levels.tobytes()
+    ## Superseded retransmissions aren't kept by default
+    assert service.reader.records.history == {}
+
+
+def test_piping_test_wmo_into_the_service():
+    with open(TEST_FILE, "rb") as snfile:
+        output = subprocess.run([sys.executable, os.path.join(REPO_DIR, "WMOService.py")], stdin=snfile,
+                                stdout=subprocess.PIPE, check=True, cwd=REPO_DIR).stdout.decode()
+    records = WMOReader(TEST_FILE).records
+    expected = ["Time: {time}\tStations: {nstn}\tMessages: {nmsg}".format(
+                time=tid, nstn=len(records[tid]), nmsg=sum(len(msgs) for msgs in records[tid].values()))
+                for tid in sorted(records.keys())]
+    assert output.splitlines() == expected
+
+
+def test_old_record_times_expire():
+    text = _text()
+    older = text.replace(b" 130000", b" 100000")
+    stats = WMOStats()
+    service = _ingest(older + text, retention=86400, stats=stats)
+    assert sorted(service.reader.records.keys()) == ["130000"]
+    assert stats.counters["record_times_expired"] == 1
+    assert sorted(_ingest(older + text, retention=None).reader.records.keys()) == ["100000", "130000"]
+
+
+def test_oversized_transmission_is_dropped():
+    stats = WMOStats()
+    junk = b"\x01" + b"X" * 5000
+    service = _ingest(junk + b"\x03" + _text() + junk, max_transmission=4096, stats=stats)
+    assert service.ndropped == 2
+    assert stats.counters["transmissions_dropped"] == 2
+    assert _current(service.reader.records) == _current(WMOReader(TEST_FILE).records)
@@ -0,0 +1,36 @@
+from conftest import TEST_FILE, corrupt_copy
+from WMOIngest import ingest_files
+from WMOParser import WMOReader
+from WMOStats import WMOStats
+from WMOStore import WMOLevelStore
+import datetime
+import shutil
+
+REF_DATE = datetime.date(2022, 7, 13)
+
+
+def test_adding_a_file_again_adds_nothing(tmp_path):
+    store = WMOLevelStore(str(tmp_path / "store"))
+    assert store.add_reader(WMOReader(TEST_FILE), REF_DATE) > 0
+    assert store.add_reader(WMOReader(TEST_FILE), REF_DATE) == 0
+
+
+def test_changed_levels_with_the_same_code_are_added(tmp_path):
+    store = WMOLevelStore(str(tmp_path / "store"))
+    store.add_reader(WMOReader(TEST_FILE), REF_DATE)
+    ## Same time, type, code and number of levels, different temperature
+    changed = corrupt_copy(tmp_path, "99870 36683 08505", "99870 34683 08505")
+    assert store.add_reader(WMOReader(changed), REF_DATE) >= 1
+
+
+def test_undecodable_message_is_left_out(tmp_path):
+    filename = corrupt_copy(tmp_path, "99870 36683 08505", "99870 3A683 08505")
+    dated = str(tmp_path / "20220713_00Z.uair")
+    shutil.move(filename, dated)
+    stats = WMOStats()
+    ingest_files([dated], processes=1, store_dir=str(tmp_path / "store"), stats=stats)
+
+    good = WMOLevelStore(str(tmp_path / "good"))
+    nadded = good.add_reader(WMOReader(TEST_FILE), REF_DATE)
+    assert stats.counters["messages_not_stored"] > 0
+    assert stats.counters["messages_stored"] == nadded - stats.counters["messages_not_stored"]
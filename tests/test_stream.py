@@ -0,0 +1,21 @@
+from conftest import TEST_FILE, corrupt_copy, all_messages
+from WMOParser import WMOReader
+from WMOStats import WMOStats
+
+
+def test_stream_yields_every_message():
+    streamed = list(WMOReader(TEST_FILE, stream=True).iter_messages(decode=False))
+    reader = WMOReader(TEST_FILE)
+    nmessages = sum(1 + len(reader.records.superseded(tid, sid, msg_type))
+                    for tid, sid, msg_type, wmo_msg in all_messages(reader.records))
+    assert len(streamed) == nmessages
+
+
+def test_bad_message_does_not_end_the_stream(tmp_path):
+    filename = corrupt_copy(tmp_path, "99870 36683 08505", "99870 3A683 08505")
+    stats = WMOStats()
+    streamed = list(WMOReader(filename, stream=True, stats=stats).iter_messages())
+    assert len(streamed) == len(list(WMOReader(TEST_FILE, stream=True).iter_messages(decode=False)))
+    failed = [wmo_msg for wmo_msg in streamed if wmo_msg.levels is None]
+    assert len(failed) > 0
+    assert sum(num for name, num in stats.counters.items() if name.startswith("decode_failures")) == len(failed)
@@ -0,0 +1,34 @@
+from conftest import TEST_FILE
+from WMOData import WMOSounding
+from WMOParser import WMOReader
+from WMOStats import WMOStats
+from WMOThermo import precipitable_water, batch_from_reader, thermo_batch
+import numpy as np
+
+
+def test_precipitable_water_skips_levels_without_dewpoint():
+    pres = np.array([[1000.0, 850.0, 700.0, 500.0]])
+    dwpc = np.array([[20.0, 10.0, 0.0, -20.0]])
+    gappy = np.array([[1000.0, 925.0, 850.0, 800.0, 700.0, 500.0]])
+    gappy_dwpc = np.array([[20.0, np.nan, 10.0, np.nan, 0.0, -20.0]])
+
+    pw = precipitable_water(pres, dwpc)
+    assert pw[0] > 0
+    assert np.allclose(precipitable_water(gappy, gappy_dwpc), pw)
+
+
+def test_batch_skips_soundings_that_cannot_be_assembled(monkeypatch):
+    reader = WMOReader(TEST_FILE, stats=WMOStats())
+    good_keys, good = batch_from_reader(WMOReader(TEST_FILE))
+    bad_key = good_keys[0]
+    assemble = WMOSounding.assemble
+
+    def broken(sounding, *args, **kwargs):
+        if (sounding.time_str, sounding.wmo_id) == bad_key: raise ValueError("bad sounding")
+        return assemble(sounding, *args, **kwargs)
+
+    monkeypatch.setattr(WMOSounding, "assemble", broken)
+    keys, batch = batch_from_reader(reader)
+    assert keys == good_keys[1:]
+    assert reader.stats.counters["soundings_failed"] == 1
+    assert len(thermo_batch(batch)["cape"]) == len(keys)
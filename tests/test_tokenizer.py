@@ -0,0 +1,64 @@
+from conftest import TEST_FILE
+from WMOTokenizer import HEADERS, NIL_REPORTS, tokenize, tokenize_message
+import pytest
+
+IGNORE = ["", "\n\n\n", "\n\n", "\n"]
+
+
+def _legacy_messages(text):
+    """
+    The multi-split formatter the tokenizer replaced: split into
+    transmissions on '\\x03', messages on '=', then lines and groups.
+    """
+    out = []
+    for transmission in text.replace("\r", "").replace("\x01", "").split("\x03"):
+        if transmission in IGNORE: continue
+        messages = [msg for msg in transmission.split("=") if msg not in IGNORE]
+        header = None
+        for midx, message in enumerate(messages):
+            message = [line for line in message.split("\n") if line not in IGNORE]
+            if len(message) == 1: message = message[0].split(" ")
+            if midx == 0:
+                header = message[1].split(" ")
+                message = message[2:]
+            start = [n for n in range(len(message)) for head in HEADERS if head in message[n]]
+            message = message[start[0] if len(start) > 0 else 0:]
+            groups = [group for line in message for group in line.split(" ") if group not in IGNORE]
+            start = [n for n in range(len(groups)) for head in HEADERS if head in groups[n]]
+            groups = groups[start[0] if len(start) > 0 else 0:]
+            if len(groups) == 0: continue
+            for nil in ["NIL", "NILL", "XMTD"]:
+                if nil in groups: groups.pop(groups.index(nil))
+                elif nil.lower() in groups: groups.pop(groups.index(nil.lower()))
+            if len(groups) <= 2: continue
+            if groups[0].upper() in NIL_REPORTS or groups[1].upper() in NIL_REPORTS: continue
+            out.append((header, groups))
+    return out
+
+
+def _read():
+    with open(TEST_FILE, "r", newline="") as snfile:
+        return snfile.read()
+
+
+def test_tokenizer_matches_the_legacy_formatter():
+    text = _read()
+    tokens = [(header, groups) for header, msg_type, groups, start, end in tokenize(text)]
+    assert len(tokens) > 0
+    assert tokens == _legacy_messages(text)
+
+
+@pytest.mark.parametrize("text", [
+    "\x01\r\r\n123\r\r\nUSUS50 KWBC 130000\r\r\nTTAA 63001 72572 99870 36683 08505=\r\r\n\x03",
+    "\x01\n123\nUSUS50 KWBC 130000 RRA\nTTAA 63001 72572 99870 36683\n08505 00005=\nTTBB 6300/ 72572 NIL=\n\x03",
+    "\x01\n123\nUSUS50 KWBC 130000\nPPBB 63008 72572 90012 27005 29007 29009=\n\n\x03\x01\n124\nUSUS50 KWBC 130000\nTTBB 6300/ 72403 00004 26241=",
+])
+def test_tokenizer_matches_the_legacy_formatter_on_edge_cases(text):
+    tokens = [(header, groups) for header, msg_type, groups, start, end in tokenize(text)]
+    assert tokens == _legacy_messages(text)
+
+
+def test_offsets_tokenize_again_on_their_own():
+    text = _read()
+    for header, msg_type, groups, start, end in tokenize(text):
+        assert tokenize_message(text[start:end]) == groups